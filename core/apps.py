@@ -36,10 +36,18 @@ class CoreConfig(AppConfig):
         except Exception as e:
             logger.exception("Fallo init_db() en AppConfig.ready(): %s", e)
 
-        # 3) Arranca scheduler y bootstrap paralelo (idempotentes)
+        # 2b) Mapa tienda -> almacenes en memoria (api_stock no consulta SQLite por request)
         try:
-            from .scheduler import start_scheduler_and_jobs, bootstrap_parallel
-            start_scheduler_and_jobs()   # cron jobs
-            bootstrap_parallel()         # primera carga paralela
+            from services.database import cargar_grupos_cumplimiento
+            cargar_grupos_cumplimiento()
+        except Exception as e:
+            logger.exception("Fallo cargando grupos de cumplimiento en memoria: %s", e)
+
+        # 3) Elección de líder: solo un proceso corre cron jobs + bootstrap paralelo;
+        #    el resto consume los Parquet/snapshots que ese proceso publica
+        try:
+            from .liderazgo import iniciar_eleccion_lider
+            from .scheduler import activar_como_lider, pausar_como_seguidor
+            iniciar_eleccion_lider(activar_como_lider, pausar_como_seguidor)
         except Exception as e:
             logger.exception("Fallo arrancando scheduler/bootstrap: %s", e)
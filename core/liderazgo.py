@@ -0,0 +1,157 @@
+# core/liderazgo.py
+"""
+Elección de líder entre procesos para el scheduler (APScheduler + bootstrap).
+
+Con varios workers WSGI cada proceso pasaba por ``CoreConfig.ready()`` y todos
+descargaban los mismos Parquet y consultaban Fabric a la vez. Ahora los procesos
+compiten por un *lease* en SQLite (tabla ``scheduler_lease``):
+
+- el lease vive en su propio archivo (``SCHEDULER_LEASE_DB``), no en la base que
+  la cola de escritura retiene durante cargas masivas: el heartbeat no compite
+  con los escritores;
+- el dueño renueva el lease cada ``TTL / 3`` segundos (heartbeat);
+- si el dueño muere o deja de renovar, el lease vence y otro proceso lo toma;
+- el dueño se considera líder solo hasta ``SCHEDULER_LEASE_MARGEN`` segundos
+  antes del vencimiento que escribió: pasado eso, los jobs en curso ya no pueden
+  publicar (``services.guarda_publicacion``) aunque el heartbeat esté trabado;
+- el resto de los procesos solo consume los Parquet/snapshots publicados.
+
+Se usa SQLite (y no flock) porque funciona igual en Linux y en Windows.
+"""
+import atexit
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from services.database import SQLITE_DB_PATH
+from services.guarda_publicacion import registrar_guarda
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+LEASE_NOMBRE = "scheduler"
+LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
+# Antes del vencimiento el líder deja de publicar (holgura para el último swap en curso)
+LEASE_MARGEN = float(os.getenv("SCHEDULER_LEASE_MARGEN", "5"))
+LEASE_DB = os.getenv("SCHEDULER_LEASE_DB", SQLITE_DB_PATH + ".lease")
+
+
+def _conectar() -> sqlite3.Connection:
+    conexion = sqlite3.connect(LEASE_DB, timeout=5, isolation_level=None)
+    conexion.execute("PRAGMA journal_mode=WAL;")
+    conexion.execute(
+        "CREATE TABLE IF NOT EXISTS scheduler_lease ("
+        "nombre TEXT PRIMARY KEY, owner TEXT NOT NULL, expira REAL NOT NULL, heartbeat REAL NOT NULL)"
+    )
+    return conexion
+
+
+class LeaseScheduler:
+    """Lease renovable: ``intentar()`` adquiere o renueva; devuelve si este proceso es líder."""
+
+    def __init__(self, nombre: str = LEASE_NOMBRE, ttl: float = LEASE_TTL):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Vencimiento del último lease que escribimos (0: no somos líderes)
+        self._expira = 0.0
+
+    def vigente(self) -> bool:
+        """Si este proceso sigue siendo líder según su propio reloj (sin tocar SQLite)."""
+        return time.time() < self._expira - LEASE_MARGEN
+
+    def intentar(self) -> bool:
+        ahora = time.time()
+        conexion = _conectar()
+        try:
+            # BEGIN IMMEDIATE toma el lock de escritura: lectura + escritura atómicas entre procesos
+            conexion.execute("BEGIN IMMEDIATE")
+            fila = conexion.execute(
+                "SELECT owner, expira FROM scheduler_lease WHERE nombre = ?", (self.nombre,)
+            ).fetchone()
+            if fila is not None and fila[0] != self.owner and fila[1] > ahora:
+                conexion.execute("ROLLBACK")
+                self._expira = 0.0
+                return False
+            conexion.execute(
+                "INSERT INTO scheduler_lease (nombre, owner, expira, heartbeat) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(nombre) DO UPDATE SET owner = excluded.owner, expira = excluded.expira, "
+                "heartbeat = excluded.heartbeat",
+                (self.nombre, self.owner, ahora + self.ttl, ahora),
+            )
+            conexion.execute("COMMIT")
+            self._expira = ahora + self.ttl
+            if fila is not None and fila[0] != self.owner:
+                logger.warning(f"Lease {self.nombre} tomado de {fila[0]} (vencido)")
+            return True
+        except sqlite3.Error:
+            logger.exception(f"No se pudo adquirir/renovar el lease {self.nombre}")
+            try:
+                conexion.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            return False
+        finally:
+            conexion.close()
+
+    def liberar(self):
+        """Borra el lease si es nuestro (salida ordenada: otro proceso toma el relevo enseguida)."""
+        self._expira = 0.0
+        try:
+            conexion = _conectar()
+            try:
+                conexion.execute("DELETE FROM scheduler_lease WHERE nombre = ? AND owner = ?",
+                                 (self.nombre, self.owner))
+            finally:
+                conexion.close()
+        except sqlite3.Error:
+            logger.exception(f"No se pudo liberar el lease {self.nombre}")
+
+
+_hilo: Optional[threading.Thread] = None
+
+
+def iniciar_eleccion_lider(on_elegido: Callable[[], None], on_depuesto: Callable[[], None]) -> threading.Thread:
+    """Lanza (una vez por proceso) el hilo de heartbeat/elección.
+
+    ``on_elegido`` se ejecuta en un hilo aparte cada vez que el proceso pasa a ser
+    líder (así un bootstrap largo no frena el heartbeat); ``on_depuesto`` cuando
+    pierde el lease. Los jobs que sigan corriendo tras perderlo quedan frenados por
+    la guarda de publicación.
+    """
+    global _hilo
+    if _hilo is not None:
+        return _hilo
+
+    lease = LeaseScheduler()
+    intervalo = max(lease.ttl / 3.0, 1.0)
+
+    def _bucle():
+        lider = False
+        while True:
+            es_lider = lease.intentar()
+            if lider and not es_lider and lease.vigente():
+                # Fallo transitorio al renovar: seguimos siendo líderes hasta el vencimiento
+                es_lider = True
+            if es_lider and not lider:
+                logger.info(f"Proceso {lease.owner} elegido líder del scheduler")
+                threading.Thread(target=on_elegido, name="scheduler-lider", daemon=True).start()
+            elif lider and not es_lider:
+                logger.warning(f"Proceso {lease.owner} perdió el liderazgo del scheduler")
+                try:
+                    on_depuesto()
+                except Exception:
+                    logger.exception("Fallo al detener jobs tras perder el liderazgo")
+            lider = es_lider
+            time.sleep(intervalo)
+
+    registrar_guarda(lease.vigente)
+    atexit.register(lease.liberar)
+    _hilo = threading.Thread(target=_bucle, name="scheduler-lease", daemon=True)
+    _hilo.start()
+    logger.info(f"Elección de líder iniciada ({lease.owner}, TTL {lease.ttl:.0f}s)")
+    return _hilo
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from services.database import DB_PATHS_LEGACY, SQLITE_DB_PATH, init_db, migrar_bases_legacy
+
+
+class Command(BaseCommand):
+    help = "Migra las bases SQLite por dominio (atributos.db, stock.db, ...) a la base única"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conservar', action='store_true',
+                            help='No renombrar los archivos migrados a *.db.migrado')
+
+    def handle(self, *args, **opts):
+        init_db()
+        resumen = migrar_bases_legacy(renombrar=not opts['conservar'])
+        if not resumen:
+            self.stdout.write(f"Nada para migrar (origen: {len(DB_PATHS_LEGACY)} bases por dominio).")
+            return
+        for tabla, filas in sorted(resumen.items()):
+            self.stdout.write(f"  {tabla}: {filas} filas")
+        self.stdout.write(self.style.SUCCESS(f"Migración completa en {SQLITE_DB_PATH}"))
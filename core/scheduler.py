@@ -2,6 +2,7 @@
 import os
 import sys
 import time
+import threading
 from typing import Optional, Dict, Tuple
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -12,15 +13,15 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor as APS_ThreadPoolExecutor
 from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.schedulers.base import STATE_PAUSED
 
 # Actualizadores de caché (escritura de archivos Parquet)
 from services.caching import (
     actualizar_cache_productos,
     actualizar_cache_clientes,
-    actualizar_cache_stock,
     actualizar_cache_empleados,
-    actualizar_cache_atributos,
     actualizar_cache_codigos_postales,
+    registrar_listener_cambios_productos,
 )
 
 # ETLs / lecturas desde Fabric
@@ -32,8 +33,8 @@ from services.fabric import (
     obtener_grupos_cumplimiento_fabric,
 )
 
-from services.get_token import get_access_token_d365, TokenRetrievalError
-from services.database import guardar_token_d365
+from services.token_d365 import gestor_token_d365
+from services.presupuestos_outbox import reanudar_presupuestos_pendientes
 from services.email_service import enviar_correo_fallo
 
 # Rutas de archivos Parquet
@@ -45,7 +46,17 @@ from services.config import (
     CACHE_FILE_CODIGOS_POSTALES,
 )
 
-import pyarrow.parquet as pq
+from services.registro_tablas import obtener_tabla, obtener_tabla_con_version, metricas_tablas, registrar_orden_snapshot
+from services.pool_sqlite import metricas_pool
+from services.cola_escritura import metricas_escritura
+from services.indice_productos import CatalogoIndex, ordenar_catalogo
+from services.indice_clientes import IndiceClientes
+from services.busqueda_productos import IndiceBusquedaProductos
+from services.indice_stock import IndiceStock, ordenar_stock
+from services.indice_atributos import IndiceAtributos, ordenar_atributos
+from services.payload_productos import invalidar_payloads_productos
+from services.changelog_productos import registrar_cambios_productos
+from services.guarda_publicacion import PublicacionRechazada, puede_publicar
 from services.logging_utils import get_module_logger
 
 logger = get_module_logger(__name__)
@@ -98,39 +109,93 @@ def job_listener(event):
 scheduler.add_listener(job_listener, EVENT_JOB_ERROR | EVENT_JOB_EXECUTED)
 
 # =============================================================================
-# Lectura de Parquet con caché en memoria (evita recargas innecesarias)
+# Lectura de Parquet: registro compartido del proceso (services.registro_tablas)
 # =============================================================================
-# cache: ruta -> (mtime, pyarrow.Table)
-_PARQUET_CACHE: Dict[str, Tuple[float, "pyarrow.Table"]] = {}
-
 def _load_parquet_cached(path: str):
-    """Lee un Parquet con caché en memoria según mtime. Devuelve pyarrow.Table o None."""
+    """Lee un Parquet a través del registro compartido (mtime + LRU). Devuelve pyarrow.Table o None."""
     try:
-        if not os.path.exists(path):
-            return None
-        mtime = os.path.getmtime(path)
-        cached = _PARQUET_CACHE.get(path)
-        if cached and cached[0] == mtime:
-            return cached[1]
-        tbl = pq.read_table(path)
-        _PARQUET_CACHE[path] = (mtime, tbl)
-        return tbl
+        return obtener_tabla(path)
+    except Exception:
+        logger.exception(f"No se pudo leer Parquet: {path}")
+        return None
+
+# Estructuras derivadas (índices) de cada Parquet: (ruta, nombre) -> (mtime, objeto)
+_DERIVADOS_CACHE: Dict[Tuple[str, str], Tuple[float, object]] = {}
+_DERIVADOS_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+
+# Snapshots escritos en el orden de su índice: los índices usan la tabla mapeada sin copiarla
+registrar_orden_snapshot(CACHE_FILE_PRODUCTOS, ordenar_catalogo)
+registrar_orden_snapshot(CACHE_FILE_STOCK, ordenar_stock)
+registrar_orden_snapshot(CACHE_FILE_ATRIBUTOS, ordenar_atributos)
+
+def _load_derivado_cached(path: str, nombre: str, builder):
+    """Devuelve ``builder(tabla, mtime)`` reconstruyéndolo solo cuando cambia el mtime del Parquet."""
+    try:
+        res = obtener_tabla_con_version(path)
     except Exception:
         logger.exception(f"No se pudo leer Parquet: {path}")
         return None
+    if res is None:
+        return None
+    mtime, tbl = res
+    key = (path, nombre)
+    cached = _DERIVADOS_CACHE.get(key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    lock = _DERIVADOS_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        cached = _DERIVADOS_CACHE.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            t0 = time.perf_counter()
+            obj = builder(tbl, mtime)
+            logger.info(f"Índice {nombre} construido en {time.perf_counter()-t0:0.2f}s")
+        except Exception:
+            logger.exception(f"No se pudo construir índice {nombre} para {path}")
+            return None
+        _DERIVADOS_CACHE[key] = (mtime, obj)
+        return obj
 
 def load_parquet_productos():
     return _load_parquet_cached(CACHE_FILE_PRODUCTOS)
 
+def load_catalogo_index():
+    """Índice del catálogo (columnas canónicas, partición por tienda, mapa por código)."""
+    return _load_derivado_cached(CACHE_FILE_PRODUCTOS, "catalogo", CatalogoIndex)
+
+def _construir_busqueda_productos(tabla, mtime):
+    # Reutiliza el índice del catálogo de la misma versión (si ya está construido)
+    catalogo = load_catalogo_index()
+    if catalogo is None or catalogo.version != mtime:
+        catalogo = CatalogoIndex(tabla, mtime)
+    return IndiceBusquedaProductos(catalogo)
+
+def load_busqueda_productos_index():
+    """Índice de texto completo del catálogo (términos sin acentos, prefijos y errores de tipeo)."""
+    return _load_derivado_cached(CACHE_FILE_PRODUCTOS, "busqueda_productos", _construir_busqueda_productos)
+
 def load_parquet_clientes():
     return _load_parquet_cached(CACHE_FILE_CLIENTES)
 
+def load_clientes_index():
+    """Índice de búsqueda de clientes (prefijos + trigramas sobre nif/número/nombre)."""
+    return _load_derivado_cached(CACHE_FILE_CLIENTES, "busqueda_clientes", IndiceClientes)
+
 def load_parquet_stock():
     return _load_parquet_cached(CACHE_FILE_STOCK)
 
+def load_stock_index():
+    """Índice de stock por código exacto con rango de filas por código (almacenes ordenados)."""
+    return _load_derivado_cached(CACHE_FILE_STOCK, "stock", IndiceStock)
+
 def load_parquet_atributos():
     return _load_parquet_cached(CACHE_FILE_ATRIBUTOS)
 
+def load_atributos_index():
+    """Atributos agrupados por producto (tabla ordenada + rango de filas por producto)."""
+    return _load_derivado_cached(CACHE_FILE_ATRIBUTOS, "atributos", IndiceAtributos)
+
 def load_parquet_codigos_postales():
     return _load_parquet_cached(CACHE_FILE_CODIGOS_POSTALES)
 
@@ -143,10 +208,15 @@ def obtener_productos_cache():
 # =============================================================================
 def _run_step(nombre: str, fn, *args, **kwargs):
     """Ejecuta una función simple con logging y aviso por correo en error."""
+    if not puede_publicar():
+        logger.info(f"{nombre} omitido: el proceso ya no es líder")
+        return
     t0 = time.perf_counter()
     try:
         fn(*args, **kwargs)
         logger.info(f"{OK} {nombre} OK en {time.perf_counter()-t0:0.2f}s")
+    except PublicacionRechazada as e:
+        logger.warning(f"{nombre} interrumpido sin publicar: {e}")
     except Exception as e:
         logger.error(f"{FAIL} {nombre} falló: {e}", exc_info=True)
         try:
@@ -163,8 +233,13 @@ def _run_step_chain(nombre: str, *fn_chain):
     t0 = time.perf_counter()
     try:
         for fn in fn_chain:
+            if not puede_publicar():
+                logger.info(f"{nombre} omitido: el proceso ya no es líder")
+                return
             fn()
         logger.info(f"{OK} {nombre} OK en {time.perf_counter()-t0:0.2f}s")
+    except PublicacionRechazada as e:
+        logger.warning(f"{nombre} interrumpido sin publicar: {e}")
     except Exception as e:
         logger.error(f"{FAIL} {nombre} falló: {e}", exc_info=True)
         try:
@@ -173,18 +248,40 @@ def _run_step_chain(nombre: str, *fn_chain):
             logger.exception("Fallo enviando correo de error")
 
 
+# Cada refresco con cambios alimenta el change log de /api/productos/changes
+registrar_listener_cambios_productos(registrar_cambios_productos)
+
+
+def actualizar_productos():
+    """Job `productos`: descarga el Parquet si cambió, descarta los payloads serializados y precalienta los índices."""
+    if actualizar_cache_productos() is not None:
+        invalidar_payloads_productos()
+    load_catalogo_index()
+    load_busqueda_productos_index()
+
+
+def actualizar_clientes():
+    """Job `clientes`: descarga el Parquet si cambió y reconstruye el índice de búsqueda."""
+    actualizar_cache_clientes()
+    load_clientes_index()
+
+
+def actualizar_stock():
+    """Job `stock_fabric`: extrae stock a SQLite + Parquet y reconstruye el índice por código."""
+    obtener_stock_fabric()
+    load_stock_index()
+
+
+def actualizar_atributos():
+    """Job `atributos_fabric`: extrae atributos a SQLite + Parquet y reconstruye el índice por producto."""
+    obtener_atributos_fabric()
+    load_atributos_index()
+
+
 def actualizar_token_d365():
-    """Obtiene y persiste el token D365."""
-    try:
-        token = get_access_token_d365()
-    except TokenRetrievalError as exc:
-        logger.error(f"{FAIL} get_access_token_d365 falló: {exc}")
-        return
-    if not token:
+    """Renueva el token D365 si está por vencer (se comparte con los demás procesos vía SQLite)."""
+    if not gestor_token_d365.obtener():
         logger.error(f"{FAIL} No se pudo obtener token D365")
-        return
-    guardar_token_d365(token)
-    logger.info("Token D365 actualizado por bootstrap/cron.")
 
 # =============================================================================
 # Bootstrap paralelo (primera vez)
@@ -203,14 +300,15 @@ def bootstrap_parallel(max_workers: Optional[int] = None):
 
     # Trabajos independientes + cadenas con dependencias
     jobs = [
-        ("parquet_productos",           _run_step,        actualizar_cache_productos),
-        ("parquet_clientes",            _run_step,        actualizar_cache_clientes),
+        ("parquet_productos",           _run_step,        actualizar_productos),
+        ("parquet_clientes",            _run_step,        actualizar_clientes),
         ("datos_tiendas",               _run_step,        obtener_datos_tiendas),
         ("grupos_cumplimiento",         _run_step,        obtener_grupos_cumplimiento_fabric),
         ("token_d365",                  _run_step,        actualizar_token_d365),
 
-        ("stock + cache_stock",         _run_step_chain,  obtener_stock_fabric,       actualizar_cache_stock),
-        ("atributos + cache_atributos", _run_step_chain,  obtener_atributos_fabric,   actualizar_cache_atributos),
+        # La extracción en lotes escribe SQLite y el Parquet en la misma pasada
+        ("stock + cache_stock",         _run_step,        actualizar_stock),
+        ("atributos + cache_atributos", _run_step,        actualizar_atributos),
         ("empleados + cache_empleados", _run_step_chain,  obtener_empleados_fabric,   actualizar_cache_empleados),
         ("codigos_postales + cache",    _run_step,        actualizar_cache_codigos_postales),
     ]
@@ -242,26 +340,31 @@ def start_scheduler_and_jobs():
     logger.info("Iniciando scheduler/background jobs...")
 
     # Keep-alive
-    scheduler.add_job(lambda: logger.info("Scheduler vivo"),
+    scheduler.add_job(lambda: logger.info(f"Scheduler vivo | Parquet en memoria: {metricas_tablas()} "
+                                          f"| Pool SQLite: {metricas_pool()} "
+                                          f"| Cola escritura: {metricas_escritura()}"),
                       CronTrigger(minute="*/5"), id="alive")
 
     # Token
     scheduler.add_job(actualizar_token_d365,
-                      CronTrigger(minute="*/10"), id="token_d365")
+                      CronTrigger(minute="*/5"), id="token_d365")
+
+    # Presupuestos D365 encolados que quedaron a medias (reinicio / proceso caído)
+    scheduler.add_job(reanudar_presupuestos_pendientes,
+                      CronTrigger(minute="*"), id="presupuestos_outbox")
 
     # Cachés “simples”
-    scheduler.add_job(actualizar_cache_clientes,
+    scheduler.add_job(actualizar_clientes,
                       CronTrigger(minute="*/14"), id="clientes")
-    scheduler.add_job(actualizar_cache_productos,
+    scheduler.add_job(actualizar_productos,
                       CronTrigger(minute="*/20"), id="productos")
 
     # Con dependencias (cadenas)
-    scheduler.add_job(lambda: _run_step_chain("stock_fabric",
-                                              obtener_stock_fabric, actualizar_cache_stock),
+    # (obtener_*_fabric escriben SQLite + Parquet en streaming)
+    scheduler.add_job(lambda: _run_step("stock_fabric", actualizar_stock),
                       CronTrigger(minute="*/20"), id="stock_fabric")
 
-    scheduler.add_job(lambda: _run_step_chain("atributos_fabric",
-                                              obtener_atributos_fabric, actualizar_cache_atributos),
+    scheduler.add_job(lambda: _run_step("atributos_fabric", actualizar_atributos),
                       CronTrigger(minute="*/30"), id="atributos_fabric")
 
     # Diaria (empleados)
@@ -288,3 +391,27 @@ def start_scheduler_and_jobs():
 
     for job in scheduler.get_jobs():
         logger.info(f"Job: {job.id} | Next: {job.next_run_time} | Trigger: {job.trigger}")
+
+
+# =============================================================================
+# Liderazgo (core.liderazgo): solo el proceso líder corre jobs y bootstrap
+# =============================================================================
+def activar_como_lider():
+    """Callback de elección: arranca (o reanuda) el scheduler y la carga inicial."""
+    if scheduler.state == STATE_PAUSED:
+        scheduler.resume()
+        logger.info("Scheduler reanudado (proceso líder).")
+        return
+    start_scheduler_and_jobs()
+    bootstrap_parallel()
+
+
+def pausar_como_seguidor():
+    """Callback al perder el lease: deja de disparar jobs.
+
+    Los que ya corren no se pueden matar, pero la guarda de publicación
+    (``LeaseScheduler.vigente``) les impide publicar tablas, Parquet o snapshots.
+    """
+    if scheduler.running:
+        scheduler.pause()
+        logger.info("Scheduler pausado (proceso seguidor).")
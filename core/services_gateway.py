@@ -1,9 +1,11 @@
 from pathlib import Path
 from django.conf import settings
 import os, time
-import pyarrow.parquet as pq
 import pyarrow.compute as pc
 
+from services.indice_productos import renombrar_columnas_productos
+from services.registro_tablas import obtener_tabla
+
 # Usamos tu config.py existente para ruta de productos
 try:
     from services.config import CACHE_FILE_PRODUCTOS
@@ -15,11 +17,10 @@ def parquet_path():
 
 def productos_listar(store: str|None=None, page:int=1, items_per_page:int=20000):
     """Lee el parquet y devuelve una lista de dicts compatible con tu front."""
-    path = parquet_path()
-    if not os.path.exists(path):
+    table = obtener_tabla(parquet_path())
+    if table is None:
         return []
-
-    table = pq.read_table(path)
+    table = renombrar_columnas_productos(table)
 
     # Filtro por tienda si viene
     if store:
@@ -51,11 +52,13 @@ def productos_last_modified():
     return int(os.path.getmtime(path))
 
 def stock_por_codigo_y_grupo(codigo: str, store: str):
-    """Usa tu DB local de stock + grupos de cumplimiento para filtrar por almacenes."""
-    from services.database import obtener_grupos_cumplimiento, obtener_stock
-    almacenes_permitidos = set(obtener_grupos_cumplimiento(store))
-    data = obtener_stock()
-    # Filtramos por código + almacenes del grupo
-    result = [s for s in data if s.get('codigo') == str(codigo) and s.get('almacen_365') in almacenes_permitidos]
+    """Stock del código en los almacenes del grupo de cumplimiento de la tienda (índice por código)."""
+    from core.scheduler import load_stock_index
+    from services.database import obtener_grupos_cumplimiento
+    from services.extraccion_lotes import decimales_a_float
+    almacenes_permitidos = obtener_grupos_cumplimiento(store) or []
+    index = load_stock_index()
+    if index is None or not almacenes_permitidos:
+        return []
     # Si no hay nada, devolvemos 404 desde la view
-    return result
+    return decimales_a_float(index.buscar(codigo, almacenes_permitidos)).to_pylist()
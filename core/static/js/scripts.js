@@ -127,15 +127,57 @@ function getLastStore() {
     return 'BA001GC';
 }
 
+/**
+ * Aplica sobre `products` solo lo que cambio desde `since` (/api/productos/changes).
+ * Devuelve false si el servidor pide resincronizacion total.
+ */
+async function applyProductChanges(storeId, since) {
+    const data = await fetchWithAuth(`/api/productos/changes?since=${since}&store=${encodeURIComponent(storeId)}`);
+    if (!data || data.error || data.full_resync) {
+        return false;
+    }
+    const cambios = (data.stores || {})[storeId];
+    if (cambios) {
+        const normalizar = product => ({
+            ...product,
+            nombre_producto_normalizado: normalizeText(product["nombre_producto"] || ""),
+            grupo_cobertura_normalizado: normalizeText(product["grupo_cobertura"] || "")
+        });
+        const eliminados = new Set(cambios.deleted || []);
+        const actualizados = new Map((cambios.updated || []).map(p => [p.numero_producto, normalizar(p)]));
+        products = products
+            .filter(p => !eliminados.has(p.numero_producto))
+            .map(p => {
+                const nuevo = actualizados.get(p.numero_producto);
+                actualizados.delete(p.numero_producto);
+                return nuevo || p;
+            })
+            .concat([...actualizados.values()], (cambios.inserted || []).map(normalizar));
+
+        const catEl = document.getElementById("categoryFilter");
+        const covEl = document.getElementById("coverageGroupFilter");
+        const previousCategory = catEl ? catEl.value : "";
+        const previousCoverage = covEl ? covEl.value : "";
+        initializeFilters(previousCategory, previousCoverage ? normalizeText(previousCoverage) : "");
+        filterAndPaginate(false, false);
+        updateCartPrices(storeId);
+    }
+    lastProductsUpdate = data.version;
+    return true;
+}
+
 async function checkProductsUpdate() {
     try {
         const data = await fetchWithAuth('/api/check_products_update');
         const newLastModified = data.last_modified;
 
         if (newLastModified > lastProductsUpdate) {
-            lastProductsUpdate = newLastModified;
             const storeId = document.getElementById("storeFilter").value || getLastStore();
-            await loadProducts(storeId, 1, 20000, false, false);
+            // Primero se intenta el delta; si el servidor pide resync se baja el catalogo completo
+            if (!lastProductsUpdate || !(await applyProductChanges(storeId, lastProductsUpdate))) {
+                lastProductsUpdate = newLastModified;
+                await loadProducts(storeId, 1, 20000, false, false);
+            }
         }
     } catch (error) {
         console.error("Error al verificar actualizaciÃ³n de productos:", error);
@@ -2264,6 +2306,8 @@ function showClientDetailsModal() {
 
 // Variable global para almacenar el nÃºmero del presupuesto
 let lastQuotationNumber = null;
+// Clave de idempotencia del presupuesto en curso (se reutiliza si se reintenta el envio)
+let quotationIdempotencyKey = null;
 
 // Mostrar modal de selecciÃ³n de tipo
 function showQuotationTypeModal() {
@@ -2316,16 +2360,21 @@ async function createInD365WithType(tipo_presupuesto) {
                 body: JSON.stringify(payload)
             });
         } else {
-            // Crear nuevo presupuesto en D365
+            // Crear nuevo presupuesto en D365 (se encola; la misma clave evita duplicados al reintentar)
+            if (!quotationIdempotencyKey) quotationIdempotencyKey = crypto.randomUUID();
             response = await fetch('/api/create_quotation', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': quotationIdempotencyKey },
                 body: JSON.stringify(payload)
             });
         }
 
-        const result = await response.json();
+        let result = await response.json();
         if (!response.ok) throw new Error(result.error || "Error al procesar el presupuesto");
+        if (response.status === 202) {
+            result = await waitQuotationJob(result);
+            quotationIdempotencyKey = null;
+        }
 
         lastQuotationNumber = result.quotation_number;
         toggleCart();
@@ -2342,6 +2391,26 @@ async function createInD365WithType(tipo_presupuesto) {
     }
 }
 
+// Consultar el estado del presupuesto encolado hasta que termine
+async function waitQuotationJob(job, timeoutMs = 300000) {
+    const start = Date.now();
+    while (!job.done) {
+        if (Date.now() - start > timeoutMs) {
+            throw new Error(`El presupuesto ${job.reference} sigue en proceso; revise en unos minutos`);
+        }
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        const response = await fetch(job.status_url || `/api/quotation_jobs/${job.job_id}`);
+        const status = await response.json();
+        if (!response.ok) throw new Error(status.error || "Error al consultar el presupuesto");
+        job = { ...job, ...status };
+    }
+    if (job.status === 'error') {
+        quotationIdempotencyKey = null;  // el proximo envio es un presupuesto nuevo
+        throw new Error(job.error || "Error al crear el presupuesto");
+    }
+    return job;
+}
+
 // Mostrar modal de confirmaciÃ³n de impresiÃ³n
 function showPrintConfirmationModal(quotationNumber, tipo) {
     const modal = new bootstrap.Modal(document.getElementById('printConfirmationModal'));
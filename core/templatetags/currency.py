@@ -1,5 +1,7 @@
 from django import template
 
+from services.formato_moneda import formatear_valor_ars
+
 register = template.Library()
 
 @register.filter
@@ -9,5 +11,5 @@ def ars(value):
     except (TypeError, ValueError):
         value = 0.0
     # Formatea con dos decimales y estilo argentino (separador de miles ".", decimales ",")
-    formatted = f"$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    formatted = f"$ {formatear_valor_ars(value)}"
     return formatted
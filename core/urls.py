@@ -15,8 +15,12 @@ urlpatterns = [
     path('api/productos', views.api_productos, name='api_productos'),
     path('api/check_products_update', views.api_check_products_update, name='api_check_products_update'),
     path('api/productos/by_code', views.api_productos_by_code, name='api_productos_by_code'),
+    path('api/productos/changes', views.api_productos_changes, name='api_productos_changes'),
+    path('api/productos/search', views.api_productos_search, name='api_productos_search'),
 
     path('producto/atributos/<int:product_id>', views.producto_atributos, name='producto_atributos'),
+    path('api/productos/atributos/batch', views.api_atributos_batch, name='api_atributos_batch'),
+    path('api/stock/batch', views.api_stock_batch, name='api_stock_batch'),
     path('api/stock/<str:codigo>/<str:store>', views.api_stock, name='api_stock'),
 
     path('api/update_last_store', views.api_update_last_store, name='api_update_last_store'),
@@ -33,6 +37,7 @@ urlpatterns = [
     path('api/direcciones/codigo_postal', views.api_direcciones_codigo_postal, name='api_direcciones_codigo_postal'),
 
     path('api/create_quotation', views.api_create_quotation, name='api_create_quotation'),
+    path('api/quotation_jobs/<str:job_id>', views.api_quotation_job, name='api_quotation_job'),
     path('api/update_quotation/<str:quotation_id>', views.api_update_quotation, name='api_update_quotation'),
 
     path('api/local_quotations', views.api_local_quotations, name='api_local_quotations'),
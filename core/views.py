@@ -1,6 +1,7 @@
 # core/views.py
 import os
 import json
+import math
 import datetime
 from datetime import timezone, timedelta
 
@@ -24,11 +25,13 @@ from django import forms
 from .models import ModoEntrega
 
 
+import pyarrow as pa
 import pyarrow.compute as pc
 
 # Servicios
 from services.database import (
     obtener_atributos,
+    obtener_atributos_lote,
     obtener_stores_from_parquet,
     obtener_grupos_cumplimiento,
     obtener_datos_tienda_por_id,
@@ -36,10 +39,8 @@ from services.database import (
     actualizar_last_store,
     save_cart,
     get_cart,
-    obtener_token_d365,
 )
 from services.d365_interface import (
-    run_crear_presupuesto_batch,
     run_obtener_presupuesto_d365,
     run_actualizar_presupuesto_d365,
     run_validar_cliente_existente,
@@ -54,15 +55,26 @@ from services.config import (
     CACHE_FILE_ATRIBUTOS,
 )
 from services.modulo_facturacion_arca import generar_factura
+from services.indice_productos import COLUMNAS_MONEDA
+from services.payload_productos import obtener_payload_productos
+from services.busqueda_productos import BUSQUEDA_PAGE_SIZE, BUSQUEDA_PAGE_SIZE_MAX
+from services.indice_stock import STOCK_BATCH_MAX_CODIGOS, normalizar_codigo
+from services.indice_atributos import ATRIBUTOS_BATCH_MAX_PRODUCTOS
+from services.token_d365 import obtener_token_d365
+from services.presupuestos_outbox import encolar_presupuesto, obtener_trabajo, estado_publico
+from services.changelog_productos import obtener_cambios_desde
+from services.formato_moneda import formatear_columnas_ars, formatear_valor_ars
+from services.extraccion_lotes import decimales_a_float
 from services.logging_utils import get_module_logger
 
 # Importa utilidades del scheduler (NO de services.caching)
 from .scheduler import (
     FLAG_FILE,
-    load_parquet_productos,
-    load_parquet_clientes,
-    load_parquet_stock,
-    load_parquet_atributos,
+    load_catalogo_index,
+    load_busqueda_productos_index,
+    load_clientes_index,
+    load_stock_index,
+    load_atributos_index,
     load_parquet_codigos_postales,
 )
 
@@ -231,46 +243,32 @@ def productos(request):
 @login_required
 def api_productos(request):
     try:
-        import pandas as pd
         store = (request.GET.get('store') or 'BA001GC').strip()
         page = int(request.GET.get('page', 1))
         items = int(request.GET.get('items_per_page', 200000))
-        offset = (page - 1) * items
 
         if not os.path.exists(CACHE_FILE_PRODUCTOS):
             return JsonResponse({"error": f"Archivo de caché no encontrado: {CACHE_FILE_PRODUCTOS}"}, status=500)
 
-        # Carga desde parquet (Arrow Table)
-        table = load_parquet_productos()
-        if table is None:
+        # Índice del catálogo (columnas canónicas + partición por tienda)
+        index = load_catalogo_index()
+        if index is None:
             return JsonResponse({"error": "No se pudo cargar los productos desde Parquet"}, status=500)
 
-        # Renombrar columnas según tu esquema
-        mapping = {
-            'Número de Producto': 'numero_producto',
-            'Nombre de Categoría de Producto': 'categoria_producto',
-            'Nombre del Producto': 'nombre_producto',
-            'Grupo de Cobertura': 'grupo_cobertura',
-            'Unidad de Medida': 'unidad_medida',
-            'PrecioFinalConIVA': 'precio_final_con_iva',
-            'PrecioFinalConDescE': 'precio_final_con_descuento',
-            'StoreNumber': 'store_number',
-            'TotalDisponibleVenta': 'total_disponible_venta',
-            'Signo': 'signo',
-            'Multiplo': 'multiplo',
-        }
-        table = table.rename_columns([mapping.get(c, c) for c in table.column_names])
-
-        filtered = table.filter(pc.match_substring(pc.field('store_number'), store))
-        df = filtered.to_pandas()
-
-        # formateo monetario a string con coma decimal
-        for col in ('precio_final_con_iva', 'precio_final_con_descuento', 'total_disponible_venta'):
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: f"{x:,.2f}".replace(".", "X").replace(",", ".").replace("X", ","))
-
-        data = df.iloc[offset:offset+items].to_dict('records')
-        return JsonResponse(data, safe=False)
+        # JSON ya serializado/comprimido por (tienda, página) para esta versión del catálogo
+        payload = obtener_payload_productos(index, store, page, items)
+        if payload.coincide(request.headers.get('If-None-Match')):
+            resp = HttpResponse(status=304)
+        else:
+            body, encoding = payload.cuerpo(request.headers.get('Accept-Encoding', ''))
+            resp = HttpResponse(body, content_type='application/json')
+            if encoding:
+                resp['Content-Encoding'] = encoding
+        resp['ETag'] = payload.etag
+        resp['Last-Modified'] = payload.last_modified
+        resp['Cache-Control'] = 'private, no-cache'
+        resp['Vary'] = 'Accept-Encoding'
+        return resp
     except Exception as e:
         logger.exception("api_productos error")
         return JsonResponse({"error": str(e)}, status=500)
@@ -289,6 +287,26 @@ def api_check_products_update(request):
         enviar_correo_fallo("check_products_update", str(e))
         return JsonResponse({"error": str(e)}, status=500)
 
+# ======== API: delta de productos desde una versión ========
+@require_GET
+@login_required
+def api_productos_changes(request):
+    try:
+        since = request.GET.get('since')
+        if since in (None, ''):
+            return JsonResponse({"error": "Parámetro since es requerido"}, status=400)
+        try:
+            since = float(since)
+        except ValueError:
+            return JsonResponse({"error": "Parámetro since inválido"}, status=400)
+        if not math.isfinite(since):
+            return JsonResponse({"error": "Parámetro since inválido"}, status=400)
+        store = (request.GET.get('store') or '').strip()
+        return JsonResponse(obtener_cambios_desde(since, store or None))
+    except Exception as e:
+        logger.exception("api_productos_changes error")
+        return JsonResponse({"error": str(e)}, status=500)
+
 # ======== API: producto por código (exacto) ========
 @require_GET
 @login_required
@@ -303,29 +321,11 @@ def api_productos_by_code(request):
         if not os.path.exists(CACHE_FILE_PRODUCTOS):
             return JsonResponse({"error": f"Archivo de caché no encontrado: {CACHE_FILE_PRODUCTOS}"}, status=500)
 
-        table = load_parquet_productos()
-        mapping = {
-            'Número de Producto': 'numero_producto',
-            'Nombre de Categoría de Producto': 'categoria_producto',
-            'Nombre del Producto': 'nombre_producto',
-            'Grupo de Cobertura': 'grupo_cobertura',
-            'Unidad de Medida': 'unidad_medida',
-            'PrecioFinalConIVA': 'precio_final_con_iva',
-            'PrecioFinalConDescE': 'precio_final_con_descuento',
-            'StoreNumber': 'store_number',
-            'TotalDisponibleVenta': 'total_disponible_venta',
-            'Signo': 'signo',
-            'Multiplo': 'multiplo',
-        }
-        table = table.rename_columns([mapping.get(c, c) for c in table.column_names])
+        index = load_catalogo_index()
+        if index is None:
+            return JsonResponse({"error": "No se pudo cargar los productos desde Parquet"}, status=500)
 
-        filt = table.filter(pc.equal(pc.field('numero_producto'), code))
-        if store:
-            filt = filt.filter(pc.equal(pc.field('store_number'), store))
-        df = filt.to_pandas()
-        for col in ('precio_final_con_iva', 'precio_final_con_descuento', 'total_disponible_venta'):
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: f"{x:,.2f}".replace(".", "X").replace(",", ".").replace("X", ","))
+        df = formatear_columnas_ars(index.buscar(code, store or None), COLUMNAS_MONEDA).to_pandas()
 
         products = df.to_dict('records')
         if not products:
@@ -336,16 +336,56 @@ def api_productos_by_code(request):
         logger.exception("api_productos_by_code")
         return JsonResponse({"error": str(e)}, status=500)
 
+# ======== API: búsqueda de productos (texto completo) ========
+@require_GET
+@login_required
+def api_productos_search(request):
+    try:
+        query = (request.GET.get('q') or request.GET.get('query') or '').strip()
+        store = (request.GET.get('store') or '').strip()
+        try:
+            page = int(request.GET.get('page', 1))
+            page_size = int(request.GET.get('page_size', BUSQUEDA_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({"error": "Parámetros page/page_size inválidos"}, status=400)
+        page, page_size = max(page, 1), min(max(page_size, 1), BUSQUEDA_PAGE_SIZE_MAX)
+        if not query:
+            return JsonResponse({"query": query, "total": 0, "page": page, "results": []})
+
+        if not os.path.exists(CACHE_FILE_PRODUCTOS):
+            return JsonResponse({"error": f"Archivo de caché no encontrado: {CACHE_FILE_PRODUCTOS}"}, status=500)
+
+        index = load_busqueda_productos_index()
+        if index is None:
+            return JsonResponse({"error": "No se pudo cargar los productos desde Parquet"}, status=500)
+
+        total, encontrados = index.buscar(query, store or None, page, page_size)
+        filas = [fila for fila, _ in encontrados]
+        results = formatear_columnas_ars(index.tabla_resultados(filas), COLUMNAS_MONEDA).to_pylist()
+        for producto, (_, score) in zip(results, encontrados):
+            producto["score"] = round(score, 3)
+        return JsonResponse({
+            "query": query,
+            "store": store,
+            "version": index.version,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "results": results,
+        })
+    except Exception as e:
+        logger.exception("api_productos_search")
+        return JsonResponse({"error": str(e)}, status=500)
+
 # ======== API: atributos de producto ========
 @require_GET
 @login_required
 def producto_atributos(request, product_id: int):
     try:
-        # Si el bootstrap dejó el FLAG, usar parquet; si no, DB
-        if os.path.exists(FLAG_FILE):
-            table = load_parquet_atributos()
-            table = table.filter(pc.equal(pc.field('ProductNumber'), str(product_id)))
-            atributos = table.to_pandas().to_dict('records') if table.num_rows > 0 else []
+        # Si el bootstrap dejó el FLAG, usar el índice del parquet; si no, DB
+        index = load_atributos_index() if os.path.exists(FLAG_FILE) else None
+        if index is not None:
+            atributos = index.atributos(product_id)
         else:
             atributos = obtener_atributos(product_id) or []
 
@@ -365,6 +405,61 @@ def producto_atributos(request, product_id: int):
             return JsonResponse({'error': f'Error al cargar atributos: {str(e)}'}, status=500)
         raise
 
+# ======== API: atributos de varios productos (comparador / paneles de detalle) ========
+@csrf_exempt
+@require_POST
+@login_required
+def api_atributos_batch(request):
+    try:
+        body = json.loads(request.body.decode('utf-8') or '{}')
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Se esperaba un objeto JSON"}, status=400)
+        productos = body.get('products') or body.get('productos') or []
+        if not isinstance(productos, list) or not productos:
+            return JsonResponse({"error": "products (lista) es requerido"}, status=400)
+        if len(productos) > ATRIBUTOS_BATCH_MAX_PRODUCTOS:
+            return JsonResponse({"error": f"Máximo {ATRIBUTOS_BATCH_MAX_PRODUCTOS} productos por llamada"}, status=400)
+
+        index = load_atributos_index() if os.path.exists(FLAG_FILE) else None
+        if index is not None:
+            atributos = index.atributos_lote(productos)
+        else:
+            # Mismas claves que el índice (normalizar_codigo), sea cual sea la forma en que se enviaron
+            atributos = {normalizar_codigo(p): [] for p in productos if normalizar_codigo(p)}
+            for producto, filas in obtener_atributos_lote(str(p).strip() for p in productos if str(p).strip()).items():
+                atributos.setdefault(normalizar_codigo(producto), []).extend(filas)
+
+        return JsonResponse({
+            "products": {
+                producto: {
+                    "product_name": filas[0].get("ProductName") if filas else "Producto",
+                    "attributes": filas,
+                }
+                for producto, filas in atributos.items()
+            }
+        })
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "JSON inválido"}, status=400)
+    except Exception as e:
+        logger.exception("api_atributos_batch")
+        return JsonResponse({"error": f"Error interno: {str(e)}"}, status=500)
+
+
+def _completar_almacenes(stock: list, codigo: str, almacenes: list) -> list:
+    """Agrega en cero los almacenes del grupo sin fila de stock para el código."""
+    presentes = {(s.get("almacen_365") or "").strip().upper() for s in stock}
+    for alm in almacenes:
+        if alm not in presentes:
+            stock.append({
+                "codigo": codigo,
+                "almacen_365": alm,
+                "stock_fisico": 0.00,
+                "disponible_venta": 0.00,
+                "disponible_entrega": 0.00,
+                "comprometido": 0.00
+            })
+    return stock
+
 # ======== API: stock por código y store ========
 @require_GET
 @login_required
@@ -382,29 +477,60 @@ def api_stock(request, codigo: str, store: str):
             return JsonResponse({"mensaje": f"No hay almacenes asignados a la tienda {store}."}, status=404)
 
         codigo_norm = str(codigo).strip().upper()
-        table = load_parquet_stock()
-        f1 = pc.match_substring(pc.field('codigo'), codigo_norm)
-        f2 = pc.field('almacen_365').isin(almacenes_asignados)
-        filtered = table.filter(pc.and_kleene(f1, f2))
-        df = filtered.to_pandas()
-        stock = df.to_dict('records')
-
-        presentes = {s["almacen_365"].strip().upper() for s in stock}
-        for alm in almacenes_asignados:
-            if alm not in presentes:
-                stock.append({
-                    "codigo": codigo_norm,
-                    "almacen_365": alm,
-                    "stock_fisico": 0.00,
-                    "disponible_venta": 0.00,
-                    "disponible_entrega": 0.00,
-                    "comprometido": 0.00
-                })
-        return JsonResponse(stock, safe=False)
+        index = load_stock_index()
+        if index is None:
+            return JsonResponse({"error": "No se pudo cargar el stock desde Parquet"}, status=500)
+        # Código exacto: rango de filas del código y filtro de almacenes sobre ese rango
+        stock = decimales_a_float(index.buscar(codigo_norm, almacenes_asignados)).to_pylist()
+        return JsonResponse(_completar_almacenes(stock, codigo_norm, almacenes_asignados), safe=False)
     except Exception as e:
         logger.exception("api_stock")
         return JsonResponse({"error": f"Error interno: {str(e)}"}, status=500)
 
+# ======== API: stock de varios productos (carrito / grilla) ========
+@csrf_exempt
+@require_POST
+@login_required
+def api_stock_batch(request):
+    try:
+        body = json.loads(request.body.decode('utf-8') or '{}')
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Se esperaba un objeto JSON"}, status=400)
+        store = (body.get('store') or '').strip()
+        codigos = body.get('codes') or body.get('codigos') or []
+        only_available = bool(body.get('only_available', False))
+        if not store or not isinstance(codigos, list) or not codigos:
+            return JsonResponse({"error": "codes (lista) y store son requeridos"}, status=400)
+        if len(codigos) > STOCK_BATCH_MAX_CODIGOS:
+            return JsonResponse({"error": f"Máximo {STOCK_BATCH_MAX_CODIGOS} códigos por llamada"}, status=400)
+
+        if not os.path.exists(CACHE_FILE_STOCK):
+            return JsonResponse({"error": f"Archivo de caché no encontrado: {CACHE_FILE_STOCK}"}, status=500)
+
+        # Grupo de cumplimiento resuelto una sola vez para todo el lote
+        almacenes_asignados = [a.strip().upper() for a in (obtener_grupos_cumplimiento(store) or [])]
+        if not almacenes_asignados:
+            return JsonResponse({"mensaje": f"No hay almacenes asignados a la tienda {store}."}, status=404)
+
+        index = load_stock_index()
+        if index is None:
+            return JsonResponse({"error": "No se pudo cargar el stock desde Parquet"}, status=500)
+
+        codigos_norm = list(dict.fromkeys(normalizar_codigo(c) for c in codigos if normalizar_codigo(c)))
+        filas = decimales_a_float(index.buscar_lote(codigos_norm, almacenes_asignados, only_available)).to_pylist()
+        stock = {c: [] for c in codigos_norm}
+        for fila in filas:
+            stock.setdefault(normalizar_codigo(fila.get("codigo")), []).append(fila)
+        if not only_available:
+            for codigo, filas_codigo in stock.items():
+                _completar_almacenes(filas_codigo, codigo, almacenes_asignados)
+        return JsonResponse({"store": store, "almacenes": almacenes_asignados, "stock": stock})
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "JSON inválido"}, status=400)
+    except Exception as e:
+        logger.exception("api_stock_batch")
+        return JsonResponse({"error": f"Error interno: {str(e)}"}, status=500)
+
 # ======== API: actualizar last_store ========
 @csrf_exempt
 @require_POST
@@ -514,8 +640,8 @@ def api_clientes_create(request):
             return JsonResponse({"error": error}, status=500)
 
         # refrescar cache clientes
-        from .scheduler import actualizar_cache_clientes
-        actualizar_cache_clientes()
+        from .scheduler import actualizar_clientes
+        actualizar_clientes()
         return JsonResponse({"customer_id": customer_id, "message": "Cliente creado exitosamente"}, status=201)
     except Exception as e:
         logger.exception("api_clientes_create")
@@ -526,21 +652,18 @@ def api_clientes_create(request):
 @login_required
 def api_clientes_search(request):
     try:
-        import pandas as pd
-        query = (request.GET.get('query') or '').strip().lower()
+        query = (request.GET.get('query') or '').strip()
         if not query:
             return JsonResponse([], safe=False)
 
         if not os.path.exists(CACHE_FILE_CLIENTES):
             return JsonResponse({"error": f"Archivo de caché no encontrado: {CACHE_FILE_CLIENTES}"}, status=500)
 
-        table = load_parquet_clientes()
-        nif_filter = pc.match_substring(pc.field('nif'), query)
-        numero_cliente_filter = pc.match_substring(pc.field('numero_cliente'), query)
-        combined = pc.or_kleene(nif_filter, numero_cliente_filter)
-        filtered = table.filter(combined)
-        df = filtered.to_pandas()
-        return JsonResponse(df.head(10).to_dict('records'), safe=False)
+        # Índice prearmado (prefijo + trigramas), top-10 con corte temprano
+        index = load_clientes_index()
+        if index is None:
+            return JsonResponse({"error": "No se pudo cargar los clientes desde Parquet"}, status=500)
+        return JsonResponse(index.buscar(query), safe=False)
     except Exception as e:
         logger.exception("api_clientes_search")
         return JsonResponse({"error": str(e)}, status=500)
@@ -626,6 +749,11 @@ def api_create_quotation(request):
         if not request.session.get('empleado_d365'):
             return JsonResponse({"error": "Inicia sesión nuevamente (ID empleado faltante)"}, status=401)
 
+        # El trabajo (y su Idempotency-Key) se asocia al usuario de la sesión
+        usuario = request.session.get('email')
+        if not usuario:
+            return JsonResponse({"error": "Inicia sesión nuevamente (usuario faltante)"}, status=401)
+
         if not cart.get('client') or not cart['client'].get('numero_cliente'):
             return JsonResponse({"error": "Debe seleccionar un cliente"}, status=400)
 
@@ -633,11 +761,6 @@ def api_create_quotation(request):
         if not items:
             return JsonResponse({"error": "El carrito está vacío"}, status=400)
 
-        token = obtener_token_d365()
-        if not token:
-            enviar_correo_fallo("create_quotation", "No se pudo obtener token D365")
-            return JsonResponse({"error": "No se pudo obtener token"}, status=500)
-
         tienda = obtener_datos_tienda_por_id(store_id)
         if not tienda:
             return JsonResponse({"error": f"Tienda {store_id} no encontrada"}, status=404)
@@ -670,15 +793,30 @@ def api_create_quotation(request):
             }
             lineas.append(linea)
 
-        quotation_number, error = run_crear_presupuesto_batch(datos_cabecera, lineas, token)
-        if not quotation_number:
-            return JsonResponse({"error": error}, status=500)
-        return JsonResponse({"quotation_number": quotation_number}, status=201)
+        # Cabecera + líneas en segundo plano (outbox): el request no espera a D365
+        clave = request.headers.get('Idempotency-Key') or body.get('idempotency_key')
+        trabajo = encolar_presupuesto(datos_cabecera, lineas, usuario, clave)
+        respuesta = estado_publico(trabajo)
+        respuesta["status_url"] = reverse("core:api_quotation_job", args=[trabajo["id"]])
+        return JsonResponse(respuesta, status=202)
     except Exception as e:
         logger.exception("api_create_quotation")
         enviar_correo_fallo("create_quotation", str(e))
         return JsonResponse({"error": str(e)}, status=500)
 
+# ======== API: estado de un presupuesto encolado ========
+@require_GET
+@login_required
+def api_quotation_job(request, job_id: str):
+    try:
+        trabajo = obtener_trabajo(job_id)
+        if not trabajo or trabajo["usuario"] != request.session.get('email'):
+            return JsonResponse({"error": "Trabajo no encontrado"}, status=404)
+        return JsonResponse(estado_publico(trabajo))
+    except Exception as e:
+        logger.exception("api_quotation_job")
+        return JsonResponse({"error": str(e)}, status=500)
+
 # ======== API: actualizar presupuesto D365 ========
 @csrf_exempt
 def api_update_quotation(request, quotation_id: str):
@@ -840,12 +978,15 @@ def api_local_quotation(request, quotation_id: str):
         logger.exception("api_local_quotation")
         return JsonResponse({"error": str(e)}, status=500)
 
+# Columnas del catálogo que usa el enriquecimiento de líneas de presupuesto D365
+COLUMNAS_PRODUCTO_PRESUPUESTO = ('nombre_producto', 'precio_final_con_descuento', 'precio_final_con_iva',
+                                 'unidad_medida', 'multiplo')
+
 # ======== API: obtener presupuesto D365 y enriquecer con cache ========
 @require_GET
 @login_required
 def api_d365_quotation(request, quotation_id: str):
     try:
-        import pandas as pd
         if not quotation_id.startswith('VENT1-'):
             return JsonResponse({"error": "ID de presupuesto D365 inválido"}, status=400)
 
@@ -864,26 +1005,9 @@ def api_d365_quotation(request, quotation_id: str):
         numero_cliente = header.get("InvoiceCustomerAccountNumber", "N/A")
         client_info = None
         if os.path.exists(CACHE_FILE_CLIENTES):
-            t = load_parquet_clientes()
-            mapping = {
-                'Bloqueado': 'bloqueado',
-                'Tipo_Contribuyente': 'tipo_contribuyente',
-                'Numero_Cliente': 'numero_cliente',
-                'Nombre_Cliente': 'nombre_cliente',
-                'Limite_Credito': 'limite_credito',
-                'Grupo_Impuestos': 'grupo_impuestos',
-                'NIF': 'nif',
-                'TIF': 'tif',
-                'Direccion_Completa': 'direccion_completa',
-                'Fecha_Modificacion': 'fecha_modificacion',
-                'Fecha_Creacion': 'fecha_creacion',
-                'EmailContacto': 'email_contacto',
-                'TelefonoContacto': 'telefono_contacto'
-            }
-            t = t.rename_columns([mapping.get(c, c) for c in t.column_names])
-            t = t.filter(pc.equal(pc.field('numero_cliente'), numero_cliente))
-            dfc = t.to_pandas()
-            client_info = dfc.to_dict('records')[0] if not dfc.empty else None
+            clientes_index = load_clientes_index()
+            if clientes_index is not None:
+                client_info = clientes_index.por_numero(numero_cliente)
 
         sales_origin = header.get("SalesOrderOriginCode")
         selected_store = request.GET.get('store') or (sales_origin if sales_origin else "BA001GC")
@@ -920,37 +1044,31 @@ def api_d365_quotation(request, quotation_id: str):
         has_flete = False
         unique = {}
 
-        prod_table = None
+        prod_index = None
         if os.path.exists(CACHE_FILE_PRODUCTOS):
-            prod_table = load_parquet_productos()
-            mapping = {
-                'Número de Producto': 'numero_producto',
-                'Nombre de Categoría de Producto': 'categoria_producto',
-                'Nombre del Producto': 'nombre_producto',
-                'Grupo de Cobertura': 'grupo_cobertura',
-                'Unidad de Medida': 'unidad_medida',
-                'PrecioFinalConIVA': 'precio_final_con_iva',
-                'PrecioFinalConDescE': 'precio_final_con_descuento',
-                'StoreNumber': 'store_number',
-                'TotalDisponibleVenta': 'total_disponible_venta',
-                'Signo': 'signo',
-                'Multiplo': 'multiplo',
-            }
-            prod_table = prod_table.rename_columns([mapping.get(c, c) for c in prod_table.column_names])
+            prod_index = load_catalogo_index()
+
+        # Todas las líneas en una pasada: posición de cada ItemNumber en la tienda y un solo take
+        productos = {}
+        if prod_index is not None and lines:
+            posiciones = {}
+            for line in lines:
+                pos = prod_index.fila(line["ItemNumber"], selected_store)
+                if pos is not None:
+                    posiciones.setdefault(str(line["ItemNumber"]), pos)
+            if posiciones:
+                columnas = [c for c in COLUMNAS_PRODUCTO_PRESUPUESTO if c in prod_index.table.column_names]
+                filas = prod_index.table.select(columnas).take(pa.array(list(posiciones.values()), type=pa.int64()))
+                productos = dict(zip(posiciones, filas.to_pylist()))
 
         for line in lines:
-            product = None
-            if prod_table is not None:
-                f1 = pc.equal(pc.field('numero_producto'), line["ItemNumber"])
-                f2 = pc.equal(pc.field('store_number'), selected_store)
-                dfp = prod_table.filter(pc.and_kleene(f1, f2)).to_pandas()
-                product = dfp.to_dict('records')[0] if not dfp.empty else None
+            product = productos.get(str(line["ItemNumber"]))
 
             if product:
                 price = float(product["precio_final_con_descuento"])
                 precio_lista = float(product["precio_final_con_iva"])
                 unidad = product.get("unidad_medida", "Un")
-                multiplo = float(product.get("multiplo", 1))
+                multiplo = float(product.get("multiplo") or 1)
                 nombre = product.get("nombre_producto", line["ItemNumber"])
             else:
                 price = float(line.get("SalesPrice", 0))
@@ -962,8 +1080,8 @@ def api_d365_quotation(request, quotation_id: str):
             item = {
                 "productId": line["ItemNumber"],
                 "productName": nombre,
-                "price": f"{price:,.2f}".replace(".", "X").replace(",", ".").replace("X", ","),
-                "precioLista": f"{precio_lista:,.2f}".replace(".", "X").replace(",", ".").replace("X", ","),
+                "price": formatear_valor_ars(price),
+                "precioLista": formatear_valor_ars(precio_lista),
                 "quantity": float(line.get("RequestedSalesQuantity", 0)),
                 "multiplo": multiplo,
                 "unidadMedida": unidad,
@@ -0,0 +1,48 @@
+"""Benchmark: formateo es-AR vectorizado vs. el lambda por celda usado en las vistas.
+
+Uso: python scripts/bench_formato_moneda.py [filas ...]   (por defecto 100000 y 1000000)
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.formato_moneda import formatear_ars  # noqa: E402
+
+
+def lambda_actual(serie: pd.Series) -> pd.Series:
+    return serie.apply(lambda x: f"{x:,.2f}".replace(".", "X").replace(",", ".").replace("X", ","))
+
+
+def medir(fn, *args, repeticiones: int = 3) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn(*args)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main(tamanos):
+    rng = np.random.default_rng(42)
+    print(f"{'filas':>10} {'lambda (ns/fila)':>18} {'vectorizado (ns/fila)':>22} {'speedup':>8}")
+    for n in tamanos:
+        valores = np.round(rng.uniform(0, 5_000_000, n), 2)
+        serie = pd.Series(valores)
+        columna = pa.array(valores)
+
+        esperado = lambda_actual(serie).tolist()
+        assert formatear_ars(columna).to_pylist() == esperado, "el formateo vectorizado difiere del lambda"
+
+        t_lambda = medir(lambda_actual, serie)
+        t_vector = medir(formatear_ars, columna)
+        print(f"{n:>10} {t_lambda / n * 1e9:>18.1f} {t_vector / n * 1e9:>22.1f} {t_lambda / t_vector:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000])
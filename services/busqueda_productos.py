@@ -0,0 +1,238 @@
+# services/busqueda_productos.py
+"""
+Búsqueda de texto completo del catálogo de productos (``/api/productos/search``).
+
+Se construye una vez por versión del Parquet de productos desde
+``core.scheduler.load_busqueda_productos_index``, sobre el ``CatalogoIndex``
+de esa misma versión. Cada producto (``numero_producto``) es un documento con
+los términos de ``nombre_producto``, ``categoria_producto`` y ``numero_producto``:
+
+- términos en minúsculas y sin acentos (á -> a, ñ -> n, ü -> u);
+- índice invertido ``término -> {documento: peso del campo}``;
+- vocabulario ordenado para coincidencias por prefijo (búsqueda binaria);
+- índice de borrados (SymSpell) para coincidencias con errores de tipeo: distancia
+  de edición 1 (2 en palabras de ``LARGO_MIN_DOS_EDICIONES`` o más), con
+  transposiciones. Cada término del vocabulario guarda sus variantes con hasta 1
+  borrado, o hasta 2 si puede estar a distancia 2 de una consulta larga; la consulta
+  genera las suyas con la misma profundidad y los candidatos se verifican con la
+  distancia real.
+
+Todas las palabras de la consulta deben coincidir (AND). El puntaje suma, por
+palabra, la mejor coincidencia (exacta > prefijo > aproximada) por el peso del
+campo; los resultados se devuelven ordenados y paginados (top-k con ``heapq``).
+"""
+import heapq
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set, Tuple
+
+import pyarrow as pa
+
+from services.indice_productos import CatalogoIndex
+
+# Peso de cada campo en el puntaje (un código exacto pesa más que el nombre)
+PESOS_CAMPOS = {'numero_producto': 3.0, 'nombre_producto': 1.0, 'categoria_producto': 0.5}
+# Puntaje de cada tipo de coincidencia de un término
+PUNTAJE_EXACTO = 1.0
+PUNTAJE_PREFIJO = 0.7
+PUNTAJE_APROXIMADO = 0.5
+
+# Largo mínimo de una palabra para buscarla por prefijo / con errores
+LARGO_MIN_PREFIJO = int(os.getenv("BUSQUEDA_LARGO_MIN_PREFIJO", "2"))
+LARGO_MIN_APROXIMADO = int(os.getenv("BUSQUEDA_LARGO_MIN_APROXIMADO", "4"))
+LARGO_MIN_DOS_EDICIONES = int(os.getenv("BUSQUEDA_LARGO_MIN_DOS_EDICIONES", "8"))
+# Cota de términos del vocabulario que puede expandir un prefijo corto
+MAX_EXPANSION_PREFIJO = int(os.getenv("BUSQUEDA_MAX_EXPANSION_PREFIJO", "500"))
+BUSQUEDA_PAGE_SIZE = int(os.getenv("BUSQUEDA_PAGE_SIZE", "20"))
+BUSQUEDA_PAGE_SIZE_MAX = int(os.getenv("BUSQUEDA_PAGE_SIZE_MAX", "200"))
+
+_PATRON_TERMINO = re.compile(r"[a-z0-9]+")
+
+
+def plegar_acentos(texto: str) -> str:
+    """Minúsculas y sin diacríticos (``"Cañería Térmica"`` -> ``"caneria termica"``)."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def terminos(texto: str) -> List[str]:
+    return _PATRON_TERMINO.findall(plegar_acentos(texto))
+
+
+def max_ediciones(termino: str) -> int:
+    """Distancia de edición tolerada según el largo de la palabra."""
+    if len(termino) < LARGO_MIN_APROXIMADO:
+        return 0
+    return 1 if len(termino) < LARGO_MIN_DOS_EDICIONES else 2
+
+
+def _borrados(termino: str, profundidad: int = 1) -> Set[str]:
+    """Variantes de ``termino`` con 1 a ``profundidad`` letras borradas."""
+    salida: Set[str] = set()
+    nivel = {termino}
+    for _ in range(profundidad):
+        nivel = {t[:i] + t[i + 1:] for t in nivel for i in range(len(t))}
+        salida |= nivel
+    return salida
+
+
+def _profundidad_vocabulario(termino: str) -> int:
+    """Borrados que necesita un término para encontrarse desde cualquier consulta tolerada."""
+    if len(termino) >= LARGO_MIN_DOS_EDICIONES - 2:
+        return 2
+    return 1 if len(termino) >= LARGO_MIN_APROXIMADO - 1 else 0
+
+
+def distancia_edicion(a: str, b: str, cota: int) -> int:
+    """Distancia de Damerau-Levenshtein (OSA) con corte: devuelve ``cota + 1`` si la supera."""
+    if abs(len(a) - len(b)) > cota:
+        return cota + 1
+    previa2: Optional[List[int]] = None
+    previa = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            costo = 0 if a[i - 1] == b[j - 1] else 1
+            actual[j] = min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + costo)
+            if previa2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                actual[j] = min(actual[j], previa2[j - 2] + 1)
+        if min(actual) > cota:
+            return cota + 1
+        previa2, previa = previa, actual
+    return previa[-1]
+
+
+class IndiceBusquedaProductos:
+    """Índice invertido por producto con prefijos y tolerancia a errores de tipeo."""
+
+    def __init__(self, catalogo: CatalogoIndex):
+        self.catalogo = catalogo
+        self.version = catalogo.version
+        table = catalogo.table
+        columnas = [c for c in PESOS_CAMPOS if c in table.column_names]
+
+        # Un documento por producto: la primera fila del catálogo con ese código
+        self._codigos: List[str] = []
+        self._filas: List[int] = []
+        self._postings: Dict[str, Dict[int, float]] = {}
+        vistos: Dict[str, int] = {}
+        valores = {c: table.column(c).to_pylist() for c in columnas}
+        numeros = valores.get('numero_producto') or [None] * table.num_rows
+        for fila, numero in enumerate(numeros):
+            codigo = str(numero) if numero is not None else f"#{fila}"
+            if codigo in vistos:
+                continue
+            doc = vistos[codigo] = len(self._codigos)
+            self._codigos.append(codigo)
+            self._filas.append(fila)
+            for campo in columnas:
+                texto = valores[campo][fila]
+                if texto is None:
+                    continue
+                peso = PESOS_CAMPOS[campo]
+                palabras = terminos(str(texto))
+                if campo == 'numero_producto':
+                    # el código completo también es un término ("AB-123" -> "ab123")
+                    palabras.append("".join(palabras))
+                for palabra in palabras:
+                    if not palabra:
+                        continue
+                    docs = self._postings.setdefault(palabra, {})
+                    if docs.get(doc, 0.0) < peso:
+                        docs[doc] = peso
+
+        self._vocabulario: List[str] = sorted(self._postings)
+        self._por_borrado: Dict[str, List[str]] = {}
+        for palabra in self._vocabulario:
+            for borrado in _borrados(palabra, _profundidad_vocabulario(palabra)):
+                self._por_borrado.setdefault(borrado, []).append(palabra)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._codigos)
+
+    def _expansiones(self, q: str) -> Dict[str, float]:
+        """Términos del vocabulario que corresponden a la palabra ``q``, con su puntaje."""
+        salida: Dict[str, float] = {}
+        if q in self._postings:
+            salida[q] = PUNTAJE_EXACTO
+
+        if len(q) >= LARGO_MIN_PREFIJO:
+            i = bisect_left(self._vocabulario, q)
+            fin = min(len(self._vocabulario), i + MAX_EXPANSION_PREFIJO)
+            while i < fin and self._vocabulario[i].startswith(q):
+                salida.setdefault(self._vocabulario[i], PUNTAJE_PREFIJO)
+                i += 1
+
+        cota = max_ediciones(q)
+        if cota:
+            candidatos = set(self._por_borrado.get(q, ()))
+            for borrado in _borrados(q, cota):
+                if borrado in self._postings:
+                    candidatos.add(borrado)
+                candidatos.update(self._por_borrado.get(borrado, ()))
+            for termino in candidatos:
+                if termino in salida:
+                    continue
+                d = distancia_edicion(q, termino, cota)
+                if d <= cota:
+                    salida[termino] = PUNTAJE_APROXIMADO / d
+        return salida
+
+    def puntajes(self, query: str) -> Dict[int, float]:
+        """Documentos que contienen todas las palabras de ``query`` -> puntaje."""
+        palabras = list(dict.fromkeys(terminos(query)))
+        if not palabras:
+            return {}
+        acumulado: Optional[Dict[int, float]] = None
+        # Primero las palabras más selectivas: el AND se achica enseguida
+        por_palabra = []
+        for q in palabras:
+            mejor: Dict[int, float] = {}
+            for termino, puntaje in self._expansiones(q).items():
+                for doc, peso in self._postings[termino].items():
+                    valor = puntaje * peso
+                    if valor > mejor.get(doc, 0.0):
+                        mejor[doc] = valor
+            if not mejor:
+                return {}
+            por_palabra.append(mejor)
+        por_palabra.sort(key=len)
+        for mejor in por_palabra:
+            if acumulado is None:
+                acumulado = dict(mejor)
+            else:
+                acumulado = {doc: s + mejor[doc] for doc, s in acumulado.items() if doc in mejor}
+            if not acumulado:
+                return {}
+        return acumulado or {}
+
+    def buscar(self, query: str, store: Optional[str] = None, page: int = 1,
+               page_size: int = BUSQUEDA_PAGE_SIZE) -> Tuple[int, List[Tuple[int, float]]]:
+        """``(total, [(fila del catálogo, puntaje), ...])`` de la página pedida.
+
+        Con ``store`` solo cuentan los productos que existen en esa tienda y las
+        filas devueltas son las de esa tienda (precio/stock de la sucursal).
+        """
+        page = max(int(page), 1)
+        page_size = min(max(int(page_size), 1), BUSQUEDA_PAGE_SIZE_MAX)
+        candidatos: List[Tuple[float, str, int]] = []
+        for doc, puntaje in self.puntajes(query).items():
+            codigo = self._codigos[doc]
+            if store:
+                fila = self.catalogo.fila(codigo, store)
+                if fila is None:
+                    continue
+            else:
+                fila = self._filas[doc]
+            candidatos.append((-puntaje, codigo, fila))
+
+        # top-k parcial: solo se ordena hasta el final de la página pedida
+        mejores = heapq.nsmallest(page * page_size, candidatos)
+        pagina = mejores[(page - 1) * page_size:]
+        return len(candidatos), [(fila, -neg) for neg, _, fila in pagina]
+
+    def tabla_resultados(self, filas: List[int]) -> pa.Table:
+        return self.catalogo.table.take(pa.array(filas, type=pa.int64()))
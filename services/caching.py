@@ -5,22 +5,31 @@ choques en los imports. Aquí viven las funciones de actualización de caché
 usadas por el scheduler.
 """
 import os
+import json
+import time
 import datetime
-from functools import lru_cache
 from services.logging_utils import get_module_logger
 
 import requests
-import pyarrow as pa
 import pyarrow.parquet as pq
 
 from services.email_service import enviar_correo_fallo
-from services.database import (
-    obtener_stock,
-    obtener_empleados,
-    obtener_todos_atributos,
-)
+from services.database import conectar_db
 from services.config import CACHE_FILE_CODIGOS_POSTALES
-from services.fabric import obtener_codigos_postales_fabric
+from services.fabric import (
+    obtener_codigos_postales_fabric,
+    COLUMNAS_STOCK,
+    COLUMNAS_ATRIBUTOS,
+    COLUMNAS_EMPLEADOS,
+)
+from services.extraccion_lotes import extraer_en_lotes
+from services.guarda_publicacion import PublicacionRechazada, verificar_publicacion
+from services.delta_productos import calcular_cambios_productos
+from services.registro_tablas import (
+    obtener_tabla,
+    publicar_tabla,
+    asegurar_snapshot_arrow,
+)
 
 logger = get_module_logger(__name__)
 
@@ -58,16 +67,96 @@ CLIENTES_PARQUET_URL  = "https://fabricstorageeastus.blob.core.windows.net/fabri
 # ----------------------------------------------------------------------
 # Descargas
 # ----------------------------------------------------------------------
-def _descargar(url: str, destino: str, nombre: str):
+DESCARGA_CHUNK = 1024 * 1024  # 1 MiB por escritura
+
+
+def _meta_path(destino: str) -> str:
+    return f"{destino}.meta.json"
+
+
+def _leer_meta(destino: str) -> dict:
+    """Metadatos HTTP (ETag, Last-Modified, Content-Length) de la última descarga."""
+    try:
+        if not os.path.exists(destino):
+            return {}
+        with open(_meta_path(destino), "r", encoding="utf-8") as fh:
+            return json.load(fh) or {}
+    except Exception:
+        return {}
+
+
+def _guardar_meta(destino: str, resp) -> None:
+    meta = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "content_length": resp.headers.get("Content-Length"),
+    }
     try:
+        with open(_meta_path(destino), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+    except Exception:
+        logger.warning(f"No se pudo grabar metadatos de descarga para {destino}", exc_info=True)
+
+
+def _sin_cambios(meta: dict, resp, destino: str) -> bool:
+    """El servidor ignoró el condicional pero la respuesta describe el mismo archivo."""
+    etag = resp.headers.get("ETag")
+    largo = resp.headers.get("Content-Length")
+    if not etag or etag != meta.get("etag"):
+        return False
+    if largo is not None:
+        try:
+            return int(largo) == os.path.getsize(destino)
+        except (OSError, ValueError):
+            return False
+    return True
+
+
+def _descargar(url: str, destino: str, nombre: str, antes_de_reemplazar=None) -> bool:
+    """Descarga condicional y en streaming.
+
+    Envía ``If-None-Match``/``If-Modified-Since`` con los metadatos de la descarga
+    anterior; si el archivo no cambió devuelve False sin tocar ``destino`` (su mtime
+    no cambia y las cachés en memoria siguen válidas). Si cambió, escribe por bloques
+    en un temporal y lo mueve atómicamente sobre ``destino``; devuelve True.
+    ``antes_de_reemplazar(tmp)`` se invoca justo antes del reemplazo con la ruta del
+    archivo descargado (p. ej. para leer la versión anterior y calcular el diff).
+    """
+    tmp = f"{destino}.tmp"
+    try:
+        meta = _leer_meta(destino)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
         logger.info(f"Descargando {nombre} desde URL...")
-        resp = requests.get(url, timeout=60)
-        resp.raise_for_status()
-        with open(destino, "wb") as f:
-            f.write(resp.content)
+        with requests.get(url, headers=headers, stream=True, timeout=60) as resp:
+            if resp.status_code == 304 or (resp.ok and _sin_cambios(meta, resp, destino)):
+                logger.info(f"{nombre} sin cambios (ETag {meta.get('etag')}); se conserva {destino}")
+                return False
+            resp.raise_for_status()
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=DESCARGA_CHUNK):
+                    if chunk:
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            if antes_de_reemplazar is not None:
+                antes_de_reemplazar(tmp)
+            verificar_publicacion(nombre)
+            os.replace(tmp, destino)
+            _guardar_meta(destino, resp)
         logger.info(f"{nombre} descargado en {destino}")
+        return True
     except Exception as e:
         logger.error(f"Error al descargar {nombre}: {e}", exc_info=True)
+        try:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        except OSError:
+            pass
         try:
             enviar_correo_fallo(f"descargar_{nombre}", str(e))
         except Exception:
@@ -83,33 +172,77 @@ def _hoy(dt_path: str) -> bool:
         return False
 
 # ----------------------------------------------------------------------
-# Cargas en memoria (invalidables)
+# Cargas en memoria (registro compartido de tablas)
 # ----------------------------------------------------------------------
-@lru_cache(maxsize=1)
 def load_products_to_memory():
-    return pq.read_table(CACHE_FILE_PRODUCTOS)
+    return obtener_tabla(CACHE_FILE_PRODUCTOS)
 
-@lru_cache(maxsize=1)
 def load_parquet_to_memory():
-    return pq.read_table(CACHE_FILE_CLIENTES)
+    return obtener_tabla(CACHE_FILE_CLIENTES)
 
-@lru_cache(maxsize=1)
 def load_stock_to_memory():
-    return pq.read_table(CACHE_FILE_STOCK)
+    return obtener_tabla(CACHE_FILE_STOCK)
 
-@lru_cache(maxsize=1)
 def load_atributos_to_memory():
-    return pq.read_table(CACHE_FILE_ATRIBUTOS)
+    return obtener_tabla(CACHE_FILE_ATRIBUTOS)
 
 # ----------------------------------------------------------------------
 # API pública usada por el scheduler
 # ----------------------------------------------------------------------
+# Suscriptores del conjunto de cambios del catálogo (índices, change log, etc.)
+_LISTENERS_CAMBIOS_PRODUCTOS = []
+
+
+def registrar_listener_cambios_productos(fn):
+    """Registra ``fn(cambios: CambiosCatalogo)``, llamada con cada catálogo nuevo.
+
+    Se llama antes de publicar el Parquet (``os.replace``): lo que el listener
+    persista (p. ej. el change log) ya existe cuando un worker ve la versión nueva.
+    """
+    if fn not in _LISTENERS_CAMBIOS_PRODUCTOS:
+        _LISTENERS_CAMBIOS_PRODUCTOS.append(fn)
+    return fn
+
+
 def actualizar_cache_productos():
-    """Actualiza productos_cache.parquet descargándolo directamente."""
+    """Actualiza productos_cache.parquet (descarga condicional) y emite el diff por filas.
+
+    Devuelve el ``CambiosCatalogo`` respecto de la versión anterior, o None si el
+    archivo remoto no cambió.
+    """
     try:
-        _descargar(PRODUCTOS_PARQUET_URL, CACHE_FILE_PRODUCTOS, "productos.parquet")
-        load_products_to_memory.cache_clear()
-        logger.info("Caché productos actualizada y memoria invalidada.")
+        emitido = {}
+
+        def _emitir_cambios(tmp):
+            version_anterior, anterior = None, None
+            if os.path.exists(CACHE_FILE_PRODUCTOS):
+                version_anterior = os.path.getmtime(CACHE_FILE_PRODUCTOS)
+                anterior = obtener_tabla(CACHE_FILE_PRODUCTOS)
+            # La versión (mtime) se fija en el temporal: os.replace la conserva
+            version_ms = max(int(time.time() * 1000), int(round((version_anterior or 0) * 1000)) + 1)
+            os.utime(tmp, ns=(version_ms * 1_000_000, version_ms * 1_000_000))
+            cambios = calcular_cambios_productos(
+                anterior, pq.read_table(tmp, memory_map=True),
+                version_anterior=version_anterior, version=os.path.getmtime(tmp),
+            )
+            for fn in list(_LISTENERS_CAMBIOS_PRODUCTOS):
+                try:
+                    fn(cambios)
+                except PublicacionRechazada:
+                    raise
+                except Exception:
+                    logger.exception(f"Listener de cambios de productos falló: {fn}")
+            emitido["cambios"] = cambios
+
+        if not _descargar(PRODUCTOS_PARQUET_URL, CACHE_FILE_PRODUCTOS, "productos.parquet",
+                          antes_de_reemplazar=_emitir_cambios):
+            asegurar_snapshot_arrow(CACHE_FILE_PRODUCTOS)
+            return None
+        publicar_tabla(CACHE_FILE_PRODUCTOS)
+
+        cambios = emitido["cambios"]
+        logger.info(f"Caché productos actualizada y memoria invalidada. Cambios: {cambios.resumen()}")
+        return cambios
     except Exception as e:
         logger.error(f"Error actualizar_cache_productos: {e}", exc_info=True)
         raise
@@ -117,8 +250,10 @@ def actualizar_cache_productos():
 def actualizar_cache_clientes():
     """Actualiza clientes_cache.parquet descargándolo directamente."""
     try:
-        _descargar(CLIENTES_PARQUET_URL, CACHE_FILE_CLIENTES, "clientes.parquet")
-        load_parquet_to_memory.cache_clear()
+        if not _descargar(CLIENTES_PARQUET_URL, CACHE_FILE_CLIENTES, "clientes.parquet"):
+            asegurar_snapshot_arrow(CACHE_FILE_CLIENTES)
+            return
+        publicar_tabla(CACHE_FILE_CLIENTES)
         logger.info("Caché clientes actualizada y memoria invalidada.")
     except Exception as e:
         logger.error(f"Error actualizar_cache_clientes: {e}", exc_info=True)
@@ -126,16 +261,17 @@ def actualizar_cache_clientes():
 
 def actualizar_cache_stock():
     try:
-        logger.info("Obteniendo stock (services.database.obtener_stock) para cache...")
-        stock_data = obtener_stock(formateado=False)  # <<< NUMÉRICO
-        if not stock_data:
+        logger.info("Reconstruyendo stock_cache.parquet desde SQLite (lectura en lotes)...")
+        with conectar_db("stock") as conexion:
+            total = extraer_en_lotes(
+                conexion.cursor(),
+                "SELECT codigo, almacen_365, stock_fisico, disponible_venta, disponible_entrega, comprometido FROM stock",
+                COLUMNAS_STOCK, destino_parquet=CACHE_FILE_STOCK, nombre="cache_stock",
+            )
+        if not total:
             logger.warning("No se encontraron datos de stock para cache.")
             return
-        keys = stock_data[0].keys()
-        data = {k: [row.get(k) for row in stock_data] for k in keys}
-        table = pa.Table.from_pydict(data)
-        pq.write_table(table, CACHE_FILE_STOCK)
-        load_stock_to_memory.cache_clear()
+        publicar_tabla(CACHE_FILE_STOCK)
         logger.info("Caché stock actualizada.")
     except Exception as e:
         logger.error(f"Error actualizar_cache_stock: {e}", exc_info=True)
@@ -148,15 +284,17 @@ def actualizar_cache_stock():
 def actualizar_cache_empleados():
     """Construye el parquet de empleados desde la DB local."""
     try:
-        logger.info("Obteniendo empleados (services.database.obtener_empleados) para cache...")
-        empleados = obtener_empleados()
-        if not empleados:
+        logger.info("Construyendo empleados_cache.parquet desde SQLite (columnar, en lotes)...")
+        with conectar_db("empleados") as conexion:
+            total = extraer_en_lotes(
+                conexion.cursor(),
+                "SELECT empleado_d365, id_puesto, email, nombre_completo, numero_sap FROM empleados",
+                COLUMNAS_EMPLEADOS, destino_parquet=CACHE_FILE_EMPLEADOS, nombre="cache_empleados",
+            )
+        if not total:
             logger.warning("No se encontraron empleados para cache.")
             return
-        keys = empleados[0].keys()
-        data = {k: [row.get(k) for row in empleados] for k in keys}
-        table = pa.Table.from_pydict(data)
-        pq.write_table(table, CACHE_FILE_EMPLEADOS)
+        publicar_tabla(CACHE_FILE_EMPLEADOS)
         logger.info("Caché empleados actualizada.")
     except Exception as e:
         logger.error(f"Error actualizar_cache_empleados: {e}", exc_info=True)
@@ -169,16 +307,17 @@ def actualizar_cache_empleados():
 def actualizar_cache_atributos():
     """Construye el parquet de atributos desde la DB local."""
     try:
-        logger.info("Obteniendo atributos (services.database.obtener_todos_atributos) para cache...")
-        atributos = obtener_todos_atributos()
-        if not atributos:
+        logger.info("Reconstruyendo atributos_cache.parquet desde SQLite (lectura en lotes)...")
+        with conectar_db("atributos") as conexion:
+            total = extraer_en_lotes(
+                conexion.cursor(),
+                "SELECT product_number, product_name, attribute_name, attribute_value FROM atributos",
+                COLUMNAS_ATRIBUTOS, destino_parquet=CACHE_FILE_ATRIBUTOS, nombre="cache_atributos",
+            )
+        if not total:
             logger.warning("No se encontraron atributos para cache.")
             return
-        keys = atributos[0].keys()
-        data = {k: [row.get(k) for row in atributos] for k in keys}
-        table = pa.Table.from_pydict(data)
-        pq.write_table(table, CACHE_FILE_ATRIBUTOS)
-        load_atributos_to_memory.cache_clear()
+        publicar_tabla(CACHE_FILE_ATRIBUTOS)
         logger.info("Caché atributos actualizada.")
     except Exception as e:
         logger.error(f"Error actualizar_cache_atributos: {e}", exc_info=True)
@@ -194,16 +333,11 @@ def actualizar_cache_codigos_postales():
     Columnas: AddressZipCode, AddressCountryRegionId, AddressState, AddressCounty, AddressCity, CountyName
     """
     try:
-        logger.info("Obteniendo padrón de códigos postales desde Fabric...")
-        rows = obtener_codigos_postales_fabric() or []
-        if not rows:
+        logger.info("Exportando padrón de códigos postales desde Fabric (lectura en lotes)...")
+        if not obtener_codigos_postales_fabric(CACHE_FILE_CODIGOS_POSTALES):
             logger.warning("No se obtuvieron códigos postales para cache.")
             return
-        # Normalizar a pydict de listas
-        keys = list(rows[0].keys())
-        data = {k: [r.get(k) for r in rows] for k in keys}
-        table = pa.Table.from_pydict(data)
-        pq.write_table(table, CACHE_FILE_CODIGOS_POSTALES)
+        publicar_tabla(CACHE_FILE_CODIGOS_POSTALES)
         logger.info("Caché de códigos postales actualizada.")
     except Exception as e:
         logger.error(f"Error actualizar_cache_codigos_postales: {e}", exc_info=True)
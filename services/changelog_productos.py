@@ -0,0 +1,211 @@
+# services/changelog_productos.py
+"""
+Change log del catálogo de productos para la sincronización delta de los POS.
+
+Cada refresco del Parquet que trae cambios (``CambiosCatalogo``) se persiste como
+un Parquet chico en ``CAMBIOS_PRODUCTOS_DIR`` llamado
+``cambios_<desde>_<hasta>.parquet`` (versiones = mtime del catálogo en ms), con
+una columna ``_op`` (``insert``/``update``/``delete``). Al estar en disco lo
+comparten todos los procesos web, no solo el que corre el scheduler.
+
+El archivo se escribe antes de publicar el Parquet nuevo (``actualizar_cache_productos``):
+un worker que ya ve la versión nueva encuentra el eslabón que lleva a ella.
+
+``obtener_cambios_desde`` encadena los archivos desde la versión del cliente
+hasta la actual y compone el resultado por tienda; si falta algún eslabón (versión
+muy vieja, log purgado) o el delta es demasiado grande, pide resincronización total.
+Las composiciones se cachean por lista de archivos de la cadena (nunca una cadena
+rota) con un tope total de filas (``CAMBIOS_CACHE_MAX_FILAS``).
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from services.config import CACHE_FILE_PRODUCTOS, CAMBIOS_PRODUCTOS_DIR
+from services.delta_productos import CLAVES_PRODUCTO, CambiosCatalogo
+from services.formato_moneda import formatear_columnas_ars
+from services.guarda_publicacion import verificar_publicacion
+from services.indice_productos import COLUMNAS_MONEDA
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# Cantidad de refrescos que se conservan (72 x 20 min = 24 h)
+CAMBIOS_RETENCION = int(os.getenv("PRODUCTOS_CAMBIOS_RETENCION", "72"))
+# Por encima de esta cantidad de filas conviene bajar el catálogo completo
+CAMBIOS_MAX_FILAS = int(os.getenv("PRODUCTOS_CAMBIOS_MAX_FILAS", "20000"))
+# Filas (productos por tienda) que se conservan entre todas las composiciones cacheadas
+CAMBIOS_CACHE_MAX_FILAS = int(os.getenv("PRODUCTOS_CAMBIOS_CACHE_MAX_FILAS", "100000"))
+
+_PATRON_ARCHIVO = re.compile(r"^cambios_(\d+)_(\d+)\.parquet$")
+
+
+def version_ms(version: float) -> int:
+    """Versión del catálogo (mtime en segundos) normalizada a milisegundos enteros."""
+    return int(round(float(version) * 1000))
+
+
+def version_actual() -> float:
+    return os.path.getmtime(CACHE_FILE_PRODUCTOS) if os.path.exists(CACHE_FILE_PRODUCTOS) else 0.0
+
+
+def _tabla_cambios(cambios: CambiosCatalogo) -> pa.Table:
+    partes = []
+    for op, tabla in (("insert", cambios.agregados), ("update", cambios.modificados)):
+        if tabla.num_rows:
+            partes.append(tabla.append_column("_op", pa.array([op] * tabla.num_rows, type=pa.string())))
+    if cambios.eliminados.num_rows:
+        eliminados = cambios.eliminados.select(CLAVES_PRODUCTO)
+        partes.append(eliminados.append_column("_op", pa.array(["delete"] * eliminados.num_rows, type=pa.string())))
+    if not partes:
+        return pa.table({c: pa.array([], type=pa.string()) for c in CLAVES_PRODUCTO + ["_op"]})
+    return pa.concat_tables(partes, promote_options="permissive")
+
+
+def _archivos() -> List[Tuple[int, int, str]]:
+    if not os.path.isdir(CAMBIOS_PRODUCTOS_DIR):
+        return []
+    salida = []
+    for nombre in os.listdir(CAMBIOS_PRODUCTOS_DIR):
+        m = _PATRON_ARCHIVO.match(nombre)
+        if m:
+            salida.append((int(m.group(1)), int(m.group(2)), os.path.join(CAMBIOS_PRODUCTOS_DIR, nombre)))
+    return sorted(salida, key=lambda t: t[1])
+
+
+def registrar_cambios_productos(cambios: CambiosCatalogo):
+    """Listener de ``actualizar_cache_productos``: agrega el refresco al change log y purga lo viejo."""
+    if cambios.version_anterior is None:
+        # Primera descarga: no hay versión previa desde la cual sincronizar
+        return
+    desde, hasta = version_ms(cambios.version_anterior), version_ms(cambios.version)
+    os.makedirs(CAMBIOS_PRODUCTOS_DIR, exist_ok=True)
+    destino = os.path.join(CAMBIOS_PRODUCTOS_DIR, f"cambios_{desde}_{hasta}.parquet")
+    tmp = f"{destino}.tmp"
+    try:
+        pq.write_table(_tabla_cambios(cambios), tmp)
+        verificar_publicacion("change log productos")
+        os.replace(tmp, destino)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logger.info(f"Change log productos {desde}->{hasta}: {cambios.resumen()}")
+
+    for _, _, path in _archivos()[:-CAMBIOS_RETENCION]:
+        try:
+            os.remove(path)
+        except OSError:
+            logger.warning(f"No se pudo purgar {path}", exc_info=True)
+
+
+def _cadena(desde: int, hasta: int) -> Optional[List[str]]:
+    """Archivos que llevan de ``desde`` a ``hasta`` en orden, o None si la cadena está rota."""
+    siguiente: Dict[int, Tuple[int, str]] = {d: (h, p) for d, h, p in _archivos()}
+    cadena, actual = [], desde
+    while actual != hasta:
+        paso = siguiente.get(actual)
+        if paso is None or paso[0] <= actual:
+            return None
+        actual, path = paso
+        cadena.append(path)
+    return cadena
+
+
+def _componer_cadena(cadena: List[str], store: Optional[str]) -> Optional[Dict[str, dict]]:
+    # (producto, tienda) -> (op, fila); se aplica cada refresco en orden
+    estado: Dict[Tuple[str, str], Tuple[str, Optional[dict]]] = {}
+    for path in cadena:
+        tabla = pq.read_table(path, filters=[("store_number", "=", store)] if store else None)
+        if tabla.num_rows + len(estado) > CAMBIOS_MAX_FILAS:
+            return None
+        tabla = formatear_columnas_ars(tabla, COLUMNAS_MONEDA)
+        for fila in tabla.to_pylist():
+            op = fila.pop("_op")
+            clave = (str(fila.get("numero_producto")), str(fila.get("store_number")))
+            previo = estado.get(clave, (None, None))[0]
+            if op == "delete":
+                estado[clave] = ("delete", None)
+            elif previo == "insert" or (previo is None and op == "insert"):
+                estado[clave] = ("insert", fila)
+            else:
+                # update, o re-alta de algo que el cliente ya tenía antes del delete
+                estado[clave] = ("update", fila)
+
+    por_tienda: Dict[str, dict] = {}
+    for (numero, tienda), (op, fila) in estado.items():
+        grupo = por_tienda.setdefault(tienda, {"inserted": [], "updated": [], "deleted": []})
+        if op == "delete":
+            grupo["deleted"].append(numero)
+        else:
+            grupo["inserted" if op == "insert" else "updated"].append(fila)
+    return por_tienda
+
+
+_cache_lock = threading.Lock()
+# (archivos de la cadena, tienda) -> (cambios por tienda, filas)
+_cache: "OrderedDict[Tuple[Tuple[str, ...], Optional[str]], Tuple[Dict[str, dict], int]]" = OrderedDict()
+_cache_filas = 0
+
+
+def limpiar_cache_cambios():
+    global _cache_filas
+    with _cache_lock:
+        _cache.clear()
+        _cache_filas = 0
+
+
+def _componer(desde: int, hasta: int, store: Optional[str]) -> Optional[Dict[str, dict]]:
+    """Cambios por tienda de ``desde`` a ``hasta``, o None (cadena rota o delta demasiado grande)."""
+    global _cache_filas
+    cadena = _cadena(desde, hasta)
+    if cadena is None:
+        return None
+    clave = (tuple(cadena), store)
+    with _cache_lock:
+        cacheado = _cache.get(clave)
+        if cacheado is not None:
+            _cache.move_to_end(clave)
+            return cacheado[0]
+
+    por_tienda = _componer_cadena(cadena, store)
+    if por_tienda is None:
+        return None
+    # Una composición vacía también ocupa una entrada
+    filas = max(1, sum(len(g["inserted"]) + len(g["updated"]) + len(g["deleted"]) for g in por_tienda.values()))
+    with _cache_lock:
+        if clave not in _cache and filas <= CAMBIOS_CACHE_MAX_FILAS:
+            _cache[clave] = (por_tienda, filas)
+            _cache_filas += filas
+            while _cache_filas > CAMBIOS_CACHE_MAX_FILAS:
+                _, (_, descartadas) = _cache.popitem(last=False)
+                _cache_filas -= descartadas
+    return por_tienda
+
+
+def obtener_cambios_desde(since: float, store: Optional[str] = None) -> dict:
+    """Cambios del catálogo desde la versión ``since`` (opcionalmente de una sola tienda).
+
+    Devuelve ``{"version", "since", "full_resync", "stores"}``; con ``full_resync``
+    en True el cliente debe volver a pedir ``/api/productos`` completo.
+    """
+    actual = version_actual()
+    respuesta = {"version": actual, "since": since, "full_resync": False, "stores": {}}
+    desde, hasta = version_ms(since), version_ms(actual)
+    if desde == hasta:
+        return respuesta
+    if desde > hasta or not actual:
+        respuesta["full_resync"] = True
+        return respuesta
+
+    por_tienda = _componer(desde, hasta, store or None)
+    if por_tienda is None:
+        respuesta["full_resync"] = True
+    else:
+        respuesta["stores"] = por_tienda
+    return respuesta
@@ -0,0 +1,110 @@
+# services/cliente_d365.py
+"""
+Cliente HTTP de larga vida para la API OData de D365.
+
+Antes cada ``run_*`` de ``services.d365_interface`` hacía ``asyncio.run`` con un
+``httpx.AsyncClient`` nuevo: event loop, DNS y handshake TLS en cada request.
+Ahora el proceso tiene un único event loop en un hilo de fondo con un
+``httpx.AsyncClient`` compartido:
+
+- pool de conexiones keep-alive (HTTP/2 si está instalado ``h2``, si no HTTP/1.1);
+- los wrappers síncronos envían la corrutina al loop con
+  ``run_coroutine_threadsafe`` y esperan el resultado (``ejecutar``);
+- las corrutinas pueden lanzar pedidos independientes en paralelo con
+  ``asyncio.gather`` sobre las mismas conexiones;
+- un 401 se reintenta una vez con el token renovado (``services.token_d365.AuthD365``).
+
+El loop se crea al primer uso y se recrea en el hijo tras un ``fork``.
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from services.logging_utils import get_module_logger
+from services.token_d365 import AuthD365
+
+logger = get_module_logger(__name__)
+
+D365_MAX_CONEXIONES = int(os.getenv("D365_MAX_CONEXIONES", "20"))
+D365_MAX_KEEPALIVE = int(os.getenv("D365_MAX_KEEPALIVE", "10"))
+D365_KEEPALIVE_EXPIRY = float(os.getenv("D365_KEEPALIVE_EXPIRY", "120"))
+# HTTP/2 requiere el extra httpx[http2] (paquete h2)
+D365_HTTP2 = os.getenv("D365_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+
+class ClienteD365:
+    """Event loop en un hilo de fondo + ``httpx.AsyncClient`` compartido."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hilo: Optional[threading.Thread] = None
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _iniciar(self) -> asyncio.AbstractEventLoop:
+        loop = self._loop
+        if loop is not None:
+            return loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._hilo = threading.Thread(target=loop.run_forever, name="d365-loop", daemon=True)
+                self._hilo.start()
+                self._loop = loop
+                logger.info(f"Cliente D365 iniciado (http2={D365_HTTP2}, max_conexiones={D365_MAX_CONEXIONES})")
+            return self._loop
+
+    def http(self) -> httpx.AsyncClient:
+        """Cliente compartido; solo debe usarse desde el loop de fondo."""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                http2=D365_HTTP2,
+                auth=AuthD365(),
+                limits=httpx.Limits(max_connections=D365_MAX_CONEXIONES,
+                                    max_keepalive_connections=D365_MAX_KEEPALIVE,
+                                    keepalive_expiry=D365_KEEPALIVE_EXPIRY),
+            )
+        return self._http
+
+    def ejecutar(self, coro, timeout: Optional[float] = None):
+        """Corre ``coro`` en el loop de fondo y devuelve su resultado (bloquea el hilo que llama)."""
+        loop = self._iniciar()
+        if self._hilo is threading.current_thread():
+            coro.close()
+            raise RuntimeError("ejecutar() llamado desde el propio loop de D365: usar await")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def cerrar(self):
+        with self._lock:
+            loop, http = self._loop, self._http
+            self._loop = self._hilo = self._http = None
+        if loop is None:
+            return
+        if http is not None:
+            asyncio.run_coroutine_threadsafe(http.aclose(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def reiniciar_tras_fork(self):
+        # El hilo del loop no sobrevive al fork y las conexiones TLS no se comparten
+        self._lock = threading.Lock()
+        self._loop = self._hilo = self._http = None
+
+
+cliente_d365 = ClienteD365()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=cliente_d365.reiniciar_tras_fork)
+
+
+@asynccontextmanager
+async def cliente_http():
+    """``async with cliente_http() as client``: el cliente compartido (no se cierra al salir)."""
+    yield cliente_d365.http()
+
+
+def ejecutar_d365(coro, timeout: Optional[float] = None):
+    return cliente_d365.ejecutar(coro, timeout)
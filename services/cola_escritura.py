@@ -0,0 +1,180 @@
+# services/cola_escritura.py
+"""
+Cola de escritura única por base SQLite.
+
+Los escritores de ``services.database`` ya no abren su propia transacción ni
+reintentan con ``time.sleep`` ante ``database is locked``: encolan una función
+``fn(cursor, *args)`` y esperan un ``Future``. Un hilo dedicado por base:
+
+- toma el primer trabajo y junta los que ya esperan (hasta ``ESCRITURA_MAX_LOTE``);
+- abre una sola transacción ``BEGIN IMMEDIATE`` para todo el lote (group commit);
+- aísla cada trabajo en un ``SAVEPOINT``: si uno falla se revierte solo ese;
+- hace un único ``COMMIT`` y recién entonces resuelve los futures.
+
+Si ``escribir`` se cansa de esperar, cancela el trabajo mientras siga en la cola
+(no se ejecuta nunca); si el escritor ya lo tomó, espera su resultado: una
+escritura no se informa como fallida si termina confirmada.
+
+Dentro del proceso la contención se vuelve una cola acotada; entre procesos la
+espera la resuelve el ``busy_timeout`` de SQLite (``SQLITE_TIMEOUT``).
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict
+
+from services.logging_utils import get_module_logger
+from services.pool_sqlite import pool_sqlite
+
+logger = get_module_logger(__name__)
+
+ESCRITURA_MAX_LOTE = int(os.getenv("ESCRITURA_MAX_LOTE", "64"))
+# Tiempo máximo que un request espera su escritura antes de dar error
+ESCRITURA_TIMEOUT = float(os.getenv("ESCRITURA_TIMEOUT", "30"))
+
+
+class _Trabajo:
+    __slots__ = ("fn", "args", "future", "encolado")
+
+    def __init__(self, fn: Callable, args: tuple):
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.encolado = time.monotonic()
+
+
+class ColaEscritura:
+    """Un hilo escritor por archivo SQLite con commit agrupado."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._cola: "queue.Queue[_Trabajo]" = queue.Queue()
+        self._hilo = threading.Thread(target=self._bucle, name=f"sqlite-writer-{os.path.basename(path)}",
+                                      daemon=True)
+        self._lock = threading.Lock()
+        self._metricas = {"jobs": 0, "batches": 0, "max_batch": 0, "errors": 0, "cancelled": 0,
+                          "wait_seconds": 0.0}
+        self._hilo.start()
+
+    def enviar(self, fn: Callable, *args) -> Future:
+        """Encola ``fn(cursor, *args)``; el future devuelve su resultado tras el COMMIT."""
+        if threading.current_thread() is self._hilo:
+            # Escritura anidada desde el propio hilo escritor: no puede esperar a la cola
+            raise RuntimeError("Escritura anidada en la cola de escritura")
+        trabajo = _Trabajo(fn, args)
+        self._cola.put(trabajo)
+        return trabajo.future
+
+    def _tomar(self, trabajo: _Trabajo, lote: list):
+        # Desde acá el trabajo ya no se puede cancelar; los cancelados por timeout se saltean
+        if trabajo.future.set_running_or_notify_cancel():
+            lote.append(trabajo)
+        else:
+            with self._lock:
+                self._metricas["cancelled"] += 1
+
+    def _lote(self):
+        lote = []
+        while not lote:
+            self._tomar(self._cola.get(), lote)
+        while len(lote) < ESCRITURA_MAX_LOTE:
+            try:
+                self._tomar(self._cola.get_nowait(), lote)
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._lote()
+            inicio = time.monotonic()
+            resultados = []
+            try:
+                with pool_sqlite.conexion(self.path) as conexion:
+                    cursor = conexion.cursor()
+                    cursor.execute("BEGIN IMMEDIATE;")
+                    try:
+                        for trabajo in lote:
+                            cursor.execute("SAVEPOINT trabajo;")
+                            try:
+                                resultado = (True, trabajo.fn(cursor, *trabajo.args))
+                                cursor.execute("RELEASE trabajo;")
+                            except Exception as e:
+                                cursor.execute("ROLLBACK TO trabajo;")
+                                cursor.execute("RELEASE trabajo;")
+                                resultado = (False, e)
+                            resultados.append(resultado)
+                        conexion.commit()
+                    except Exception:
+                        conexion.rollback()
+                        raise
+            except Exception as e:
+                logger.error(f"Lote de escritura ({len(lote)} trabajos) revertido en {self.path}: {e}")
+                resultados = [(False, e)] * len(lote)
+
+            with self._lock:
+                self._metricas["jobs"] += len(lote)
+                self._metricas["batches"] += 1
+                self._metricas["max_batch"] = max(self._metricas["max_batch"], len(lote))
+                self._metricas["wait_seconds"] += sum(inicio - t.encolado for t in lote)
+                self._metricas["errors"] += sum(1 for ok, _ in resultados if not ok)
+            for trabajo, (ok, valor) in zip(lote, resultados):
+                if ok:
+                    trabajo.future.set_result(valor)
+                else:
+                    trabajo.future.set_exception(valor)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            datos = dict(self._metricas)
+        datos["pending"] = self._cola.qsize()
+        return datos
+
+
+_colas: Dict[str, ColaEscritura] = {}
+_colas_lock = threading.Lock()
+
+
+def cola_escritura(path: str) -> ColaEscritura:
+    cola = _colas.get(path)
+    if cola is None:
+        with _colas_lock:
+            cola = _colas.get(path)
+            if cola is None:
+                cola = _colas[path] = ColaEscritura(path)
+    return cola
+
+
+def escribir(path: str, fn: Callable, *args, timeout: float = ESCRITURA_TIMEOUT):
+    """Ejecuta ``fn(cursor, *args)`` en la cola de escritura de ``path`` y devuelve su resultado.
+
+    Los errores de ``fn`` se propagan tal cual. Si el trabajo sigue en la cola tras
+    ``timeout`` se cancela (no se ejecutará) y se lanza ``sqlite3.OperationalError``
+    (mismo tipo que un lock vencido); si ya se está ejecutando se espera su resultado.
+    """
+    future = cola_escritura(path).enviar(fn, *args)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        if future.cancel():
+            raise sqlite3.OperationalError(f"Cola de escritura sin respuesta tras {timeout:.0f}s")
+        logger.warning(f"Escritura en {os.path.basename(path)} en curso tras {timeout:.0f}s; se espera su COMMIT")
+        return future.result()
+
+
+def _reiniciar_tras_fork():
+    # Los hilos escritores no sobreviven al fork: cada hijo crea los suyos
+    global _colas_lock
+    _colas.clear()
+    _colas_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def metricas_escritura() -> dict:
+    return {os.path.basename(p): c.metricas() for p, c in list(_colas.items())}
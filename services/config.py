@@ -10,3 +10,5 @@ CACHE_FILE_CLIENTES = os.path.join(CACHE_DIR, 'clientes_cache.parquet')
 CACHE_FILE_EMPLEADOS = os.path.join(CACHE_DIR, 'empleados_cache.parquet')
 CACHE_FILE_ATRIBUTOS = os.path.join(CACHE_DIR, 'atributos_cache.parquet')
 CACHE_FILE_CODIGOS_POSTALES = os.path.join(CACHE_DIR, 'codigos_postales_cache.parquet')
+# Change log del catálogo de productos (un Parquet por refresco)
+CAMBIOS_PRODUCTOS_DIR = os.path.join(CACHE_DIR, 'productos_cambios')
@@ -5,6 +5,8 @@ from services.email_service import enviar_correo_fallo
 from services.database import obtener_contador_presupuesto
 import configparser
 from services.logging_utils import get_module_logger
+from services.cliente_d365 import cliente_http, ejecutar_d365
+from services.odata_batch import ParteBatch, ParserBatch, resultados_por_operacion, truncar
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(ROOT_DIR)), 'config.ini')
@@ -15,6 +17,9 @@ config.read(CONFIG_PATH)
 
 logger = get_module_logger(__name__)
 
+# Respuestas de D365 que indican una falla transitoria (se puede reintentar)
+STATUS_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
 def load_d365_config():
     if 'd365' not in config:
         raise KeyError("La sección 'd365' no se encuentra en config.ini")
@@ -40,50 +45,122 @@ def generar_referencia_presupuesto():
         logger.error(error)
         return f"BUSCADOR-ERROR-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"  # Fallback en caso de fallo
 
-async def crear_presupuesto_batch(datos_cabecera, lineas, access_token):
-    logger.info(f"Datos recibidos para crear presupuesto: cabecera={datos_cabecera}, lineas={lineas}")
-    if not datos_cabecera or not lineas or not access_token:
-        error = "Datos o token inválidos."
-        enviar_correo_fallo("crear_presupuesto_batch", error)
-        return None, error
+def _payload_cabecera_presupuesto(datos_cabecera, referencia):
+    fecha_actual = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    fecha_expiracion = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "dataAreaId": "uni",
+        "CashDiscountPercentage": 0,
+        "CurrencyCode": "ARS",
+        "SalesQuotationTypeId": datos_cabecera.get("tipo_presupuesto", "Caja"),
+        "DefaultShippingSiteId": datos_cabecera.get("sitio", ""),
+        "DefaultShippingWarehouseId": datos_cabecera.get("almacen_retiro", ""),
+        "FixedExchangeRate": 0,
+        "InvoiceCustomerAccountNumber": datos_cabecera.get("id_cliente", ""),
+        "QuotationResponsiblePersonnelNumber": datos_cabecera.get("id_empleado", ""),
+        "QuotationTakerPersonnelNumber": datos_cabecera.get("id_empleado", ""),
+        "ReportingCurrencyFixedExchangeRate": 0,
+        "RequestingCustomerAccountNumber": datos_cabecera.get("id_cliente", ""),
+        "TotalDiscountPercentage": 0,
+        "DeliveryModeCode": "Ret Suc",
+        "CustomersReference": datos_cabecera.get("observaciones", ""),
+        "SalesOrderOriginCode": datos_cabecera.get("store_id", ""),
+        "DeliveryAddressLocationId": datos_cabecera.get("id_direccion", ""),
+        "ReceiptDateRequested": fecha_actual,
+        "RequestedShippingDate": fecha_actual,
+        "SalesQuotationExpiryDate": fecha_expiracion,
+        "CustomerRequisitionNumber": referencia,
+        "SkipOpportunityCreationPrompt": "Yes"
+    }
 
+async def buscar_presupuesto_por_referencia(referencia, access_token):
+    """SalesQuotationNumber de la cabecera con ese CustomerRequisitionNumber (clave de idempotencia), o None."""
     d365_config = load_d365_config()
-    async with httpx.AsyncClient() as client:
-        # Paso 1: Crear la cabecera individualmente
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        fecha_actual = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-        fecha_expiracion = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
-        referencia = generar_referencia_presupuesto()
+    url = f"{d365_config['client_prod']}/data/SalesQuotationHeadersV2?$filter=CustomerRequisitionNumber eq '{referencia}'&$select=SalesQuotationNumber"
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {access_token}'}
+    async with cliente_http() as client:
+        try:
+            response = await client.get(url, headers=headers, timeout=httpx.Timeout(30))
+            response.raise_for_status()
+            valores = response.json().get("value", [])
+            return (valores[0].get("SalesQuotationNumber") if valores else None), None
+        except httpx.HTTPStatusError as e:
+            return None, f"Error HTTP al buscar presupuesto {referencia}: {e}, Respuesta: {e.response.text}"
+        except Exception as e:
+            return None, f"Error al buscar presupuesto {referencia}: {str(e)}"
 
-        cabecera_payload = {
-            "dataAreaId": "uni",
-            "CashDiscountPercentage": 0,
-            "CurrencyCode": "ARS",
-            "SalesQuotationTypeId": datos_cabecera.get("tipo_presupuesto", "Caja"),
-            "DefaultShippingSiteId": datos_cabecera.get("sitio", ""),
-            "DefaultShippingWarehouseId": datos_cabecera.get("almacen_retiro", ""),
-            "FixedExchangeRate": 0,
-            "InvoiceCustomerAccountNumber": datos_cabecera.get("id_cliente", ""),
-            "QuotationResponsiblePersonnelNumber": datos_cabecera.get("id_empleado", ""),
-            "QuotationTakerPersonnelNumber": datos_cabecera.get("id_empleado", ""),
-            "ReportingCurrencyFixedExchangeRate": 0,
-            "RequestingCustomerAccountNumber": datos_cabecera.get("id_cliente", ""),
-            "TotalDiscountPercentage": 0,
-            "DeliveryModeCode": "Ret Suc",
-            "CustomersReference": datos_cabecera.get("observaciones", ""),
-            "SalesOrderOriginCode": datos_cabecera.get("store_id", ""),
-            "DeliveryAddressLocationId": datos_cabecera.get("id_direccion", ""),
-            "ReceiptDateRequested": fecha_actual,
-            "RequestedShippingDate": fecha_actual,
-            "SalesQuotationExpiryDate": fecha_expiracion,
-            "CustomerRequisitionNumber": referencia,
-            "SkipOpportunityCreationPrompt": "Yes"
-        }
-        logger.info(f"Enviando cabecera a {d365_config['client_prod']}/data/SalesQuotationHeadersV2: {json.dumps(cabecera_payload)}")
+async def listar_articulos_presupuesto(sales_quotation_number, access_token):
+    """ItemNumber de cada línea que ya tiene el presupuesto en D365, o None si no se pudo consultar."""
+    d365_config = load_d365_config()
+    url = f"{d365_config['client_prod']}/data/SalesQuotationLines?$filter=SalesQuotationNumber eq '{sales_quotation_number}'&$select=ItemNumber"
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {access_token}'}
+    async with cliente_http() as client:
+        try:
+            response = await client.get(url, headers=headers, timeout=httpx.Timeout(30))
+            response.raise_for_status()
+            return [v.get("ItemNumber") for v in response.json().get("value", [])]
+        except Exception as e:
+            logger.warning(f"No se pudieron listar las líneas de {sales_quotation_number}: {e}")
+            return None
+
+async def _enviar_batch(client, url, headers, body, grupos, timeout, que):
+    """POST de un ``$batch`` leyendo la respuesta en streaming.
 
+    Devuelve ``(resultados, error)``: ``resultados`` es ``Content-ID -> ParteBatch``
+    para todas las operaciones de ``grupos``. Si falla el pedido entero, todas las
+    operaciones llevan ese status (0 si no se sabe si D365 lo aplicó: red o 5xx).
+    """
+    logger.debug(f"Cuerpo del lote OData ({que}): {body}")
+    try:
+        async with client.stream("POST", url, headers=headers, content=body, timeout=httpx.Timeout(timeout)) as response:
+            if response.status_code >= 400:
+                texto = (await response.aread()).decode("utf-8", errors="replace")
+                status = 0 if response.status_code >= 500 else response.status_code
+                error = f"Error HTTP {response.status_code} en el lote ({que}): {truncar(texto)}"
+                logger.error(error)
+                logger.debug(f"Respuesta completa del lote ({que}): {texto}")
+                return _fallo_total(grupos, status, response.reason_phrase, truncar(texto)), error
+            parser = ParserBatch(response.headers.get("content-type", ""))
+            async for trozo in response.aiter_bytes():
+                parser.alimentar(trozo)
+            partes = parser.terminar()
+    except (httpx.TransportError, ValueError) as e:
+        error = f"Error de red / respuesta inválida en el lote ({que}): {str(e)}"
+        logger.error(error)
+        return _fallo_total(grupos, 0, str(e), None), error
+
+    resultados = resultados_por_operacion(partes, grupos)
+    fallidas = {cid: parte for cid, parte in resultados.items() if not parte.ok}
+    logger.info(f"Lote OData ({que}): {len(resultados)} operaciones, {len(fallidas)} con error")
+    if not fallidas:
+        return resultados, None
+    for cid, parte in fallidas.items():
+        logger.warning(f"Operación {cid} del lote ({que}): {parte.status} {parte.motivo} {truncar(parte.cuerpo)}")
+    error = f"{len(fallidas)} operación/es con error en el lote ({que})"
+    return resultados, error
+
+def _fallo_total(grupos, status, motivo, cuerpo):
+    return {cid: ParteBatch(grupo=i, content_id=cid, status=status, motivo=motivo or "", cuerpo=cuerpo)
+            for i, grupo in enumerate(grupos) for cid in grupo}
+
+async def crear_cabecera_presupuesto(datos_cabecera, referencia, access_token):
+    """Crea la cabecera con ``referencia`` como CustomerRequisitionNumber.
+
+    Devuelve ``(SalesQuotationNumber, error, reintentable)``. ``reintentable`` es
+    True si la falla es transitoria o no se sabe si D365 creó la cabecera (red,
+    timeout, 408/429/5xx, respuesta sin número): hay que buscarla por ``referencia``
+    antes de volver a crearla.
+    """
+    d365_config = load_d365_config()
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {access_token}'
+    }
+    cabecera_payload = _payload_cabecera_presupuesto(datos_cabecera, referencia)
+    logger.info(f"Enviando cabecera {referencia} a {d365_config['client_prod']}/data/SalesQuotationHeadersV2")
+    logger.debug(f"Cabecera {referencia}: {json.dumps(cabecera_payload)}")
+
+    async with cliente_http() as client:
         try:
             response = await client.post(
                 f"{d365_config['client_prod']}/data/SalesQuotationHeadersV2",
@@ -93,109 +170,107 @@ async def crear_presupuesto_batch(datos_cabecera, lineas, access_token):
             )
             response.raise_for_status()
             data = response.json()
-            logger.info(f"Respuesta de cabecera completa: status={response.status_code}, body={response.text}")
             sales_quotation_number = data.get("SalesQuotationNumber")
-            logger.info(f"Intento de extraer SalesQuotationNumber: {sales_quotation_number}")
             if not sales_quotation_number:
                 error = "No se obtuvo SalesQuotationNumber en la respuesta de la cabecera."
-                logger.error(f"{error} Respuesta completa: {response.text}")
-                enviar_correo_fallo("crear_presupuesto_batch", f"{error} Respuesta: {response.text}")
-                return None, error
-            logger.info(f"Cabecera creada exitosamente: {sales_quotation_number}")
+                logger.error(f"{error} Respuesta completa: {truncar(response.text)}")
+                return None, error, True
+            logger.info(f"Cabecera creada exitosamente: {sales_quotation_number} ({referencia})")
+            return sales_quotation_number, None, False
         except httpx.HTTPStatusError as e:
-            error = f"Error HTTP al crear cabecera: {e}, Respuesta: {e.response.text}"
+            error = f"Error HTTP al crear cabecera: {e}, Respuesta: {truncar(e.response.text)}"
             logger.error(error)
-            enviar_correo_fallo("crear_presupuesto_batch", error)
-            return None, error
+            reintentable = e.response.status_code in STATUS_REINTENTABLES
+            if not reintentable:
+                enviar_correo_fallo("crear_presupuesto_batch", error)
+            return None, error, reintentable
         except Exception as e:
-            error = f"Error al crear cabecera: {str(e)}, Respuesta: {response.text if 'response' in locals() else 'N/A'}"
+            # Red, timeout o respuesta ilegible: la cabecera pudo haberse creado
+            error = f"Error al crear cabecera: {str(e)}"
             logger.error(error)
-            enviar_correo_fallo("crear_presupuesto_batch", error)
-            return None, error
+            return None, error, True
 
-        # Paso 2: Crear las líneas en un lote
-        batch_url = f"{d365_config['client_prod']}/data/$batch"
-        batch_boundary = f"batch_{uuid.uuid4()}"
-        changeset_boundary = f"changeset_{uuid.uuid4()}"
+async def crear_lineas_presupuesto(sales_quotation_number, lineas, access_token):
+    """Crea las líneas en un $batch con un changeset por línea (cada una se aplica o falla sola).
 
-        batch_headers = {
-            'Content-Type': f'multipart/mixed; boundary={batch_boundary}',
-            'Authorization': f'Bearer {access_token}'
-        }
+    Devuelve ``(fallidas, error)``: ``fallidas`` es ``índice en lineas -> ParteBatch``
+    con el status y el cuerpo del error de cada línea no creada (status 0: no se
+    sabe si D365 la aplicó); ``error`` es None si se crearon todas.
+    """
+    d365_config = load_d365_config()
+    batch_url = f"{d365_config['client_prod']}/data/$batch"
+    batch_boundary = f"batch_{uuid.uuid4()}"
 
-        batch_body = [
+    batch_headers = {
+        'Content-Type': f'multipart/mixed; boundary={batch_boundary}',
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    batch_body = []
+    grupos = []
+    for i, linea in enumerate(lineas):
+        content_id_linea = str(i + 1)
+        changeset_boundary = f"changeset_{uuid.uuid4()}"
+        linea_payload = {
+            "dataAreaId": "uni",
+            "ItemNumber": linea.get('articulo', ''),
+            "LineDiscountPercentage": 0,
+            "RequestedSalesQuantity": linea.get('cantidad', 0),
+            "SalesPrice": linea.get('precio', 0),
+            "SalesQuotationNumber": sales_quotation_number,
+            "ShippingSiteId": linea.get('sitio', ''),
+            "ShippingWarehouseId": linea.get('almacen_entrega', '')
+        }
+        batch_body.extend([
             f"--{batch_boundary}",
             f"Content-Type: multipart/mixed; boundary={changeset_boundary}",
-            ""
-        ]
-
-        for i, linea in enumerate(lineas):
-            content_id_linea = str(uuid.uuid4())
-            linea_payload = {
-                "dataAreaId": "uni",
-                "ItemNumber": linea.get('articulo', ''),
-                "LineDiscountPercentage": 0,
-                "RequestedSalesQuantity": linea.get('cantidad', 0),
-                "SalesPrice": linea.get('precio', 0),
-                "SalesQuotationNumber": sales_quotation_number,
-                "ShippingSiteId": linea.get('sitio', ''),
-                "ShippingWarehouseId": linea.get('almacen_entrega', '')
-            }
-            batch_body.extend([
-                f"--{changeset_boundary}",
-                "Content-Type: application/http",
-                "Content-Transfer-Encoding: binary",
-                f"Content-ID: {content_id_linea}",
-                "",
-                f"POST {d365_config['client_prod']}/data/SalesQuotationLines HTTP/1.1",
-                "Content-Type: application/json",
-                "",
-                json.dumps(linea_payload)
-            ])
-
-        batch_body.extend([f"--{changeset_boundary}--", f"--{batch_boundary}--"])
-        batch_body_str = "\r\n".join(batch_body)
-        logger.info(f"Cuerpo del lote OData para líneas: {batch_body_str}")
-
-        try:
-            response = await client.post(
-                batch_url,
-                headers=batch_headers,
-                data=batch_body_str,
-                timeout=httpx.Timeout(120)
-            )
-            logger.info(f"Respuesta del servidor al lote: status={response.status_code}, headers={response.headers}")
-            response.raise_for_status()
+            "",
+            f"--{changeset_boundary}",
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {content_id_linea}",
+            "",
+            f"POST {d365_config['client_prod']}/data/SalesQuotationLines HTTP/1.1",
+            "Content-Type: application/json",
+            "",
+            json.dumps(linea_payload),
+            f"--{changeset_boundary}--",
+        ])
+        grupos.append([content_id_linea])
+
+    batch_body.append(f"--{batch_boundary}--")
+    batch_body_str = "\r\n".join(batch_body)
+    logger.info(f"Enviando lote de {len(lineas)} líneas para {sales_quotation_number}")
+
+    async with cliente_http() as client:
+        resultados, error = await _enviar_batch(client, batch_url, batch_headers, batch_body_str, grupos, 120,
+                                                f"líneas de {sales_quotation_number}")
+    fallidas = {int(cid) - 1: parte for cid, parte in resultados.items() if not parte.ok}
+    if not fallidas:
+        logger.info(f"Presupuesto completo creado exitosamente: {sales_quotation_number}")
+        return {}, None
+    detalle = [f"{lineas[i].get('articulo', '')}: {p.status} {p.motivo} {truncar(p.cuerpo, 300)}".strip()
+               for i, p in sorted(fallidas.items())]
+    return fallidas, f"{len(fallidas)} de {len(lineas)} líneas sin crear: {detalle}"
 
-            response_lines = response.text.splitlines()
-            logger.info(f"Respuesta del lote de líneas completa: {response.text}")
-            errores = []
-            for i, line in enumerate(response_lines):
-                if line.startswith("HTTP/1.1"):
-                    status_code = int(line.split(" ")[1])
-                    if status_code >= 400:  # Solo errores 400 o superiores
-                        errores.append(f"Error en operación {i}: {line}")
-                        logger.warning(f"Detectado error real en operación {i}: {line}")
-
-            if errores:
-                error = f"Errores al crear líneas: {errores}. Respuesta completa: {response.text}"
-                logger.error(error)
-                enviar_correo_fallo("crear_presupuesto_batch", error)
-                return sales_quotation_number, error
-            logger.info(f"Presupuesto completo creado exitosamente: {sales_quotation_number}")
-            session['new_quotation'] = sales_quotation_number
-            return sales_quotation_number, None
+async def crear_presupuesto_batch(datos_cabecera, lineas, access_token):
+    """Cabecera + líneas en un solo intento (sin outbox). Ver ``services.presupuestos_outbox``."""
+    logger.info(f"Datos recibidos para crear presupuesto: cabecera={datos_cabecera}, {len(lineas or [])} líneas")
+    if not datos_cabecera or not lineas or not access_token:
+        error = "Datos o token inválidos."
+        enviar_correo_fallo("crear_presupuesto_batch", error)
+        return None, error
 
-        except httpx.HTTPStatusError as e:
-            error = f"Error HTTP al crear líneas: {e}, Respuesta: {e.response.text}"
-            logger.error(error)
-            enviar_correo_fallo("crear_presupuesto_batch", error)
-            return sales_quotation_number, error
-        except Exception as e:
-            error = f"Error al crear líneas en batch: {str(e)}, Respuesta: {response.text if 'response' in locals() else 'N/A'}"
-            logger.error(error)
-            enviar_correo_fallo("crear_presupuesto_batch", error)
-            return sales_quotation_number, error
+    referencia = generar_referencia_presupuesto()
+    sales_quotation_number, error, reintentable = await crear_cabecera_presupuesto(datos_cabecera, referencia, access_token)
+    if not sales_quotation_number:
+        if reintentable:
+            enviar_correo_fallo("crear_presupuesto_batch", f"{error} (referencia {referencia})")
+        return None, error
+    _, error = await crear_lineas_presupuesto(sales_quotation_number, lineas, access_token)
+    if error:
+        enviar_correo_fallo("crear_presupuesto_batch", error)
+    return sales_quotation_number, error
 
 async def obtener_presupuesto_d365(quotation_id, access_token):
     """Recupera los datos de un presupuesto existente desde D365."""
@@ -207,52 +282,43 @@ async def obtener_presupuesto_d365(quotation_id, access_token):
         return None, error
 
     d365_config = load_d365_config()
-    async with httpx.AsyncClient() as client:
+    async with cliente_http() as client:
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {access_token}'
         }
 
-        # Obtener líneas del presupuesto
         lines_url = f"{d365_config['client_prod']}/data/SalesQuotationLines?$filter=SalesQuotationNumber eq '{quotation_id}'&$select=InventoryLotId,ItemNumber,RequestingCustomerAccountNumber,SalesQuotationNumber,SalesPrice,RequestedSalesQuantity,SalesUnitSymbol,ShippingSiteId,ShippingWarehouseId"
-        try:
-            lines_response = await client.get(lines_url, headers=headers, timeout=httpx.Timeout(30))
-            lines_response.raise_for_status()
-            lines_data = lines_response.json().get("value", [])
-            logger.info(f"Líneas obtenidas para {quotation_id}: {len(lines_data)}")
-        except httpx.HTTPStatusError as e:
-            error = f"Error HTTP al obtener líneas: {e}, Respuesta: {e.response.text}"
-            logger.error(error)
-            enviar_correo_fallo("obtener_presupuesto_d365", error)
-            return None, error
-        except Exception as e:
-            error = f"Error al obtener líneas: {str(e)}"
+        header_url = f"{d365_config['client_prod']}/data/SalesQuotationHeadersV2?$filter=SalesQuotationNumber eq '{quotation_id}'&$select=SalesQuotationNumber,InvoiceCustomerAccountNumber,CustomersReference,SalesOrderOriginCode,ReceiptDateRequested,SalesQuotationStatus,GeneratedSalesOrderNumber"
+
+        async def consultar(url, que):
+            try:
+                response = await client.get(url, headers=headers, timeout=httpx.Timeout(30))
+                response.raise_for_status()
+                return response.json().get("value", []), None
+            except httpx.HTTPStatusError as e:
+                return None, f"Error HTTP al obtener {que}: {e}, Respuesta: {e.response.text}"
+            except Exception as e:
+                return None, f"Error al obtener {que}: {str(e)}"
+
+        # Líneas y cabecera son independientes: se piden en paralelo sobre el pool compartido
+        (lines_data, error_lineas), (header_value, error_cabecera) = await asyncio.gather(
+            consultar(lines_url, "líneas"), consultar(header_url, "cabecera")
+        )
+        error = error_lineas or error_cabecera
+        if error:
             logger.error(error)
             enviar_correo_fallo("obtener_presupuesto_d365", error)
             return None, error
+        logger.info(f"Líneas obtenidas para {quotation_id}: {len(lines_data)}")
 
         if not lines_data:
             error = f"No se encontraron líneas para el presupuesto {quotation_id}"
             logger.info(error)
             return None, error
 
-        # Obtener cabecera del presupuesto con campos adicionales
-        header_url = f"{d365_config['client_prod']}/data/SalesQuotationHeadersV2?$filter=SalesQuotationNumber eq '{quotation_id}'&$select=SalesQuotationNumber,InvoiceCustomerAccountNumber,CustomersReference,SalesOrderOriginCode,ReceiptDateRequested,SalesQuotationStatus,GeneratedSalesOrderNumber"
-        try:
-            header_response = await client.get(header_url, headers=headers, timeout=httpx.Timeout(30))
-            header_response.raise_for_status()
-            header_data = header_response.json().get("value", [])[0] if header_response.json().get("value") else {}
-            logger.info(f"Cabecera obtenida para {quotation_id}")
-        except httpx.HTTPStatusError as e:
-            error = f"Error HTTP al obtener cabecera: {e}, Respuesta: {e.response.text}"
-            logger.error(error)
-            enviar_correo_fallo("obtener_presupuesto_d365", error)
-            return None, error
-        except Exception as e:
-            error = f"Error al obtener cabecera: {str(e)}"
-            logger.error(error)
-            enviar_correo_fallo("obtener_presupuesto_d365", error)
-            return None, error
+        header_data = header_value[0] if header_value else {}
+        logger.info(f"Cabecera obtenida para {quotation_id}")
 
         # Combinar datos en una respuesta
         presupuesto_data = {
@@ -272,7 +338,7 @@ async def actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nueva
         return None, error
 
     d365_config = load_d365_config()
-    async with httpx.AsyncClient() as client:
+    async with cliente_http() as client:
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {access_token}'
@@ -295,11 +361,13 @@ async def actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nueva
                 ""
             ]
 
+            ids_eliminacion = []
             for i, line in enumerate(lineas_existentes):
                 inventory_lot_id = line.get("InventoryLotId")
                 if not inventory_lot_id:
                     logger.warning(f"Línea {i} no tiene InventoryLotId, omitiendo eliminación: {line}")
                     continue
+                ids_eliminacion.append(str(i + 1))
                 batch_body.extend([
                     f"--{changeset_boundary}",
                     "Content-Type: application/http",
@@ -313,44 +381,16 @@ async def actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nueva
 
             batch_body.extend([f"--{changeset_boundary}--", f"--{batch_boundary}--"])
             batch_body_str = "\r\n".join(batch_body)
-            logger.info(f"Cuerpo del lote OData para eliminación de líneas: {batch_body_str}")
-
-            try:
-                response = await client.post(
-                    batch_url,
-                    headers=batch_headers,
-                    data=batch_body_str,
-                    timeout=httpx.Timeout(120)
-                )
-                logger.info(f"Respuesta del servidor al lote de eliminación: status={response.status_code}, headers={response.headers}")
-                response.raise_for_status()
-
-                response_lines = response.text.splitlines()
-                logger.info(f"Respuesta del lote de eliminación completa: {response.text}")
-                errores = []
-                for i, line in enumerate(response_lines):
-                    if line.startswith("HTTP/1.1"):
-                        status_code = int(line.split(" ")[1])
-                        if status_code >= 400:
-                            errores.append(f"Error en operación {i}: {line}")
-                            logger.warning(f"Detectado error en operación de eliminación {i}: {line}")
-
-                if errores:
-                    error = f"Errores al eliminar líneas: {errores}. Respuesta completa: {response.text}"
-                    logger.error(error)
-                    enviar_correo_fallo("actualizar_presupuesto_d365", error)
-                    return None, error
-                logger.info(f"Todas las líneas existentes eliminadas para {quotation_id}")
-            except httpx.HTTPStatusError as e:
-                error = f"Error HTTP al eliminar líneas: {e}, Respuesta: {e.response.text}"
-                logger.error(error)
-                enviar_correo_fallo("actualizar_presupuesto_d365", error)
-                return None, error
-            except Exception as e:
-                error = f"Error al eliminar líneas en batch: {str(e)}, Respuesta: {response.text if 'response' in locals() else 'N/A'}"
+            resultados, error = await _enviar_batch(client, batch_url, batch_headers, batch_body_str,
+                                                    [ids_eliminacion], 120, f"eliminación de líneas de {quotation_id}")
+            if error:
+                fallidas = [f"{cid}: {p.status} {p.motivo} {truncar(p.cuerpo, 300)}".strip()
+                            for cid, p in resultados.items() if not p.ok]
+                error = f"Errores al eliminar líneas: {fallidas}"
                 logger.error(error)
                 enviar_correo_fallo("actualizar_presupuesto_d365", error)
                 return None, error
+            logger.info(f"Todas las líneas existentes eliminadas para {quotation_id}")
 
         # Segundo Batch: Crear las nuevas líneas y actualizar la cabecera
         batch_url = f"{d365_config['client_prod']}/data/$batch"
@@ -418,47 +458,20 @@ async def actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nueva
 
         batch_body.extend([f"--{changeset_boundary}--", f"--{batch_boundary}--"])
         batch_body_str = "\r\n".join(batch_body)
-        logger.info(f"Cuerpo del lote OData para nuevas líneas y cabecera: {batch_body_str}")
-
-        try:
-            response = await client.post(
-                batch_url,
-                headers=batch_headers,
-                data=batch_body_str,
-                timeout=httpx.Timeout(120)
-            )
-            logger.info(f"Respuesta del servidor al lote de creación: status={response.status_code}, headers={response.headers}")
-            response.raise_for_status()
-
-            response_lines = response.text.splitlines()
-            logger.info(f"Respuesta del lote de creación completa: {response.text}")
-            errores = []
-            for i, line in enumerate(response_lines):
-                if line.startswith("HTTP/1.1"):
-                    status_code = int(line.split(" ")[1])
-                    if status_code >= 400:
-                        errores.append(f"Error en operación {i}: {line}")
-                        logger.warning(f"Detectado error en operación de creación {i}: {line}")
-
-            if errores:
-                error = f"Errores al crear líneas o actualizar cabecera: {errores}. Respuesta completa: {response.text}"
-                logger.error(error)
-                enviar_correo_fallo("actualizar_presupuesto_d365", error)
-                return quotation_id, error
-            logger.info(f"Presupuesto {quotation_id} actualizado exitosamente: nuevas líneas creadas y cabecera actualizada")
-            session['updated_quotation'] = quotation_id
-            return quotation_id, None
-
-        except httpx.HTTPStatusError as e:
-            error = f"Error HTTP al crear líneas o actualizar cabecera: {e}, Respuesta: {e.response.text}"
-            logger.error(error)
-            enviar_correo_fallo("actualizar_presupuesto_d365", error)
-            return quotation_id, error
-        except Exception as e:
-            error = f"Error al crear líneas o actualizar cabecera en batch: {str(e)}, Respuesta: {response.text if 'response' in locals() else 'N/A'}"
+        ids_creacion = ["1"] + [str(i + 2) for i in range(len(lineas_nuevas))]
+        resultados, error = await _enviar_batch(client, batch_url, batch_headers, batch_body_str,
+                                                [ids_creacion], 120, f"líneas y cabecera de {quotation_id}")
+        if error:
+            # Content-ID 1 es la cabecera; 2.. son las líneas nuevas en orden
+            fallidas = [f"{'cabecera' if cid == '1' else lineas_nuevas[int(cid) - 2].get('articulo', cid)}: "
+                        f"{p.status} {p.motivo} {truncar(p.cuerpo, 300)}".strip()
+                        for cid, p in resultados.items() if not p.ok]
+            error = f"Errores al crear líneas o actualizar cabecera: {fallidas}"
             logger.error(error)
             enviar_correo_fallo("actualizar_presupuesto_d365", error)
             return quotation_id, error
+        logger.info(f"Presupuesto {quotation_id} actualizado exitosamente: nuevas líneas creadas y cabecera actualizada")
+        return quotation_id, None
 
 async def validar_cliente_existente(dni, access_token):
     """Valida si un cliente ya existe en D365 basado en el DNI (TaxExemptNumber)."""
@@ -470,7 +483,7 @@ async def validar_cliente_existente(dni, access_token):
         'Content-Type': 'application/json'
     }
 
-    async with httpx.AsyncClient() as client:
+    async with cliente_http() as client:
         try:
             response = await client.get(url, headers=headers, timeout=httpx.Timeout(30))
             response.raise_for_status()
@@ -510,7 +523,7 @@ async def alta_cliente_d365(datos_cliente, access_token):
         "Name": f"{datos_cliente['nombre']} {datos_cliente['apellido']}",
         "AxxTaxFiscalIdentificationType_TaxFiscalIdentificationId": "DNI"
     }
-    async with httpx.AsyncClient() as client:
+    async with cliente_http() as client:
         try:
             vat_response = await client.post(vat_url, headers=headers, json=vat_payload, timeout=httpx.Timeout(60))
             vat_response.raise_for_status()
@@ -568,7 +581,7 @@ async def alta_cliente_d365(datos_cliente, access_token):
         "AxxTaxPCGrossIncAgreeType": "NotInscript"
     }
 
-    async with httpx.AsyncClient() as client:
+    async with cliente_http() as client:
         try:
             logger.info(customer_payload)
             response = await client.post(customer_url, headers=headers, json=customer_payload, timeout=httpx.Timeout(60))
@@ -595,18 +608,30 @@ async def alta_cliente_d365(datos_cliente, access_token):
             return None, error
 
 
-# Función síncrona para integrar con Flask
+# Funciones síncronas para las vistas: corren en el loop compartido de services.cliente_d365
 def run_validar_cliente_existente(dni, access_token):
-    return asyncio.run(validar_cliente_existente(dni, access_token))
+    return ejecutar_d365(validar_cliente_existente(dni, access_token))
 
 def run_alta_cliente_d365(datos_cliente, access_token):
-    return asyncio.run(alta_cliente_d365(datos_cliente, access_token))
+    return ejecutar_d365(alta_cliente_d365(datos_cliente, access_token))
 
 def run_crear_presupuesto_batch(datos_cabecera, lineas, access_token):
-    return asyncio.run(crear_presupuesto_batch(datos_cabecera, lineas, access_token))
+    return ejecutar_d365(crear_presupuesto_batch(datos_cabecera, lineas, access_token))
+
+def run_buscar_presupuesto_por_referencia(referencia, access_token):
+    return ejecutar_d365(buscar_presupuesto_por_referencia(referencia, access_token))
+
+def run_listar_articulos_presupuesto(sales_quotation_number, access_token):
+    return ejecutar_d365(listar_articulos_presupuesto(sales_quotation_number, access_token))
+
+def run_crear_cabecera_presupuesto(datos_cabecera, referencia, access_token):
+    return ejecutar_d365(crear_cabecera_presupuesto(datos_cabecera, referencia, access_token))
+
+def run_crear_lineas_presupuesto(sales_quotation_number, lineas, access_token):
+    return ejecutar_d365(crear_lineas_presupuesto(sales_quotation_number, lineas, access_token))
 
 def run_obtener_presupuesto_d365(quotation_id, access_token):
-    return asyncio.run(obtener_presupuesto_d365(quotation_id, access_token))
+    return ejecutar_d365(obtener_presupuesto_d365(quotation_id, access_token))
 
 def run_actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nuevas, lineas_existentes, access_token):
-    return asyncio.run(actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nuevas, lineas_existentes, access_token))
+    return ejecutar_d365(actualizar_presupuesto_d365(quotation_id, datos_cabecera, lineas_nuevas, lineas_existentes, access_token))
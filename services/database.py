@@ -1,6 +1,8 @@
 import sqlite3
 import os
+import re
 import locale
+import threading
 import time
 from contextlib import contextmanager
 import pyarrow.parquet as pq
@@ -8,6 +10,10 @@ import pyarrow.compute as pc
 import pyarrow.dataset as ds
 import pyarrow as pa
 from services.logging_utils import get_module_logger
+from services.formato_moneda import formatear_lista_ars, formatear_valor_ars
+from services.pool_sqlite import pool_sqlite
+from services.cola_escritura import escribir
+from services.guarda_publicacion import verificar_publicacion
 try:
     from services.config import CACHE_FILE_PRODUCTOS
 except Exception:
@@ -19,7 +25,8 @@ import json
 # Configuración inicial
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-DB_PATHS = {
+# Bases por dominio de versiones anteriores: hoy solo son origen de la migración
+DB_PATHS_LEGACY = {
     "atributos": os.path.join(BASE_DIR, "atributos.db"),
     "empleados": os.path.join(BASE_DIR, "empleados.db"),
     "misc": os.path.join(BASE_DIR, "misc.db"),
@@ -32,6 +39,33 @@ DB_PATHS = {
     "payments": os.path.join(BASE_DIR, "payments.db"),
 }
 
+# Base SQLite única: todos los dominios comparten archivo (y conexión por hilo del pool)
+SQLITE_DB_PATH = os.getenv("POS_SQLITE_PATH", os.path.join(BASE_DIR, "pos.db"))
+DB_PATHS = {dominio: SQLITE_DB_PATH for dominio in DB_PATHS_LEGACY}
+
+# Columnas agregadas después de creadas las tablas: (tabla, columna, tipo)
+COLUMNAS_AGREGADAS = (
+    ("misc", "token_d365_expira", "REAL"),
+    ("presupuestos_outbox", "lineas_creadas", "TEXT"),
+)
+
+# Índices secundarios (las UNIQUE ya cubren codigo, id_tienda, email y tienda de grupos)
+INDICES_SECUNDARIOS = {
+    "idx_atributos_product_number":
+        "CREATE INDEX IF NOT EXISTS idx_atributos_product_number ON atributos(product_number);",
+    "idx_sim_items_simulation":
+        "CREATE INDEX IF NOT EXISTS idx_sim_items_simulation ON sales_payment_simulation_items(simulation_id);",
+    "idx_presupuestos_outbox_estado":
+        "CREATE INDEX IF NOT EXISTS idx_presupuestos_outbox_estado ON presupuestos_outbox(estado);",
+}
+
+# Migración de las bases por dominio: un solo proceso crea la marca "en curso" (O_EXCL)
+# y la renombra a "hecha" al terminar bien; el resto espera a una de las dos
+MARCA_MIGRACION = SQLITE_DB_PATH + ".migracion"
+MARCA_MIGRACION_EN_CURSO = MARCA_MIGRACION + ".en_curso"
+# Una marca "en curso" más vieja que esto es de un proceso caído
+MIGRACION_TIMEOUT_SECS = float(os.getenv("MIGRACION_TIMEOUT_SECS", "600"))
+
 logger = get_module_logger(__name__)
 
 try:
@@ -43,34 +77,153 @@ except Exception as e:
 MAX_RETRIES = 5
 RETRY_DELAY = 2.5  # segundos
 
+# Sentencias de carga masiva (compartidas por agregar_*_masivo y la extracción en lotes de Fabric)
+SQL_INSERT_ATRIBUTOS = """
+    INSERT INTO atributos (product_number, product_name, attribute_name, attribute_value)
+    VALUES (?, ?, ?, ?);
+"""
+SQL_UPSERT_STOCK = """
+    INSERT INTO stock (codigo, almacen_365, stock_fisico, disponible_venta, disponible_entrega, comprometido)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(codigo, almacen_365) DO UPDATE SET
+        stock_fisico=excluded.stock_fisico,
+        disponible_venta=excluded.disponible_venta,
+        disponible_entrega=excluded.disponible_entrega,
+        comprometido=excluded.comprometido;
+"""
+SQL_UPSERT_STORE_DATA = """
+    INSERT INTO store_data (
+        almacen_retiro, sitio_almacen_retiro, id_tienda, id_unidad_operativa, 
+        nombre_tienda, almacen_envio, sitio_almacen_envio, direccion_unidad_operativa, 
+        direccion_completa_unidad_operativa
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id_tienda) DO UPDATE SET
+        almacen_retiro=excluded.almacen_retiro,
+        sitio_almacen_retiro=excluded.sitio_almacen_retiro,
+        id_unidad_operativa=excluded.id_unidad_operativa,
+        nombre_tienda=excluded.nombre_tienda,
+        almacen_envio=excluded.almacen_envio,
+        sitio_almacen_envio=excluded.sitio_almacen_envio,
+        direccion_unidad_operativa=excluded.direccion_unidad_operativa,
+        direccion_completa_unidad_operativa=excluded.direccion_completa_unidad_operativa;
+"""
+
 @contextmanager
 def conectar_db(tabla):
-    """Gestor de conexión optimizado con timeout y configuraciones para una tabla específica."""
+    """Conexión (del pool por hilo) a la base de una tabla específica."""
     db_path = DB_PATHS.get(tabla)
     if not db_path:
         raise ValueError(f"No se encontró una base de datos para la tabla {tabla}")
-    # Asegurar que el directorio de la base de datos exista antes de conectar
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
     try:
-        conexion = sqlite3.connect(db_path, timeout=10)
-        conexion.execute("PRAGMA journal_mode=WAL;")
-        conexion.execute("PRAGMA synchronous=NORMAL;")
-        logger.info(f"Conectado a la base de datos: {db_path} para tabla {tabla}")
-        yield conexion
+        with pool_sqlite.conexion(db_path) as conexion:
+            yield conexion
     except sqlite3.Error as e:
-        logger.error(f"Error al conectar con la base de datos {db_path}: {e}")
+        logger.error(f"Error en la conexión con la base de datos {db_path}: {e}")
+        raise
+
+# Cargas masivas: se escribe en <tabla>__sombra y se publica con un rename
+SUFIJO_SOMBRA = "__sombra"
+SUFIJO_VIEJA = "__vieja"
+# Los índices explícitos de la sombra alternan de nombre (SQLite no tiene ALTER INDEX ... RENAME)
+SUFIJO_INDICE_ALTERNO = "__b"
+
+
+def nombre_indice_alterno(nombre):
+    if nombre.endswith(SUFIJO_INDICE_ALTERNO):
+        return nombre[:-len(SUFIJO_INDICE_ALTERNO)]
+    return nombre + SUFIJO_INDICE_ALTERNO
+
+
+def _preparar_sombra(cursor, tabla):
+    """Crea la tabla sombra vacía con el mismo esquema. Devuelve los índices explícitos de la tabla."""
+    sombra = tabla + SUFIJO_SOMBRA
+    # Restos de una carga anterior (DROP fallido): sus índices chocarían con los nombres alternos
+    cursor.execute(f"DROP TABLE IF EXISTS {tabla}{SUFIJO_VIEJA};")
+    cursor.execute(f"DROP TABLE IF EXISTS {sombra};")
+    create_sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+    ).fetchone()[0]
+    cursor.execute(re.sub(rf'^\s*CREATE TABLE\s+"?{tabla}"?', f"CREATE TABLE {sombra}", create_sql, count=1))
+    return cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (tabla,)
+    ).fetchall()
+
+
+def _indexar_sombra(cursor, tabla, indices):
+    sombra = tabla + SUFIJO_SOMBRA
+    for nombre, sql in indices:
+        sql = re.sub(rf'\bINDEX\s+"?{nombre}"?', f"INDEX {nombre_indice_alterno(nombre)}", sql, count=1)
+        cursor.execute(re.sub(rf'\bON\s+"?{tabla}"?\s*\(', f"ON {sombra}(", sql, count=1))
+
+
+def _publicar_sombra(cursor, tabla):
+    # Solo renames: los lectores (WAL) pasan de la versión vieja completa a la nueva completa.
+    # La guarda se mira dentro de la transacción: un líder depuesto no publica
+    verificar_publicacion(f"carga masiva en {tabla}")
+    vieja = tabla + SUFIJO_VIEJA
+    cursor.execute(f"DROP TABLE IF EXISTS {vieja};")
+    cursor.execute(f"ALTER TABLE {tabla} RENAME TO {vieja};")
+    cursor.execute(f"ALTER TABLE {tabla}{SUFIJO_SOMBRA} RENAME TO {tabla};")
+
+
+def _descartar(cursor, tabla):
+    cursor.execute(f"DROP TABLE IF EXISTS {tabla};")
+
+
+@contextmanager
+def carga_masiva(tabla, sql):
+    """Reemplazo completo de ``tabla`` por lotes, vía tabla sombra (para extracción en streaming).
+
+    Devuelve una función ``escribir(lote)`` que hace ``executemany`` de ``sql``
+    (redirigido a ``<tabla>__sombra``) en la cola de escritura, un commit por lote:
+    nunca se retiene el lock de escritura durante toda la carga. Al terminar se
+    crean los índices de la sombra y se publica con ``ALTER TABLE ... RENAME`` en
+    una transacción corta. Si algo falla, o no se escribió ninguna fila, la sombra
+    se descarta y la tabla publicada queda intacta.
+    """
+    db_path = DB_PATHS[tabla]
+    sombra = tabla + SUFIJO_SOMBRA
+    sql_sombra = re.sub(rf"\bINTO\s+{tabla}\b", f"INTO {sombra}", sql, count=1)
+    indices = escribir(db_path, _preparar_sombra, tabla)
+    filas = 0
+
+    def _insertar(cursor, lote):
+        verificar_publicacion(f"carga masiva en {tabla}")
+        return cursor.executemany(sql_sombra, lote).rowcount
+
+    def escribir_lote(lote):
+        nonlocal filas
+        filas += escribir(db_path, _insertar, lote)
+
+    try:
+        yield escribir_lote
+        if not filas:
+            # Extracción vacía: no se reemplaza la tabla publicada por una vacía
+            escribir(db_path, _descartar, sombra)
+            logger.warning(f"Carga masiva en {tabla} sin filas: se descarta la sombra (la tabla publicada no cambió)")
+            return
+        escribir(db_path, _indexar_sombra, tabla, indices)
+        escribir(db_path, _publicar_sombra, tabla)
+    except Exception:
+        try:
+            escribir(db_path, _descartar, sombra)
+        except sqlite3.Error:
+            logger.exception(f"No se pudo descartar {sombra}")
+        logger.warning(f"Carga masiva en {tabla} descartada (la tabla publicada no cambió)")
         raise
-    finally:
-        if 'conexion' in locals():
-            conexion.close()
-            logger.debug(f"Conexión cerrada correctamente para {db_path}.")
+
+    try:
+        escribir(db_path, _descartar, tabla + SUFIJO_VIEJA)
+    except sqlite3.Error:
+        logger.warning(f"No se pudo borrar {tabla}{SUFIJO_VIEJA}; se reintenta en la próxima carga")
+    logger.info(f"Carga masiva en {tabla}: tabla sombra publicada")
 
 def formatear_moneda(valor):
     if valor is None:
         return "N/A"
     try:
-        return locale.format_string("%.2f", valor, grouping=True)
-    except ValueError:
+        return formatear_valor_ars(valor)
+    except (TypeError, ValueError):
         return str(valor)
 
 def obtener_stores_from_parquet():
@@ -146,6 +299,7 @@ def init_db():
             CREATE TABLE IF NOT EXISTS misc (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 token_d365 TEXT,
+                token_d365_expira REAL,
                 contador TEXT,
                 contador_pdf TEXT
             );
@@ -154,6 +308,24 @@ def init_db():
                 cart_json TEXT NOT NULL,
                 timestamp TEXT NOT NULL
             );
+            CREATE TABLE IF NOT EXISTS presupuestos_outbox (
+                id TEXT PRIMARY KEY,
+                usuario TEXT,
+                clave_idempotencia TEXT,
+                referencia TEXT NOT NULL UNIQUE,
+                estado TEXT NOT NULL,
+                datos_cabecera TEXT NOT NULL,
+                lineas TEXT NOT NULL,
+                quotation_number TEXT,
+                lineas_creadas TEXT,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                tomado_por TEXT,
+                tomado_hasta REAL,
+                creado REAL NOT NULL,
+                actualizado REAL NOT NULL,
+                UNIQUE (usuario, clave_idempotencia)
+            );
         """,
         "stock": """
             CREATE TABLE IF NOT EXISTS stock (
@@ -288,118 +460,167 @@ def init_db():
             except sqlite3.Error as e:
                 logger.error(f"Error al inicializar la base de datos para {tabla}: {e}")
 
-def guardar_token_d365(token):
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("misc") as conexion:
-            cursor = conexion.cursor()
+    with conectar_db("misc") as conexion:
+        try:
+            for tabla, columna, tipo in COLUMNAS_AGREGADAS:
+                if columna not in {r[1] for r in conexion.execute(f"PRAGMA table_info({tabla});")}:
+                    conexion.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo};")
+            existentes = {r[0] for r in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            for nombre, sql in INDICES_SECUNDARIOS.items():
+                # Tras una carga por tabla sombra el índice puede tener el nombre alterno
+                if nombre_indice_alterno(nombre) not in existentes:
+                    conexion.execute(sql)
+            conexion.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error al agregar columnas / crear índices secundarios: {e}")
+
+    # Primera vez sobre la base única: traer los datos de las bases por dominio
+    if any(os.path.exists(p) for p in DB_PATHS_LEGACY.values()):
+        _migrar_una_vez()
+
+
+def _migrar_una_vez():
+    """Corre ``migrar_bases_legacy`` en un solo proceso; los demás esperan a que termine."""
+    while not os.path.exists(MARCA_MIGRACION):
+        try:
+            fd = os.open(MARCA_MIGRACION_EN_CURSO, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
             try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("SELECT COUNT(*) FROM misc WHERE id = 1")
-                exists = cursor.fetchone()[0] > 0
-                if exists:
-                    cursor.execute("UPDATE misc SET token_d365 = ? WHERE id = 1", (token,))
-                else:
-                    cursor.execute("INSERT INTO misc (id, token_d365, contador) VALUES (1, ?, NULL)", (token,))
+                antiguedad = time.time() - os.path.getmtime(MARCA_MIGRACION_EN_CURSO)
+            except FileNotFoundError:
+                continue  # terminó (bien o mal) entre el open y el stat
+            if antiguedad > MIGRACION_TIMEOUT_SECS:
+                logger.warning(f"Marca de migración abandonada ({antiguedad:.0f}s); se reintenta")
+                try:
+                    os.remove(MARCA_MIGRACION_EN_CURSO)
+                except FileNotFoundError:
+                    pass
+                continue
+            # Otro proceso está migrando: no servir desde una base a medio llenar
+            time.sleep(0.5)
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        try:
+            migrar_bases_legacy()
+        except Exception:
+            os.remove(MARCA_MIGRACION_EN_CURSO)
+            logger.exception("Migración de las bases por dominio fallida; se reintenta en el próximo arranque")
+            raise
+        os.replace(MARCA_MIGRACION_EN_CURSO, MARCA_MIGRACION)
+        return
+
+
+def _archivo_activo(path):
+    return os.path.abspath(path) == os.path.abspath(SQLITE_DB_PATH)
+
+
+def migrar_bases_legacy(renombrar=True):
+    """Copia las tablas de las bases por dominio a la base única. Devuelve ``{tabla: filas}``.
+
+    Cada archivo se adjunta (``ATTACH``) a la conexión de la base única y se copia
+    tabla por tabla en una transacción (``INSERT OR REPLACE``, así es re-ejecutable
+    y los datos del archivo viejo pisan las semillas de ``init_db``). Tablas que no
+    existan en la base única se crean con el ``CREATE`` original. Con ``renombrar``
+    los archivos migrados quedan como ``*.db.migrado``.
+    """
+    resumen = {}
+    with conectar_db("misc") as conexion:
+        for dominio, path in DB_PATHS_LEGACY.items():
+            if not os.path.exists(path) or _archivo_activo(path):
+                continue
+            conexion.execute("ATTACH DATABASE ? AS legado;", (path,))
+            try:
+                conexion.execute("BEGIN IMMEDIATE;")
+                tablas = conexion.execute(
+                    "SELECT name, sql FROM legado.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                ).fetchall()
+                for tabla, create_sql in tablas:
+                    columnas_main = {r[1] for r in conexion.execute(f"PRAGMA main.table_info({tabla});")}
+                    if not columnas_main:
+                        conexion.execute(create_sql)
+                        columnas_main = {r[1] for r in conexion.execute(f"PRAGMA main.table_info({tabla});")}
+                    columnas = [r[1] for r in conexion.execute(f"PRAGMA legado.table_info({tabla});")
+                                if r[1] in columnas_main]
+                    lista = ", ".join(f'"{c}"' for c in columnas)
+                    cursor = conexion.execute(
+                        f"INSERT OR REPLACE INTO main.{tabla} ({lista}) SELECT {lista} FROM legado.{tabla};")
+                    resumen[tabla] = resumen.get(tabla, 0) + max(cursor.rowcount, 0)
                 conexion.commit()
-                logger.info("Token D365 guardado/actualizado exitosamente.")
-                return
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al guardar token D365 tras {MAX_RETRIES} intentos: {e}")
-                raise
-            except sqlite3.Error as e:
+            except sqlite3.Error:
                 conexion.rollback()
-                logger.error(f"Error inesperado al guardar token D365: {e}")
+                logger.exception(f"Migración de {path} revertida")
                 raise
+            finally:
+                conexion.execute("DETACH DATABASE legado;")
+            logger.info(f"Base {dominio} migrada a {SQLITE_DB_PATH}: {[t for t, _ in tablas]}")
+            if renombrar:
+                for sufijo in ("", "-wal", "-shm"):
+                    if os.path.exists(path + sufijo):
+                        try:
+                            os.replace(path + sufijo, path + sufijo + ".migrado")
+                        except OSError:
+                            logger.warning(f"No se pudo renombrar {path + sufijo} tras migrarlo", exc_info=True)
+    return resumen
 
-def obtener_token_d365():
-    for attempt in range(MAX_RETRIES):
+def guardar_token_d365(token, expira=None):
+    """Persiste el token D365 (y su vencimiento, epoch) para compartirlo entre procesos."""
+    def _guardar(cursor):
+        cursor.execute("SELECT COUNT(*) FROM misc WHERE id = 1")
+        if cursor.fetchone()[0] > 0:
+            cursor.execute("UPDATE misc SET token_d365 = ?, token_d365_expira = ? WHERE id = 1", (token, expira))
+        else:
+            cursor.execute("INSERT INTO misc (id, token_d365, token_d365_expira, contador) VALUES (1, ?, ?, NULL)",
+                           (token, expira))
+    try:
+        escribir(DB_PATHS["misc"], _guardar)
+        logger.info("Token D365 guardado/actualizado exitosamente.")
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar token D365: {e}")
+        raise
+
+def leer_token_d365():
+    """``(token, vencimiento epoch)`` persistidos, o ``(None, None)``."""
+    try:
         with conectar_db("misc") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("SELECT token_d365 FROM misc WHERE id = 1")
-                token = cursor.fetchone()
-                if token and token[0]:
-                    logger.info("Token D365 obtenido desde la base de datos.")
-                    return token[0]
-                logger.warning("No se encontró token D365 en la base de datos.")
-                return None
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al obtener token D365 tras {MAX_RETRIES} intentos: {e}")
-                return None
-            except sqlite3.Error as e:
-                logger.error(f"Error inesperado al obtener token D365: {e}")
-                return None
+            fila = conexion.execute("SELECT token_d365, token_d365_expira FROM misc WHERE id = 1").fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error al leer token D365: {e}")
+        return None, None
+    if not fila or not fila[0]:
+        return None, None
+    return fila[0], fila[1]
 
 def obtener_contador_presupuesto():
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("misc") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("SELECT contador FROM misc WHERE id = 1")
-                contador = cursor.fetchone()
-                nuevo_contador = int(contador[0]) + 1 if contador and contador[0] else 1
-                cursor.execute("SELECT COUNT(*) FROM misc WHERE id = 1")
-                exists = cursor.fetchone()[0] > 0
-                if exists:
-                    cursor.execute("UPDATE misc SET contador = ? WHERE id = 1", (str(nuevo_contador),))
-                else:
-                    cursor.execute("INSERT INTO misc (id, token_d365, contador) VALUES (1, NULL, ?)", (str(nuevo_contador),))
-                conexion.commit()
-                logger.info(f"Contador de presupuestos actualizado: {nuevo_contador}")
-                return nuevo_contador
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al actualizar contador tras {MAX_RETRIES} intentos: {e}")
-                raise
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado al obtener/incrementar contador: {e}")
-                raise
+    def _incrementar(cursor):
+        cursor.execute("SELECT contador FROM misc WHERE id = 1")
+        contador = cursor.fetchone()
+        nuevo_contador = int(contador[0]) + 1 if contador and contador[0] else 1
+        if contador is not None:
+            cursor.execute("UPDATE misc SET contador = ? WHERE id = 1", (str(nuevo_contador),))
+        else:
+            cursor.execute("INSERT INTO misc (id, token_d365, contador) VALUES (1, NULL, ?)", (str(nuevo_contador),))
+        return nuevo_contador
+    try:
+        nuevo_contador = escribir(DB_PATHS["misc"], _incrementar)
+        logger.info(f"Contador de presupuestos actualizado: {nuevo_contador}")
+        return nuevo_contador
+    except sqlite3.Error as e:
+        logger.error(f"Error al obtener/incrementar contador: {e}")
+        raise
 
 def agregar_atributos_masivo(lista_atributos):
     if not lista_atributos:
         logger.info("Lista de atributos vacía, no se insertó nada.")
         return 0
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("atributos") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("PRAGMA synchronous = OFF;")
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("DELETE FROM atributos;")
-                cursor.executemany("""
-                    INSERT INTO atributos (product_number, product_name, attribute_name, attribute_value)
-                    VALUES (?, ?, ?, ?);
-                """, lista_atributos)
-                conexion.commit()
-                logger.info(f"Se insertaron {len(lista_atributos)} atributos en SQLite.")
-                return len(lista_atributos)
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error en inserción masiva de atributos tras {MAX_RETRIES} intentos: {e}")
-                return 0
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado en inserción masiva de atributos: {e}")
-                return 0
+    try:
+        with carga_masiva("atributos", SQL_INSERT_ATRIBUTOS) as escribir_lote:
+            escribir_lote(lista_atributos)
+        logger.info(f"Se insertaron {len(lista_atributos)} atributos en SQLite.")
+        return len(lista_atributos)
+    except sqlite3.Error as e:
+        logger.error(f"Error en inserción masiva de atributos: {e}")
+        return 0
 
 def obtener_atributos(product_number):
     for attempt in range(MAX_RETRIES):
@@ -427,6 +648,29 @@ def obtener_atributos(product_number):
                 logger.error(f"Error inesperado al obtener atributos para {product_number}: {e}")
                 return []
 
+def obtener_atributos_lote(product_numbers):
+    """``product_number -> [atributos]`` de varios productos en una consulta (índice por product_number)."""
+    codigos = list(dict.fromkeys(str(p) for p in product_numbers))
+    salida = {c: [] for c in codigos}
+    if not codigos:
+        return salida
+    try:
+        with conectar_db("atributos") as conexion:
+            marcas = ",".join("?" * len(codigos))
+            filas = conexion.execute(f"""
+                SELECT product_number, product_name, attribute_name, attribute_value
+                FROM atributos WHERE product_number IN ({marcas})
+                ORDER BY product_number, attribute_name
+            """, codigos).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error al obtener atributos de {len(codigos)} productos: {e}")
+        return salida
+    for row in filas:
+        salida.setdefault(row[0], []).append(
+            {"ProductNumber": row[0], "ProductName": row[1], "AttributeName": row[2], "AttributeValue": row[3]}
+        )
+    return salida
+
 def obtener_stock(formateado=True):
     for attempt in range(MAX_RETRIES):
         with conectar_db("stock") as conexion:
@@ -438,13 +682,20 @@ def obtener_stock(formateado=True):
                 """)
                 rows = cursor.fetchall()
                 if formateado:
-                    to_row = lambda r: {
-                        "codigo": r[0], "almacen_365": r[1],
-                        "stock_fisico": formatear_moneda(r[2]),
-                        "disponible_venta": formatear_moneda(r[3]),
-                        "disponible_entrega": formatear_moneda(r[4]),
-                        "comprometido": formatear_moneda(r[5]),
-                    }
+                    # Formateo por columna completa (vectorizado) en lugar de valor por valor
+                    columnas = [formatear_lista_ars(col) for col in list(zip(*rows))[2:6]] if rows else []
+                    stock_data = [
+                        {
+                            "codigo": r[0], "almacen_365": r[1],
+                            "stock_fisico": columnas[0][i],
+                            "disponible_venta": columnas[1][i],
+                            "disponible_entrega": columnas[2][i],
+                            "comprometido": columnas[3][i],
+                        }
+                        for i, r in enumerate(rows)
+                    ]
+                    logger.info(f"Se obtuvieron {len(stock_data)} registros de stock.")
+                    return stock_data
                 else:
                     to_row = lambda r: {
                         "codigo": r[0], "almacen_365": r[1],
@@ -467,62 +718,51 @@ def obtener_stock(formateado=True):
 
 def guardar_simulacion_pago(cart_id, amount_total, currency, items, created_by, status="draft", change_amount=0):
     """Guarda una simulación de pagos con sus ítems asociados."""
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("payments") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute(
-                    """
-                    INSERT INTO sales_payment_simulations (
-                        cart_id, amount_total, currency, created_by, status, change_amount
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (cart_id, amount_total, currency, created_by, status, change_amount),
+    def _guardar(cursor):
+        cursor.execute(
+            """
+            INSERT INTO sales_payment_simulations (
+                cart_id, amount_total, currency, created_by, status, change_amount
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (cart_id, amount_total, currency, created_by, status, change_amount),
+        )
+        simulation_id = cursor.lastrowid
+        registros = []
+        for orden, item in enumerate(items, start=1):
+            registros.append(
+                (
+                    simulation_id,
+                    item.get("method_code"),
+                    item.get("amount_base"),
+                    item.get("card_brand_id"),
+                    item.get("installments"),
+                    item.get("coef_total"),
+                    item.get("interest_amount", 0),
+                    item.get("amount_final"),
+                    item.get("reference"),
+                    json.dumps(item.get("extra_meta")) if item.get("extra_meta") is not None else None,
+                    orden,
                 )
-                simulation_id = cursor.lastrowid
-                registros = []
-                for orden, item in enumerate(items, start=1):
-                    registros.append(
-                        (
-                            simulation_id,
-                            item.get("method_code"),
-                            item.get("amount_base"),
-                            item.get("card_brand_id"),
-                            item.get("installments"),
-                            item.get("coef_total"),
-                            item.get("interest_amount", 0),
-                            item.get("amount_final"),
-                            item.get("reference"),
-                            json.dumps(item.get("extra_meta")) if item.get("extra_meta") is not None else None,
-                            orden,
-                        )
-                    )
-                cursor.executemany(
-                    """
-                    INSERT INTO sales_payment_simulation_items (
-                        simulation_id, method_code, amount_base, card_brand_id,
-                        installments, coef_total, interest_amount, amount_final,
-                        reference, extra_meta, sort_order
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    registros,
-                )
-                conexion.commit()
-                logger.info(f"Simulación de pagos guardada con ID {simulation_id}")
-                return simulation_id
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al guardar simulación de pagos tras {MAX_RETRIES} intentos: {e}")
-                return None
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado al guardar simulación de pagos: {e}")
-                return None
+            )
+        cursor.executemany(
+            """
+            INSERT INTO sales_payment_simulation_items (
+                simulation_id, method_code, amount_base, card_brand_id,
+                installments, coef_total, interest_amount, amount_final,
+                reference, extra_meta, sort_order
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            registros,
+        )
+        return simulation_id
+    try:
+        simulation_id = escribir(DB_PATHS["payments"], _guardar)
+        logger.info(f"Simulación de pagos guardada con ID {simulation_id}")
+        return simulation_id
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar simulación de pagos: {e}")
+        return None
 
 
 def obtener_simulacion_pago(simulation_id):
@@ -593,91 +833,110 @@ def obtener_simulacion_pago(simulation_id):
                 logger.error(f"Error inesperado al obtener simulación de pagos: {e}")
                 return None
 
+# Mapa en memoria tienda -> almacenes del grupo de cumplimiento. Se reemplaza
+# entero (swap atómico de la referencia) al recargar; los lectores no toman lock.
+_grupos_cumplimiento = None  # (version_marca, {tienda: (almacen, ...)})
+_grupos_cumplimiento_lock = threading.Lock()
+
+
+# Se toca tras cada carga de grupos: los demás procesos recargan el mapa al ver el cambio
+# (la base es compartida por todos los dominios, su mtime cambia con cualquier escritura)
+MARCA_GRUPOS_CUMPLIMIENTO = SQLITE_DB_PATH + ".grupos_cumplimiento"
+
+
+def _version_grupos():
+    try:
+        return os.stat(MARCA_GRUPOS_CUMPLIMIENTO).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _marcar_grupos_actualizados():
+    with open(MARCA_GRUPOS_CUMPLIMIENTO, "a"):
+        pass
+    os.utime(MARCA_GRUPOS_CUMPLIMIENTO, None)
+
+
+def cargar_grupos_cumplimiento():
+    """Lee la tabla completa y publica el mapa tienda -> almacenes. Devuelve la cantidad de tiendas."""
+    global _grupos_cumplimiento
+    with _grupos_cumplimiento_lock:
+        version = _version_grupos()
+        for attempt in range(MAX_RETRIES):
+            with conectar_db("grupos_cumplimiento") as conexion:
+                try:
+                    filas = conexion.execute(
+                        "SELECT store_locator_group_name, invent_location_id FROM grupos_cumplimiento"
+                    ).fetchall()
+                    break
+                except sqlite3.OperationalError as e:
+                    if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
+                        logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
+                        time.sleep(RETRY_DELAY)
+                        continue
+                    raise
+        mapa = {}
+        for store, almacen in filas:
+            mapa.setdefault(store, []).append(almacen)
+        _grupos_cumplimiento = (version, {store: tuple(almacenes) for store, almacenes in mapa.items()})
+    logger.info(f"Grupos de cumplimiento en memoria: {len(mapa)} tiendas, {len(filas)} almacenes asignados.")
+    return len(mapa)
+
+
 def obtener_grupos_cumplimiento(store):
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("grupos_cumplimiento") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("SELECT invent_location_id FROM grupos_cumplimiento WHERE store_locator_group_name = ?", (store,))
-                almacenes_asignados = [row[0] for row in cursor.fetchall()]
-                logger.info(f"Se obtuvieron {len(almacenes_asignados)} almacenes para la tienda {store}.")
-                return almacenes_asignados
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al obtener grupos tras {MAX_RETRIES} intentos: {e}")
-                return []
-            except sqlite3.Error as e:
-                logger.error(f"Error inesperado al obtener grupos de cumplimiento: {e}")
+    """Almacenes del grupo de cumplimiento de la tienda, desde el mapa en memoria.
+
+    Solo se relee SQLite si cambió la marca de grupos (p. ej. el job semanal corrió
+    en el proceso líder); en el camino normal no hay E/S de base de datos.
+    """
+    cache = _grupos_cumplimiento
+    if cache is None or cache[0] != _version_grupos():
+        try:
+            cargar_grupos_cumplimiento()
+        except sqlite3.Error as e:
+            logger.error(f"Error al cargar grupos de cumplimiento: {e}")
+            if cache is None:
                 return []
+        cache = _grupos_cumplimiento or cache
+    return list(cache[1].get(store, ()))
 
 def agregar_stock_masivo(lista_stock):
     if not lista_stock:
         logger.info("Lista de stock vacía, no se insertó nada.")
         return 0
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("stock") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.executemany("""
-                    INSERT INTO stock (codigo, almacen_365, stock_fisico, disponible_venta, disponible_entrega, comprometido)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(codigo, almacen_365) DO UPDATE SET
-                        stock_fisico=excluded.stock_fisico,
-                        disponible_venta=excluded.disponible_venta,
-                        disponible_entrega=excluded.disponible_entrega,
-                        comprometido=excluded.comprometido;
-                """, lista_stock)
-                conexion.commit()
-                logger.info(f"Se insertaron/actualizaron {len(lista_stock)} registros de stock.")
-                return len(lista_stock)
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error en inserción de stock tras {MAX_RETRIES} intentos: {e}")
-                return 0
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado en inserción de stock: {e}")
-                return 0
+    try:
+        escribir(DB_PATHS["stock"], lambda cursor: cursor.executemany(SQL_UPSERT_STOCK, lista_stock))
+        logger.info(f"Se insertaron/actualizaron {len(lista_stock)} registros de stock.")
+        return len(lista_stock)
+    except sqlite3.Error as e:
+        logger.error(f"Error en inserción de stock: {e}")
+        return 0
 
 def agregar_grupos_cumplimiento_masivo(lista_grupos):
     if not lista_grupos:
         logger.info("Lista de grupos de cumplimiento vacía, no se insertó nada.")
         return 0
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("grupos_cumplimiento") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.executemany("""
-                    INSERT INTO grupos_cumplimiento (store_locator_group_name, invent_location_id)
-                    VALUES (?, ?)
-                    ON CONFLICT(store_locator_group_name, invent_location_id) DO UPDATE SET
-                        store_locator_group_name=excluded.store_locator_group_name,
-                        invent_location_id=excluded.invent_location_id;
-                """, lista_grupos)
-                conexion.commit()
-                logger.info(f"Se insertaron/actualizaron {len(lista_grupos)} registros en `grupos_cumplimiento`.")
-                return len(lista_grupos)
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error en inserción de grupos tras {MAX_RETRIES} intentos: {e}")
-                return 0
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado en inserción/actualización de grupos: {e}")
-                return 0
+    def _upsert(cursor):
+        cursor.executemany("""
+            INSERT INTO grupos_cumplimiento (store_locator_group_name, invent_location_id)
+            VALUES (?, ?)
+            ON CONFLICT(store_locator_group_name, invent_location_id) DO UPDATE SET
+                store_locator_group_name=excluded.store_locator_group_name,
+                invent_location_id=excluded.invent_location_id;
+        """, lista_grupos)
+    try:
+        escribir(DB_PATHS["grupos_cumplimiento"], _upsert)
+        logger.info(f"Se insertaron/actualizaron {len(lista_grupos)} registros en `grupos_cumplimiento`.")
+    except sqlite3.Error as e:
+        logger.error(f"Error en inserción/actualización de grupos: {e}")
+        return 0
+    # Swap del mapa en memoria con lo recién confirmado
+    try:
+        _marcar_grupos_actualizados()
+        cargar_grupos_cumplimiento()
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"No se pudo recargar grupos de cumplimiento en memoria: {e}")
+    return len(lista_grupos)
 
 def agregar_empleados_masivo(lista_empleados):
     if not lista_empleados:
@@ -692,36 +951,23 @@ def agregar_empleados_masivo(lista_empleados):
     if not lista_empleados_unicos:
         logger.warning("Todos los empleados tienen emails duplicados, no se insertó nada.")
         return 0
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("empleados") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("PRAGMA synchronous = OFF;")
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.executemany("""
-                    INSERT INTO empleados (empleado_d365, id_puesto, email, nombre_completo, numero_sap)
-                    VALUES (?, ?, ?, ?, ?)
-                    ON CONFLICT(email) DO UPDATE SET
-                        empleado_d365=excluded.empleado_d365,
-                        id_puesto=excluded.id_puesto,
-                        nombre_completo=excluded.nombre_completo,
-                        numero_sap=excluded.numero_sap;
-                """, lista_empleados_unicos)
-                conexion.commit()
-                logger.info(f"Se insertaron/actualizaron {len(lista_empleados_unicos)} empleados en SQLite.")
-                return len(lista_empleados_unicos)
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error en inserción masiva de empleados tras {MAX_RETRIES} intentos: {e}")
-                return 0
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado en inserción masiva de empleados: {e}")
-                return 0
+    def _upsert(cursor):
+        cursor.executemany("""
+            INSERT INTO empleados (empleado_d365, id_puesto, email, nombre_completo, numero_sap)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(email) DO UPDATE SET
+                empleado_d365=excluded.empleado_d365,
+                id_puesto=excluded.id_puesto,
+                nombre_completo=excluded.nombre_completo,
+                numero_sap=excluded.numero_sap;
+        """, lista_empleados_unicos)
+    try:
+        escribir(DB_PATHS["empleados"], _upsert)
+        logger.info(f"Se insertaron/actualizaron {len(lista_empleados_unicos)} empleados en SQLite.")
+        return len(lista_empleados_unicos)
+    except sqlite3.Error as e:
+        logger.error(f"Error en inserción masiva de empleados: {e}")
+        return 0
 
 def obtener_empleados():
     for attempt in range(MAX_RETRIES):
@@ -811,45 +1057,14 @@ def agregar_datos_tienda_masivo(lista_tiendas):
     if not lista_tiendas:
         logger.warning("Lista de tiendas vacía, no se insertó nada.")
         return 0
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("store_data") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("PRAGMA synchronous = OFF;")
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("DELETE FROM store_data;")
-                query = """
-                    INSERT INTO store_data (
-                        almacen_retiro, sitio_almacen_retiro, id_tienda, id_unidad_operativa, 
-                        nombre_tienda, almacen_envio, sitio_almacen_envio, direccion_unidad_operativa, 
-                        direccion_completa_unidad_operativa
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(id_tienda) DO UPDATE SET
-                        almacen_retiro=excluded.almacen_retiro,
-                        sitio_almacen_retiro=excluded.sitio_almacen_retiro,
-                        id_unidad_operativa=excluded.id_unidad_operativa,
-                        nombre_tienda=excluded.nombre_tienda,
-                        almacen_envio=excluded.almacen_envio,
-                        sitio_almacen_envio=excluded.sitio_almacen_envio,
-                        direccion_unidad_operativa=excluded.direccion_unidad_operativa,
-                        direccion_completa_unidad_operativa=excluded.direccion_completa_unidad_operativa;
-                """
-                cursor.executemany(query, lista_tiendas)
-                conexion.commit()
-                logger.info(f"Se insertaron/actualizaron {len(lista_tiendas)} registros de tiendas en SQLite.")
-                return len(lista_tiendas)
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error en inserción masiva de tiendas tras {MAX_RETRIES} intentos: {e}")
-                return 0
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado en inserción masiva de datos de tiendas: {e}")
-                return 0
+    try:
+        with carga_masiva("store_data", SQL_UPSERT_STORE_DATA) as escribir_lote:
+            escribir_lote(lista_tiendas)
+        logger.info(f"Se insertaron/actualizaron {len(lista_tiendas)} registros de tiendas en SQLite.")
+        return len(lista_tiendas)
+    except sqlite3.Error as e:
+        logger.error(f"Error en inserción de tiendas: {e}")
+        return 0
 
 def limpiar_direccion(direccion):
     if not direccion:
@@ -897,91 +1112,53 @@ def obtener_datos_tienda_por_id(id_tienda):
                 return {}
 
 def actualizar_last_store(email, store_id):
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("empleados") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("UPDATE empleados SET last_store = ? WHERE email = ?", (store_id, email))
-                if cursor.rowcount == 0:
-                    logger.warning(f"No se encontró empleado con email {email} para actualizar last_store.")
-                conexion.commit()
-                logger.info(f"Last_store actualizado a {store_id} para el empleado con email {email}.")
-                return
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al actualizar last_store tras {MAX_RETRIES} intentos: {e}")
-                raise
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado al actualizar last_store para {email}: {e}")
-                raise
+    def _actualizar(cursor):
+        cursor.execute("UPDATE empleados SET last_store = ? WHERE email = ?", (store_id, email))
+        return cursor.rowcount
+    try:
+        if escribir(DB_PATHS["empleados"], _actualizar) == 0:
+            logger.warning(f"No se encontró empleado con email {email} para actualizar last_store.")
+        logger.info(f"Last_store actualizado a {store_id} para el empleado con email {email}.")
+    except sqlite3.Error as e:
+        logger.error(f"Error al actualizar last_store para {email}: {e}")
+        raise
 
 def obtener_contador_pdf():
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("misc") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cursor.execute("SELECT contador_pdf FROM misc WHERE id = 1")
-                contador = cursor.fetchone()
-                nuevo_contador = int(contador[0]) + 1 if contador and contador[0] else 1
-                cursor.execute("SELECT COUNT(*) FROM misc WHERE id = 1")
-                exists = cursor.fetchone()[0] > 0
-                if exists:
-                    cursor.execute("UPDATE misc SET contador_pdf = ? WHERE id = 1", (str(nuevo_contador),))
-                else:
-                    cursor.execute("INSERT INTO misc (id, token_d365, contador, contador_pdf) VALUES (1, NULL, NULL, ?)", (str(nuevo_contador),))
-                conexion.commit()
-                logger.info(f"Contador de PDFs actualizado: {nuevo_contador}")
-                return nuevo_contador
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al actualizar contador_pdf tras {MAX_RETRIES} intentos: {e}")
-                raise
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado al obtener/incrementar contador_pdf: {e}")
-                raise
+    def _incrementar(cursor):
+        cursor.execute("SELECT contador_pdf FROM misc WHERE id = 1")
+        contador = cursor.fetchone()
+        nuevo_contador = int(contador[0]) + 1 if contador and contador[0] else 1
+        if contador is not None:
+            cursor.execute("UPDATE misc SET contador_pdf = ? WHERE id = 1", (str(nuevo_contador),))
+        else:
+            cursor.execute("INSERT INTO misc (id, token_d365, contador, contador_pdf) VALUES (1, NULL, NULL, ?)", (str(nuevo_contador),))
+        return nuevo_contador
+    try:
+        nuevo_contador = escribir(DB_PATHS["misc"], _incrementar)
+        logger.info(f"Contador de PDFs actualizado: {nuevo_contador}")
+        return nuevo_contador
+    except sqlite3.Error as e:
+        logger.error(f"Error al obtener/incrementar contador_pdf: {e}")
+        raise
 
 def save_cart(user_id, cart, timestamp):
     """Guarda o actualiza el carrito de un usuario en la tabla carts."""
-    for attempt in range(MAX_RETRIES):
-        with conectar_db("misc") as conexion:
-            cursor = conexion.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION;")
-                cart_json = json.dumps(cart, ensure_ascii=False)
-                cursor.execute("""
-                    INSERT INTO carts (user_id, cart_json, timestamp)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(user_id) DO UPDATE SET
-                        cart_json = excluded.cart_json,
-                        timestamp = excluded.timestamp;
-                """, (user_id, cart_json, timestamp))
-                conexion.commit()
-                logger.info(f"Carrito guardado para user_id {user_id} con timestamp {timestamp}")
-                return True
-            except sqlite3.OperationalError as e:
-                conexion.rollback()
-                if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Base de datos bloqueada, reintentando ({attempt + 1}/{MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"Error al guardar carrito tras {MAX_RETRIES} intentos: {e}")
-                return False
-            except sqlite3.Error as e:
-                conexion.rollback()
-                logger.error(f"Error inesperado al guardar carrito: {e}")
-                return False
+    cart_json = json.dumps(cart, ensure_ascii=False)
+    def _guardar(cursor):
+        cursor.execute("""
+            INSERT INTO carts (user_id, cart_json, timestamp)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                cart_json = excluded.cart_json,
+                timestamp = excluded.timestamp;
+        """, (user_id, cart_json, timestamp))
+    try:
+        escribir(DB_PATHS["misc"], _guardar)
+        logger.info(f"Carrito guardado para user_id {user_id} con timestamp {timestamp}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar carrito: {e}")
+        return False
 
 def get_cart(user_id):
     for attempt in range(MAX_RETRIES):
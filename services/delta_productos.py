@@ -0,0 +1,108 @@
+# services/delta_productos.py
+"""
+Diferencia fila a fila entre dos versiones del Parquet de productos.
+
+La clave de cada fila es ``(numero_producto, store_number)``. El resultado
+(``CambiosCatalogo``) lo emite ``services.caching.actualizar_cache_productos``
+tras cada descarga para que índices y cachés de clientes apliquen solo lo que
+cambió.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from services.indice_productos import renombrar_columnas_productos
+
+CLAVES_PRODUCTO = ['numero_producto', 'store_number']
+# Columnas cuyo cambio se considera "re-precio"
+COLUMNAS_PRECIO = ('precio_final_con_iva', 'precio_final_con_descuento')
+
+
+class CambiosCatalogo:
+    """Conjunto de cambios entre dos versiones del catálogo.
+
+    - ``agregados``: filas completas (nueva versión) con clave inexistente antes.
+    - ``modificados``: filas completas (nueva versión) con algún valor distinto.
+    - ``eliminados``: claves que ya no están en la nueva versión.
+    - ``repreciados``: claves de ``modificados`` cuyo precio cambió.
+    """
+
+    def __init__(self, version_anterior: Optional[float], version: float,
+                 agregados: pa.Table, modificados: pa.Table, eliminados: pa.Table, repreciados: pa.Table):
+        self.version_anterior = version_anterior
+        self.version = version
+        self.agregados = agregados
+        self.modificados = modificados
+        self.eliminados = eliminados
+        self.repreciados = repreciados
+
+    @property
+    def vacio(self) -> bool:
+        return not (self.agregados.num_rows or self.modificados.num_rows or self.eliminados.num_rows)
+
+    def resumen(self) -> Dict[str, int]:
+        return {
+            "agregados": self.agregados.num_rows,
+            "modificados": self.modificados.num_rows,
+            "eliminados": self.eliminados.num_rows,
+            "repreciados": self.repreciados.num_rows,
+        }
+
+
+def _distintos(nuevo: pa.ChunkedArray, anterior: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Máscara de valores distintos tratando null==null y NaN==NaN como iguales."""
+    if anterior.type != nuevo.type:
+        try:
+            anterior = pc.cast(anterior, nuevo.type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            nuevo, anterior = pc.cast(nuevo, pa.string()), pc.cast(anterior, pa.string())
+    distinto = pc.fill_null(pc.not_equal(nuevo, anterior), False)
+    if pa.types.is_floating(nuevo.type):
+        ambos_nan = pc.and_(pc.fill_null(pc.is_nan(nuevo), False), pc.fill_null(pc.is_nan(anterior), False))
+        distinto = pc.and_(distinto, pc.invert(ambos_nan))
+    return pc.or_(distinto, pc.xor(pc.is_null(nuevo), pc.is_null(anterior)))
+
+
+def _con_fila(table: pa.Table, nombre: str) -> pa.Table:
+    claves = table.select(CLAVES_PRODUCTO)
+    return claves.append_column(nombre, pa.array(np.arange(table.num_rows, dtype=np.int64)))
+
+
+def calcular_cambios_productos(anterior: Optional[pa.Table], nuevo: pa.Table,
+                               version_anterior: Optional[float] = None, version: float = 0.0) -> CambiosCatalogo:
+    """Compara dos tablas de productos (nombres originales o canónicos) por clave."""
+    nuevo = renombrar_columnas_productos(nuevo)
+    vacia_claves = pa.table({c: pa.array([], type=pa.string()) for c in CLAVES_PRODUCTO})
+    if anterior is None or anterior.num_rows == 0:
+        return CambiosCatalogo(version_anterior, version, nuevo, nuevo.slice(0, 0), vacia_claves, vacia_claves)
+
+    anterior = renombrar_columnas_productos(anterior)
+    cruce = _con_fila(nuevo, '_fila_nueva').join(
+        _con_fila(anterior, '_fila_anterior'), keys=CLAVES_PRODUCTO, join_type='full outer')
+
+    fila_nueva = cruce.column('_fila_nueva')
+    fila_anterior = cruce.column('_fila_anterior')
+    es_agregado = pc.is_null(fila_anterior)
+    es_eliminado = pc.is_null(fila_nueva)
+    en_ambos = cruce.filter(pc.invert(pc.or_(es_agregado, es_eliminado)))
+
+    agregados = nuevo.take(cruce.filter(es_agregado).column('_fila_nueva'))
+    eliminados = cruce.filter(es_eliminado).select(CLAVES_PRODUCTO)
+
+    idx_nuevo = en_ambos.column('_fila_nueva')
+    idx_anterior = en_ambos.column('_fila_anterior')
+    cambio = pa.chunked_array([pa.array(np.zeros(en_ambos.num_rows, dtype=bool))])
+    cambio_precio = cambio
+    comparables: List[str] = [c for c in nuevo.column_names
+                              if c in anterior.column_names and c not in CLAVES_PRODUCTO]
+    for col in comparables:
+        distinto = _distintos(nuevo.column(col).take(idx_nuevo), anterior.column(col).take(idx_anterior))
+        cambio = pc.or_(cambio, distinto)
+        if col in COLUMNAS_PRECIO:
+            cambio_precio = pc.or_(cambio_precio, distinto)
+
+    modificados = nuevo.take(en_ambos.filter(cambio).column('_fila_nueva'))
+    repreciados = en_ambos.filter(cambio_precio).select(CLAVES_PRODUCTO)
+    return CambiosCatalogo(version_anterior, version, agregados, modificados, eliminados, repreciados)
@@ -0,0 +1,119 @@
+# services/extraccion_lotes.py
+"""
+Extracción en streaming desde un cursor DB-API (pyodbc/Fabric o sqlite3).
+
+En lugar de ``cursor.fetchall()`` + listas/dicts fila a fila, se leen lotes con
+``fetchmany(batch)`` y cada lote se convierte columna a columna en un
+``pa.RecordBatch`` con esquema explícito (decimales tipados, códigos de almacén
+codificados como diccionario). De ese mismo lote se escriben:
+
+- el ``pq.ParquetWriter`` (archivo temporal + rename atómico al terminar), y
+- el *sink* SQLite (p. ej. ``services.database.carga_masiva``), con los valores
+  ya normalizados por Arrow (decimales -> float, diccionarios -> texto).
+
+La memoria pico queda acotada al tamaño del lote, sin importar el tamaño de la tabla.
+"""
+import os
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from services.guarda_publicacion import verificar_publicacion
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+FABRIC_BATCH_SIZE = int(os.getenv("FABRIC_BATCH_SIZE", "50000"))
+
+
+def _columna_arrow(valores: Sequence, tipo: pa.DataType) -> pa.Array:
+    if pa.types.is_decimal(tipo):
+        # pyodbc entrega Decimal con la escala de origen: se redondea a la del esquema
+        arr = pa.array(valores)
+        if pa.types.is_decimal(arr.type) and arr.type.scale > tipo.scale:
+            arr = pc.round(arr, tipo.scale)
+        return arr.cast(tipo)
+    try:
+        return pa.array(valores, type=tipo)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(valores).cast(tipo)
+
+
+def lote_arrow(filas: Sequence, schema: pa.Schema) -> pa.RecordBatch:
+    """Convierte un lote de filas (tuplas/pyodbc.Row) en un RecordBatch con ``schema``."""
+    columnas = list(zip(*filas))
+    return pa.RecordBatch.from_arrays(
+        [_columna_arrow(valores, campo.type) for valores, campo in zip(columnas, schema)], schema=schema)
+
+
+def filas_sqlite(lote: pa.RecordBatch) -> List[tuple]:
+    """Filas para ``executemany`` a partir del lote Arrow (SQLite no acepta Decimal)."""
+    columnas = []
+    for col in lote.columns:
+        if pa.types.is_decimal(col.type):
+            col = pc.cast(col, pa.float64())
+        elif pa.types.is_dictionary(col.type):
+            col = col.dictionary_decode()
+        columnas.append(col.to_pylist())
+    return list(zip(*columnas))
+
+
+def decimales_a_float(table: pa.Table) -> pa.Table:
+    """Castea a float64 las columnas decimales (para respuestas JSON numéricas)."""
+    for i, campo in enumerate(table.schema):
+        if pa.types.is_decimal(campo.type):
+            table = table.set_column(i, campo.name, pc.cast(table.column(i), pa.float64()))
+    return table
+
+
+def extraer_en_lotes(cursor, query: str, columnas: Sequence[Tuple[str, pa.DataType]],
+                     escribir_sqlite: Optional[Callable[[Sequence], None]] = None,
+                     destino_parquet: Optional[str] = None, params: Optional[Sequence] = None,
+                     batch: int = FABRIC_BATCH_SIZE, nombre: str = "extracción") -> int:
+    """Ejecuta ``query`` y vuelca el resultado lote a lote. Devuelve la cantidad de filas.
+
+    ``columnas`` define nombre y tipo Arrow de cada columna del SELECT (en orden);
+    SQLite y Parquet reciben los mismos valores, ya convertidos por ese esquema.
+    Si no hay filas no se toca ``destino_parquet``.
+    """
+    if params:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
+
+    schema = pa.schema(columnas)
+    tmp = f"{destino_parquet}.tmp" if destino_parquet else None
+    writer = None
+    total = 0
+    try:
+        while True:
+            filas = cursor.fetchmany(batch)
+            if not filas:
+                break
+            lote = lote_arrow(filas, schema)
+            del filas
+            verificar_publicacion(nombre)
+            if escribir_sqlite is not None:
+                escribir_sqlite(filas_sqlite(lote))
+            if destino_parquet:
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, schema)
+                writer.write_batch(lote)
+            total += lote.num_rows
+            logger.debug(f"{nombre}: {total} filas procesadas")
+
+        if writer is not None:
+            writer.close()
+            writer = None
+            verificar_publicacion(nombre)
+            os.replace(tmp, destino_parquet)
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    logger.info(f"{nombre}: {total} filas extraídas en lotes de {batch}")
+    return total
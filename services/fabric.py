@@ -4,8 +4,12 @@ import pyodbc
 import asyncio
 import configparser
 import requests
-from services.database import agregar_atributos_masivo, agregar_stock_masivo, \
-    agregar_grupos_cumplimiento_masivo, agregar_empleados_masivo, agregar_datos_tienda_masivo
+import pyarrow as pa
+from services.database import agregar_grupos_cumplimiento_masivo, agregar_empleados_masivo, \
+    carga_masiva, SQL_INSERT_ATRIBUTOS, SQL_UPSERT_STOCK, SQL_UPSERT_STORE_DATA
+from services.config import CACHE_FILE_STOCK, CACHE_FILE_ATRIBUTOS
+from services.extraccion_lotes import extraer_en_lotes
+from services.registro_tablas import publicar_tabla
 from services.logging_utils import get_module_logger
 
 # Obtén la ruta absoluta a la raíz del proyecto
@@ -18,6 +22,52 @@ config.read(CONFIG_PATH)
 
 logger = get_module_logger(__name__)
 
+# Esquemas Arrow de los Parquet generados en streaming (mismo orden que el SELECT).
+# Cantidades como decimal exacto; códigos de almacén (pocos valores distintos) como diccionario.
+CANTIDAD = pa.decimal128(28, 6)
+CODIGO_ALMACEN = pa.dictionary(pa.int32(), pa.string())
+
+COLUMNAS_STOCK = [
+    ("codigo", pa.string()),
+    ("almacen_365", CODIGO_ALMACEN),
+    ("stock_fisico", CANTIDAD),
+    ("disponible_venta", CANTIDAD),
+    ("disponible_entrega", CANTIDAD),
+    ("comprometido", CANTIDAD),
+]
+COLUMNAS_ATRIBUTOS = [
+    ("ProductNumber", pa.string()),
+    ("ProductName", pa.string()),
+    ("AttributeName", pa.string()),
+    ("AttributeValue", pa.string()),
+]
+COLUMNAS_CODIGOS_POSTALES = [
+    ("AddressZipCode", pa.string()),
+    ("AddressCountryRegionId", pa.string()),
+    ("AddressState", pa.string()),
+    ("AddressCounty", pa.string()),
+    ("AddressCity", pa.string()),
+    ("CountyName", pa.string()),
+]
+COLUMNAS_EMPLEADOS = [
+    ("empleado_d365", pa.string()),
+    ("id_puesto", pa.string()),
+    ("email", pa.string()),
+    ("nombre_completo", pa.string()),
+    ("numero_sap", pa.string()),
+]
+COLUMNAS_DATOS_TIENDAS = [
+    ("almacen_retiro", CODIGO_ALMACEN),
+    ("sitio_almacen_retiro", pa.string()),
+    ("id_tienda", pa.string()),
+    ("id_unidad_operativa", pa.string()),
+    ("nombre_tienda", pa.string()),
+    ("almacen_envio", CODIGO_ALMACEN),
+    ("sitio_almacen_envio", pa.string()),
+    ("direccion_unidad_operativa", pa.string()),
+    ("direccion_completa_unidad_operativa", pa.string()),
+]
+
 def load_db_config():
     """
     Loads the database configuration settings from the application's configuration file.
@@ -93,7 +143,8 @@ def obtener_parquet_productos():
 
 def obtener_atributos_fabric():
     """
-    Obtains attributes from the Fabric database and inserts them into another system in bulk.
+    Obtiene los atributos desde Fabric en lotes (fetchmany) y los vuelca a la vez en
+    SQLite (reemplazo total vía tabla sombra) y en atributos_cache.parquet.
     """
     query = "SELECT * FROM Atributos;"
     conexion_fabric = conectar_fabric_db()
@@ -101,17 +152,16 @@ def obtener_atributos_fabric():
         logger.error("No se pudo conectar a la base de datos de Fabric.")
         return 0
 
-    cursor_fabric = conexion_fabric.cursor()
-
     try:
-        cursor_fabric.execute(query)
-        atributos = cursor_fabric.fetchall()
-
-        if not atributos:
+        with carga_masiva("atributos", SQL_INSERT_ATRIBUTOS) as escribir:
+            total_insertados = extraer_en_lotes(
+                conexion_fabric.cursor(), query, COLUMNAS_ATRIBUTOS,
+                escribir_sqlite=escribir, destino_parquet=CACHE_FILE_ATRIBUTOS, nombre="atributos_fabric",
+            )
+        if not total_insertados:
             logger.info("No se encontraron atributos en Fabric.")
             return 0
-
-        total_insertados = agregar_atributos_masivo(atributos)
+        publicar_tabla(CACHE_FILE_ATRIBUTOS)
         return total_insertados
 
     except Exception as e:
@@ -124,7 +174,8 @@ def obtener_atributos_fabric():
 
 def obtener_stock_fabric():
     """
-    Obtiene el stock desde Fabric y lo almacena en la base de datos local.
+    Obtiene el stock desde Fabric en lotes (fetchmany) y escribe cada lote en SQLite
+    (upsert) y en stock_cache.parquet: memoria constante sin importar el volumen.
     """
     query = """
     SELECT Codigo, Almacen_365, StockFisico, DisponibleVenta, DisponibleEntrega, Comprometido 
@@ -137,15 +188,15 @@ def obtener_stock_fabric():
         return 0
 
     try:
-        cursor = conexion_fabric.cursor()
-        cursor.execute(query)
-        stock_data = cursor.fetchall()
-
-        if not stock_data:
+        with carga_masiva("stock", SQL_UPSERT_STOCK) as escribir:
+            total_insertados = extraer_en_lotes(
+                conexion_fabric.cursor(), query, COLUMNAS_STOCK,
+                escribir_sqlite=escribir, destino_parquet=CACHE_FILE_STOCK, nombre="stock_fabric",
+            )
+        if not total_insertados:
             logger.info("No se encontraron datos de stock en Fabric.")
             return 0
-
-        total_insertados = agregar_stock_masivo(stock_data)
+        publicar_tabla(CACHE_FILE_STOCK)
         return total_insertados
 
     except Exception as e:
@@ -234,8 +285,8 @@ def obtener_empleados_fabric():
 
 def obtener_datos_tiendas():
     """
-    Obtiene los datos de productos desde la base de datos Fabric y los almacena localmente.
-    Usa fetchall() para recuperar todos los datos en una sola llamada.
+    Obtiene los datos de tiendas desde Fabric y los almacena localmente.
+    Lee en lotes (fetchmany) y reemplaza store_data en una sola transacción.
     """
     query = """
     SELECT
@@ -265,20 +316,17 @@ def obtener_datos_tiendas():
         raise ConnectionError("Error de conexión: No se pudo conectar a Fabric DB.")
 
     try:
-        cursor_fabric = conexion_fabric.cursor()
-        logger.info("Ejecutando consulta SQL en Fabric...")
-        cursor_fabric.execute(query)
-        logger.info("Consulta ejecutada con éxito.")
-
-        logger.info("Recuperando los datos de tiendas con fetchall()...")
-        productos = cursor_fabric.fetchall()
-        logger.info(f"Número de registros recuperados: {len(productos)}")
-
-        if not productos:
+        logger.info("Ejecutando consulta SQL en Fabric (lectura en lotes)...")
+        with carga_masiva("store_data", SQL_UPSERT_STORE_DATA) as escribir:
+            total_insertados = extraer_en_lotes(
+                conexion_fabric.cursor(), query, COLUMNAS_DATOS_TIENDAS,
+                escribir_sqlite=escribir, nombre="datos_tiendas",
+            )
+        if not total_insertados:
+            # carga_masiva descartó la sombra: store_data queda como estaba
             logger.info("No se encontraron datos en Fabric.")
             return 0
 
-        total_insertados = agregar_datos_tienda_masivo(productos)
         logger.info(f"Total de datos de tiendas insertados: {total_insertados}")
 
         return total_insertados
@@ -292,10 +340,11 @@ def obtener_datos_tiendas():
             conexion_fabric.close()
             logger.info("Conexión con Fabric cerrada.")
 
-def obtener_codigos_postales_fabric():
-    """Obtiene el padrón de códigos postales para Argentina desde Fabric.
+def obtener_codigos_postales_fabric(destino_parquet: str) -> int:
+    """Exporta el padrón de códigos postales de Argentina desde Fabric a ``destino_parquet``.
 
-    Devuelve una lista de dict con claves:
+    Lee en lotes (fetchmany) y escribe cada lote en el Parquet; devuelve la cantidad
+    de registros. Columnas:
     - AddressZipCode, AddressCountryRegionId, AddressState, AddressCounty, AddressCity, CountyName
     """
     query = """
@@ -321,29 +370,17 @@ def obtener_codigos_postales_fabric():
     conexion_fabric = conectar_fabric_db()
     if not conexion_fabric:
         logger.error("No se pudo conectar a Fabric.")
-        return []
+        return 0
     try:
-        cursor = conexion_fabric.cursor()
-        cursor.execute(query)
-        filas = cursor.fetchall()
-        out = []
-        for row in filas:
-            try:
-                out.append({
-                    "AddressZipCode": row.AddressZipCode,
-                    "AddressCountryRegionId": row.AddressCountryRegionId,
-                    "AddressState": row.AddressState,
-                    "AddressCounty": row.AddressCounty,
-                    "AddressCity": row.AddressCity,
-                    "CountyName": row.CountyName,
-                })
-            except Exception:
-                continue
-        logger.info(f"obtener_codigos_postales_fabric: {len(out)} registros")
-        return out
+        total = extraer_en_lotes(
+            conexion_fabric.cursor(), query, COLUMNAS_CODIGOS_POSTALES,
+            destino_parquet=destino_parquet, nombre="codigos_postales_fabric",
+        )
+        logger.info(f"obtener_codigos_postales_fabric: {total} registros")
+        return total
     except Exception as e:
         logger.error(f"Error obtener_codigos_postales_fabric: {e}\n{traceback.format_exc()}")
-        return []
+        return 0
     finally:
         try:
             conexion_fabric.close()
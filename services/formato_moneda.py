@@ -0,0 +1,160 @@
+# services/formato_moneda.py
+"""
+Formateo vectorizado de importes al estilo argentino ("1.234.567,89").
+
+Reemplaza el lambda ``f"{x:,.2f}".replace(".", "X")...`` aplicado celda por
+celda y el ``locale.format_string`` por valor: trabaja sobre columnas completas
+(Arrow/NumPy) con operaciones por lote de NumPy y construye el resultado como
+un ``pa.StringArray`` sin pasar por objetos Python.
+
+Compatibilidad con el formateo anterior:
+- redondeo a 2 decimales idéntico a ``format(x, ".2f")`` (los casi-empates se
+  resuelven con el algoritmo exacto de Python);
+- valores negativos (incluido ``-0.0``) llevan el signo ``-``;
+- NaN/nulos se devuelven como ``nulo`` (por defecto ``"nan"``, como hacía pandas);
+- los decimales (``decimal128`` de Arrow, ``Decimal`` de Python) se redondean a 2
+  cifras en su propio tipo con medio al par, como ``format(Decimal, ".2f")``, antes
+  de pasar a float: ``Decimal("1234.565")`` -> ``"1.234,56"``.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Por encima de este valor absoluto se usa el formateo exacto de Python
+_LIMITE_VECTORIZADO = 1e15
+# Dígitos ASCII de "000".."999" y "00".."99": una tabla por posición, indexable por valor
+_TABLA_3_DIGITOS = [np.array([ord(f"{i:03d}"[j]) for i in range(1000)], dtype=np.uint8) for j in range(3)]
+_TABLA_2_DIGITOS = [np.array([ord(f"{i:02d}"[j]) for i in range(100)], dtype=np.uint8) for j in range(2)]
+_CENTAVO = Decimal("0.01")
+
+
+def formatear_valor_ars(valor) -> str:
+    """Formatea un único valor numérico (uso puntual; para columnas usar ``formatear_ars``)."""
+    texto = f"{valor:,.2f}" if isinstance(valor, Decimal) else f"{float(valor):,.2f}"
+    return texto.replace(".", "X").replace(",", ".").replace("X", ",")
+
+
+def _decimal_a_float(valor) -> float:
+    if valor is None:
+        return np.nan
+    if isinstance(valor, Decimal):
+        return float(valor.quantize(_CENTAVO, rounding=ROUND_HALF_EVEN)) if valor.is_finite() else float(valor)
+    return valor
+
+
+def _a_float64(valores) -> np.ndarray:
+    if isinstance(valores, pa.ChunkedArray):
+        valores = valores.combine_chunks()
+    if isinstance(valores, pa.Array):
+        if pa.types.is_decimal(valores.type):
+            # Redondeo en el tipo decimal: pasar antes a float cambia los empates (1234.565)
+            redondeados = pc.round(valores, ndigits=2, round_mode="half_to_even")
+            x = pc.cast(redondeados, pa.float64()).to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+            negativos = np.asarray(pc.fill_null(pc.less(valores, pa.scalar(0, valores.type)), False))
+            return np.where(negativos & (x == 0), -0.0, x)
+        if not pa.types.is_floating(valores.type):
+            valores = pc.cast(valores, pa.float64())
+        return valores.to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+    if isinstance(valores, list) or (isinstance(valores, np.ndarray) and valores.dtype == object):
+        return np.array([_decimal_a_float(v) for v in valores], dtype=np.float64)
+    return np.array(valores, dtype=np.float64)
+
+
+def _componer_texto(enteros: np.ndarray, decimales: np.ndarray, negativos: np.ndarray) -> pa.Array:
+    """Arma el texto "-1.234,56" de todas las filas a la vez.
+
+    Cada número se escribe alineado a la derecha en una matriz de bytes de ancho
+    fijo copiando los dígitos de cada grupo de miles desde tablas precalculadas; luego se
+    recortan los ceros a la izquierda con una máscara y el resultado se usa
+    directamente como buffer de un ``pa.StringArray``.
+    """
+    n = enteros.shape[0]
+    # Solo los grupos de miles que realmente usa el mayor valor de la columna
+    grupos = max(1, -(-len(str(int(enteros.max()))) // 3))
+    ancho = 1 + grupos * 4 - 1 + 3
+    matriz = np.empty((n, ancho), dtype=np.uint8)
+
+    matriz[:, -3] = ord(",")
+    for j in range(2):
+        matriz[:, ancho - 2 + j] = _TABLA_2_DIGITOS[j].take(decimales)
+    resto = enteros
+    for k in range(grupos):
+        fin = ancho - 3 - 4 * k
+        grupo = resto % 1000
+        for j in range(3):
+            matriz[:, fin - 3 + j] = _TABLA_3_DIGITOS[j].take(grupo)
+        resto = resto // 1000
+        if k + 1 < grupos:
+            matriz[:, fin - 4] = ord(".")
+
+    digitos = np.ones(n, dtype=np.int64)
+    for k in range(1, grupos * 3):
+        digitos += enteros >= 10 ** k
+    largos = digitos + (digitos - 1) // 3 + 3 + negativos
+    inicio = ancho - largos
+
+    filas = np.flatnonzero(negativos)
+    matriz[filas, inicio[filas]] = ord("-")
+    mascara = np.arange(ancho) >= inicio[:, None]
+
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(largos, out=offsets[1:])
+    datos = matriz[mascara]
+    return pa.StringArray.from_buffers(n, pa.py_buffer(offsets), pa.py_buffer(datos))
+
+
+def formatear_ars(valores, nulo: Optional[str] = "nan") -> pa.Array:
+    """Formatea una columna numérica completa. Devuelve un ``pa.StringArray``.
+
+    ``valores`` puede ser ``pa.Array``, ``pa.ChunkedArray``, ``np.ndarray`` o lista
+    (``None`` se trata como nulo). Con ``nulo=None`` los nulos quedan como null de Arrow.
+    """
+    x = _a_float64(valores)
+    if x.size == 0:
+        return pa.array([], type=pa.string())
+
+    finitos = np.isfinite(x)
+    escalado = np.abs(np.where(finitos, x, 0.0)) * 100.0
+    # Casi-empates (p. ej. 21548.195): el producto en coma flotante puede caer del
+    # otro lado del .5; esos pocos valores se formatean con el algoritmo exacto de Python.
+    fraccion = escalado - np.floor(escalado)
+    empates = np.abs(fraccion - 0.5) <= escalado * 1e-15 + 1e-9
+    exactos = finitos & ((np.abs(x) >= _LIMITE_VECTORIZADO) | empates)
+    normales = finitos & ~exactos
+
+    centavos = np.zeros(x.shape, dtype=np.int64)
+    centavos[normales] = np.rint(escalado[normales]).astype(np.int64)
+    resultado = _componer_texto(centavos // 100, centavos % 100, np.signbit(x))
+
+    if not normales.all():
+        # Casos raros (NaN, inf, empates, importes enormes): se resuelven valor por valor
+        reemplazos = []
+        for v in x[~normales]:
+            if np.isnan(v):
+                reemplazos.append(nulo)
+            elif np.isinf(v):
+                reemplazos.append("-inf" if v < 0 else "inf")
+            else:
+                reemplazos.append(formatear_valor_ars(v))
+        resultado = pc.replace_with_mask(resultado, pa.array(~normales), pa.array(reemplazos, type=pa.string()))
+    return resultado
+
+
+def formatear_lista_ars(valores: Iterable, nulo: Optional[str] = "N/A") -> list:
+    """Variante para listas Python (p. ej. filas de SQLite). Nulos -> ``nulo``."""
+    valores = list(valores)
+    if not valores:
+        return []
+    return formatear_ars(valores, nulo=nulo).to_pylist()
+
+
+def formatear_columnas_ars(table: pa.Table, columnas: Sequence[str], nulo: Optional[str] = "nan") -> pa.Table:
+    """Reemplaza en ``table`` las columnas indicadas (si existen) por su versión formateada."""
+    for col in columnas:
+        if col in table.column_names:
+            pos = table.column_names.index(col)
+            table = table.set_column(pos, col, formatear_ars(table.column(col), nulo=nulo))
+    return table
@@ -1,6 +1,7 @@
 import requests
 import configparser
 import os
+import time
 from django.http import JsonResponse
 from services.logging_utils import get_module_logger
 
@@ -14,6 +15,9 @@ config.read(CONFIG_PATH)
 
 logger = get_module_logger(__name__)
 
+# Si la respuesta no trae expires_in (segundos)
+DURACION_TOKEN_POR_DEFECTO = 3600
+
 
 class TokenRetrievalError(Exception):
     """Error raised when D365 access token retrieval fails."""
@@ -40,7 +44,8 @@ def load_d365_config():
     }
 
 
-def get_access_token_d365():
+def solicitar_token_d365():
+    """Pide un token nuevo al endpoint OAuth. Devuelve ``(access_token, vencimiento epoch)``."""
 
     d365_config = load_d365_config()
     client_id_prod = d365_config["client_id_prod"]
@@ -55,19 +60,26 @@ def get_access_token_d365():
     }
 
     try:
+        pedido = time.time()
         response = requests.post(token_url, data=token_params, timeout=60)
         response.raise_for_status()  # Verificar si hay errores en la respuesta
 
         token_data = response.json()
         access_token = token_data['access_token']
+        # expires_in se cuenta desde el pedido (no desde la respuesta) para no pasarse
+        expira = pedido + int(token_data.get('expires_in') or DURACION_TOKEN_POR_DEFECTO)
         logger.info("Consulta token a D365 OK")
-        return access_token
+        return access_token, expira
 
-    except requests.RequestException as e:
+    except (requests.RequestException, KeyError, ValueError) as e:
         logger.error(f"Consulta token a D365 FALLO. {e}")
         raise TokenRetrievalError("No se pudo obtener el token de acceso") from e
 
 
+def get_access_token_d365():
+    return solicitar_token_d365()[0]
+
+
 def get_access_token_d365_qa():
 
     d365_config = load_d365_config()
@@ -0,0 +1,39 @@
+# services/guarda_publicacion.py
+"""
+Guarda de publicación para los jobs del scheduler (fencing del líder).
+
+Un líder que pierde el lease (``core.liderazgo``) deja de disparar jobs, pero los
+que ya corren seguirían escribiendo en paralelo con el nuevo líder: la misma tabla
+sombra, el mismo ``.tmp`` de un Parquet. Los puntos de publicación llaman a
+``verificar_publicacion`` antes de escribir o reemplazar:
+
+- cada lote y el swap de ``services.database.carga_masiva`` (el swap, dentro de
+  la misma transacción de escritura);
+- cada lote y el ``os.replace`` de ``services.extraccion_lotes`` y de las
+  descargas de ``services.caching``;
+- el reemplazo del snapshot Arrow (``services.registro_tablas``).
+
+Sin guarda registrada (un solo proceso, comandos de management) no se bloquea nada.
+"""
+from typing import Callable, Optional
+
+_guarda: Optional[Callable[[], bool]] = None
+
+
+class PublicacionRechazada(RuntimeError):
+    """El proceso dejó de ser líder: el job en curso no debe publicar."""
+
+
+def registrar_guarda(fn: Optional[Callable[[], bool]]):
+    """``fn()`` devuelve si este proceso puede publicar (None quita la guarda)."""
+    global _guarda
+    _guarda = fn
+
+
+def puede_publicar() -> bool:
+    return _guarda is None or _guarda()
+
+
+def verificar_publicacion(que: str):
+    if not puede_publicar():
+        raise PublicacionRechazada(f"{que}: el proceso ya no es líder del scheduler")
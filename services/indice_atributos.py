@@ -0,0 +1,101 @@
+# services/indice_atributos.py
+"""
+Índice en memoria de los atributos de producto (Parquet) para
+``/producto/atributos/<id>`` y ``/api/productos/atributos/batch``.
+
+Se construye una sola vez por versión del Parquet (mtime) desde
+``core.scheduler.load_atributos_index``, al terminar el job ``atributos_fabric``:
+
+- tabla ordenada por ``ProductNumber`` (normalizado) y ``AttributeName``: los
+  atributos de cada producto quedan contiguos. El snapshot Arrow ya se escribe en
+  ese orden (``ordenar_atributos``) y la tabla mapeada se usa sin copiarla;
+- mapa hash ``producto -> (offset, largo)`` con el rango de filas del producto.
+
+Un producto es un ``slice`` (sin copiar); varios productos, un solo ``take``.
+"""
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from services.indice_stock import normalizar_codigo
+from services.orden_tablas import aplicar_orden, rangos_ordenados
+
+# Tope de productos por llamada a /api/productos/atributos/batch
+ATRIBUTOS_BATCH_MAX_PRODUCTOS = int(os.getenv("ATRIBUTOS_BATCH_MAX_PRODUCTOS", "200"))
+
+
+def _normalizar_columna(col) -> pa.ChunkedArray:
+    if pa.types.is_dictionary(col.type):
+        col = col.cast(col.type.value_type)
+    if not pa.types.is_string(col.type) and not pa.types.is_large_string(col.type):
+        col = pc.cast(col, pa.string())
+    return pc.utf8_upper(pc.utf8_trim_whitespace(col))
+
+
+def _claves_atributos(table: pa.Table):
+    productos = _normalizar_columna(table.column('ProductNumber'))
+    claves = {'producto': productos}
+    orden_claves = [('producto', 'ascending')]
+    if 'AttributeName' in table.column_names:
+        claves['atributo'] = table.column('AttributeName')
+        orden_claves.append(('atributo', 'ascending'))
+    return productos, pc.sort_indices(pa.table(claves), sort_keys=orden_claves)
+
+
+def ordenar_atributos(table: pa.Table) -> pa.Table:
+    """Tabla en el orden de ``IndiceAtributos`` (para escribir el snapshot ya ordenado)."""
+    if 'ProductNumber' not in table.column_names:
+        return table
+    return table.take(_claves_atributos(table)[1])
+
+
+class IndiceAtributos:
+    """Atributos agrupados por producto en rangos contiguos."""
+
+    def __init__(self, table: pa.Table, version: float = 0.0):
+        self.version = version
+        self._rangos: Dict[str, Tuple[int, int]] = {}
+
+        if 'ProductNumber' not in table.column_names:
+            self.table = table
+            return
+
+        productos, orden = _claves_atributos(table)
+        self.table = aplicar_orden(table, orden)
+        self._rangos = rangos_ordenados(productos.take(orden))
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def num_productos(self) -> int:
+        return len(self._rangos)
+
+    def buscar(self, producto) -> pa.Table:
+        """Tabla Arrow con los atributos del producto (vacía si no tiene)."""
+        rango = self._rangos.get(normalizar_codigo(producto))
+        if rango is None:
+            return self.table.slice(0, 0)
+        return self.table.slice(*rango)
+
+    def atributos(self, producto) -> List[dict]:
+        return self.buscar(producto).to_pylist()
+
+    def atributos_lote(self, productos: Iterable) -> Dict[str, List[dict]]:
+        """``producto -> [atributos]`` para varios productos con un solo ``take``."""
+        pedidos = list(dict.fromkeys(normalizar_codigo(p) for p in productos))
+        salida: Dict[str, List[dict]] = {p: [] for p in pedidos if p}
+        rangos = [(p, self._rangos[p]) for p in salida if p in self._rangos]
+        if not rangos:
+            return salida
+        filas = np.concatenate([np.arange(o, o + n, dtype=np.int64) for _, (o, n) in rangos])
+        registros = self.table.take(filas).to_pylist()
+        inicio = 0
+        for producto, (_, largo) in rangos:
+            salida[producto] = registros[inicio:inicio + largo]
+            inicio += largo
+        return salida
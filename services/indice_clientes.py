@@ -0,0 +1,221 @@
+# services/indice_clientes.py
+"""
+Índice de búsqueda de clientes para /api/clientes/search.
+
+Se construye una vez por versión del Parquet de clientes (mtime) desde
+``core.scheduler.load_clientes_index`` sobre ``nif``, ``numero_cliente`` y
+``nombre_cliente`` (texto en minúsculas y sin acentos):
+
+- índice de prefijos: todas las claves ordenadas, búsqueda binaria;
+- índice de trigramas (bytes UTF-8) en formato CSR con NumPy: para cada
+  trigrama, las filas que lo contienen, ordenadas.
+
+``buscar`` devuelve primero coincidencias por prefijo y luego por substring
+(intersección de listas de trigramas + verificación), cortando al llegar a
+``limite``: el costo depende del resultado, no del tamaño del padrón.
+``por_numero`` resuelve un ``numero_cliente`` exacto con un mapa hash.
+"""
+from typing import List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CAMPOS_BUSQUEDA_CLIENTES = ('nif', 'numero_cliente', 'nombre_cliente')
+
+# Nombres originales del Parquet (si vienen así) -> nombres canónicos de las vistas
+MAPEO_COLUMNAS_CLIENTES = {
+    'Bloqueado': 'bloqueado',
+    'Tipo_Contribuyente': 'tipo_contribuyente',
+    'Numero_Cliente': 'numero_cliente',
+    'Nombre_Cliente': 'nombre_cliente',
+    'Limite_Credito': 'limite_credito',
+    'Grupo_Impuestos': 'grupo_impuestos',
+    'NIF': 'nif',
+    'TIF': 'tif',
+    'Direccion_Completa': 'direccion_completa',
+    'Fecha_Modificacion': 'fecha_modificacion',
+    'Fecha_Creacion': 'fecha_creacion',
+    'EmailContacto': 'email_contacto',
+    'TelefonoContacto': 'telefono_contacto',
+}
+LIMITE_RESULTADOS = 10
+
+_ACENTOS = {'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u', 'ü': 'u', 'ñ': 'n'}
+
+
+def normalizar_texto(valor: str) -> str:
+    valor = (valor or '').strip().lower()
+    for con, sin in _ACENTOS.items():
+        valor = valor.replace(con, sin)
+    return valor
+
+
+def _normalizar_columna(col) -> pa.Array:
+    if isinstance(col, pa.ChunkedArray):
+        col = col.combine_chunks()
+    if pa.types.is_dictionary(col.type):
+        col = col.dictionary_decode()
+    if not pa.types.is_string(col.type):
+        col = pc.cast(col, pa.string())
+    col = pc.utf8_lower(pc.utf8_trim_whitespace(col))
+    for con, sin in _ACENTOS.items():
+        col = pc.replace_substring(col, con, sin)
+    return col
+
+
+def _trigramas(col: pa.StringArray, filas_base: np.ndarray):
+    """Códigos de trigrama (3 bytes -> int) y fila de cada uno, para toda la columna."""
+    offsets = np.frombuffer(col.buffers()[1], dtype=np.int32)[col.offset:col.offset + len(col) + 1]
+    datos = np.frombuffer(col.buffers()[2], dtype=np.uint8) if col.buffers()[2] is not None \
+        else np.zeros(0, dtype=np.uint8)
+    inicio, fin = offsets[:-1].astype(np.int64), offsets[1:].astype(np.int64)
+    cantidad = np.maximum(fin - inicio - 2, 0)
+    if not cantidad.sum():
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    filas = np.repeat(filas_base, cantidad)
+    # posición de cada trigrama: inicio de su string + 0..cantidad-1
+    desde = np.repeat(inicio - np.concatenate(([0], np.cumsum(cantidad)[:-1])), cantidad)
+    pos = desde + np.arange(filas.shape[0])
+    codigos = (datos[pos].astype(np.int64) << 16) | (datos[pos + 1].astype(np.int64) << 8) | datos[pos + 2]
+    return codigos, filas
+
+
+def _codigos_query(q: str) -> np.ndarray:
+    b = q.encode('utf-8')
+    return np.unique(np.array([(b[i] << 16) | (b[i + 1] << 8) | b[i + 2] for i in range(len(b) - 2)],
+                              dtype=np.int64))
+
+
+class IndiceClientes:
+    """Índice de prefijos + trigramas sobre los campos de búsqueda de clientes."""
+
+    def __init__(self, table: pa.Table, version: float = 0.0):
+        table = table.rename_columns([MAPEO_COLUMNAS_CLIENTES.get(c, c) for c in table.column_names])
+        self.table = table
+        self.version = version
+        self.campos = [c for c in CAMPOS_BUSQUEDA_CLIENTES if c in table.column_names]
+        self._textos = {c: _normalizar_columna(table.column(c)) for c in self.campos}
+
+        # numero_cliente exacto -> primera fila
+        self._por_numero = {}
+        if 'numero_cliente' in table.column_names:
+            numeros = table.column('numero_cliente')
+            if not pa.types.is_string(numeros.type):
+                numeros = pc.cast(numeros, pa.string())
+            for fila, numero in enumerate(numeros.to_pylist()):
+                if numero is not None:
+                    self._por_numero.setdefault(numero.strip(), fila)
+
+        filas = np.arange(table.num_rows, dtype=np.int64)
+        claves, claves_filas, codigos, codigos_filas = [], [], [], []
+        for campo in self.campos:
+            col = self._textos[campo]
+            validos = np.asarray(pc.fill_null(pc.greater(pc.utf8_length(col), 0), False))
+            claves.append(col.filter(pa.array(validos)))
+            claves_filas.append(filas[validos])
+            c, f = _trigramas(col, filas)
+            codigos.append(c)
+            codigos_filas.append(f)
+
+        # Prefijos: todas las claves ordenadas (con la fila a la que pertenecen)
+        claves_concat = pa.concat_arrays(claves) if claves else pa.array([], type=pa.string())
+        orden = np.asarray(pc.sort_indices(claves_concat))
+        self._claves = claves_concat.take(pa.array(orden))
+        self._claves_filas = np.concatenate(claves_filas)[orden] if claves_filas else np.zeros(0, dtype=np.int64)
+
+        # Trigramas en CSR: pares (código, fila) únicos ordenados por código y fila
+        pares = np.sort((np.concatenate(codigos) << 32) | np.concatenate(codigos_filas)) if codigos \
+            else np.zeros(0, dtype=np.int64)
+        if len(pares):
+            pares = pares[np.concatenate(([True], pares[1:] != pares[:-1]))]
+        cods = pares >> 32
+        self._postings = pares & 0xFFFFFFFF
+        cambio = np.flatnonzero(np.concatenate(([True], cods[1:] != cods[:-1]))) if len(cods) \
+            else np.zeros(0, dtype=np.int64)
+        self._gramas = cods[cambio]
+        self._inicios = cambio
+        self._fines = np.append(cambio[1:], len(cods))
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    def por_numero(self, numero_cliente) -> Optional[dict]:
+        """Registro del cliente con ese ``numero_cliente`` exacto, o None."""
+        fila = self._por_numero.get(str(numero_cliente or '').strip())
+        if fila is None:
+            return None
+        return self.table.slice(fila, 1).to_pylist()[0]
+
+    def _posting(self, codigo: int) -> Optional[np.ndarray]:
+        i = np.searchsorted(self._gramas, codigo)
+        if i >= len(self._gramas) or self._gramas[i] != codigo:
+            return None
+        return self._postings[self._inicios[i]:self._fines[i]]
+
+    def _por_prefijo(self, q: str, limite: int, vistos: set) -> List[int]:
+        lo, hi = 0, len(self._claves)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._claves[mid].as_py() < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        salida = []
+        while lo < len(self._claves) and len(salida) < limite:
+            if not self._claves[lo].as_py().startswith(q):
+                break
+            fila = int(self._claves_filas[lo])
+            if fila not in vistos:
+                vistos.add(fila)
+                salida.append(fila)
+            lo += 1
+        return salida
+
+    def _por_substring(self, q: str, limite: int, vistos: set) -> List[int]:
+        postings = []
+        for codigo in _codigos_query(q):
+            p = self._posting(int(codigo))
+            if p is None:
+                return []
+            postings.append(p)
+        postings.sort(key=len)
+        candidatos = postings[0]
+        for p in postings[1:]:
+            # intersección O(|candidatos| log |p|): ambas listas están ordenadas
+            pos = np.minimum(np.searchsorted(p, candidatos), len(p) - 1)
+            candidatos = candidatos[p[pos] == candidatos]
+            if not len(candidatos):
+                return []
+
+        salida = []
+        for fila in candidatos:
+            fila = int(fila)
+            if fila in vistos:
+                continue
+            # los trigramas no garantizan el orden: se verifica el substring real
+            if any(q in (self._textos[c][fila].as_py() or '') for c in self.campos):
+                vistos.add(fila)
+                salida.append(fila)
+                if len(salida) >= limite:
+                    break
+        return salida
+
+    def buscar_filas(self, query: str, limite: int = LIMITE_RESULTADOS) -> List[int]:
+        """Filas que coinciden: primero por prefijo, luego por substring (``limite`` en total)."""
+        q = normalizar_texto(query)
+        if not q or limite <= 0:
+            return []
+        vistos: set = set()
+        filas = self._por_prefijo(q, limite, vistos)
+        if len(filas) < limite and len(q.encode('utf-8')) >= 3:
+            filas += self._por_substring(q, limite - len(filas), vistos)
+        return filas
+
+    def buscar(self, query: str, limite: int = LIMITE_RESULTADOS) -> List[dict]:
+        """Registros (dicts) de los clientes encontrados."""
+        filas = self.buscar_filas(query, limite)
+        if not filas:
+            return []
+        return self.table.take(pa.array(filas, type=pa.int64())).to_pylist()
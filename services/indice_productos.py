@@ -0,0 +1,132 @@
+# services/indice_productos.py
+"""
+Índice en memoria del catálogo de productos (Parquet).
+
+Se construye una sola vez por versión del Parquet (mtime) desde
+``core.scheduler.load_catalogo_index`` y lo comparten todas las vistas:
+
+- columnas ya renombradas a los nombres canónicos que usa el front;
+- tabla ordenada por ``store_number`` con una partición (offset, largo) por tienda.
+  El snapshot Arrow ya se escribe en ese orden (``ordenar_catalogo``): la tabla
+  mapeada se usa tal cual, sin copia privada por worker;
+- mapa hash ``(numero_producto, store_number) -> (offset, largo)`` con el rango de
+  filas de la clave (dentro de cada tienda la tabla está ordenada por producto):
+  si el Parquet trae filas repetidas para la clave, se devuelven todas.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from services.orden_tablas import aplicar_orden, rangos_ordenados
+
+# Nombres originales del Parquet -> nombres canónicos usados por las vistas/front
+MAPEO_COLUMNAS_PRODUCTOS = {
+    'Número de Producto': 'numero_producto',
+    'Nombre de Categoría de Producto': 'categoria_producto',
+    'Nombre del Producto': 'nombre_producto',
+    'Grupo de Cobertura': 'grupo_cobertura',
+    'Unidad de Medida': 'unidad_medida',
+    'PrecioFinalConIVA': 'precio_final_con_iva',
+    'PrecioFinalConDescE': 'precio_final_con_descuento',
+    'StoreNumber': 'store_number',
+    'TotalDisponibleVenta': 'total_disponible_venta',
+    'Signo': 'signo',
+    'Multiplo': 'multiplo',
+}
+
+# Columnas monetarias que el front recibe formateadas en estilo es-AR
+COLUMNAS_MONEDA = ('precio_final_con_iva', 'precio_final_con_descuento', 'total_disponible_venta')
+
+
+def renombrar_columnas_productos(table: pa.Table) -> pa.Table:
+    """Renombra las columnas del Parquet de productos a los nombres canónicos."""
+    return table.rename_columns([MAPEO_COLUMNAS_PRODUCTOS.get(c, c) for c in table.column_names])
+
+
+def _columna_texto(table: pa.Table, nombre: str) -> pa.ChunkedArray:
+    col = table.column(nombre)
+    if not pa.types.is_string(col.type) and not pa.types.is_large_string(col.type):
+        col = pc.cast(col, pa.string())
+    return col
+
+
+def _orden_catalogo(table: pa.Table) -> pa.Array:
+    """Índices que ordenan ``table`` (columnas canónicas) por tienda y producto."""
+    orden = [('store_number', 'ascending')]
+    if 'numero_producto' in table.column_names:
+        orden.append(('numero_producto', 'ascending'))
+    return pc.sort_indices(table, sort_keys=orden)
+
+
+def ordenar_catalogo(table: pa.Table) -> pa.Table:
+    """Parquet de productos en el orden de ``CatalogoIndex`` (para escribir el snapshot ya ordenado)."""
+    canonica = renombrar_columnas_productos(table)
+    if 'store_number' not in canonica.column_names:
+        return table
+    return table.take(_orden_catalogo(canonica))
+
+
+class CatalogoIndex:
+    """Catálogo de productos particionado por tienda e indexado por (producto, tienda)."""
+
+    def __init__(self, table: pa.Table, version: float = 0.0):
+        table = renombrar_columnas_productos(table)
+        self.version = version
+        self._particiones: Dict[str, Tuple[int, int]] = {}
+        self._por_clave: Dict[Tuple[str, str], Tuple[int, int]] = {}
+
+        if 'store_number' not in table.column_names:
+            self.table = table
+            return
+
+        self.table = aplicar_orden(table, _orden_catalogo(table))
+        stores = _columna_texto(self.table, 'store_number')
+        self._particiones = rangos_ordenados(stores)
+
+        if 'numero_producto' in self.table.column_names:
+            numeros = _columna_texto(self.table, 'numero_producto')
+            por_clave = self._por_clave
+            for tienda, (offset, largo) in self._particiones.items():
+                for numero, (inicio, n) in rangos_ordenados(numeros.slice(offset, largo)).items():
+                    por_clave[(numero, tienda)] = (offset + inicio, n)
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    def tiendas(self) -> List[str]:
+        return sorted(self._particiones)
+
+    def tabla_tienda(self, store: str) -> pa.Table:
+        """Slice (sin copia) con los productos de la tienda.
+
+        Si la tienda no existe como partición se conserva el comportamiento
+        histórico de ``api_productos`` (coincidencia por substring).
+        """
+        part = self._particiones.get(store)
+        if part is not None:
+            return self.table.slice(part[0], part[1])
+        if 'store_number' not in self.table.column_names:
+            return self.table.slice(0, 0)
+        return self.table.filter(pc.match_substring(pc.field('store_number'), store))
+
+    def fila(self, numero_producto: str, store: str) -> Optional[int]:
+        """Posición en ``self.table`` (la primera, si hay repetidas) del producto para la tienda, o None."""
+        rango = self._por_clave.get((str(numero_producto), store))
+        return rango[0] if rango is not None else None
+
+    def filas_producto(self, numero_producto: str, store: Optional[str] = None) -> List[int]:
+        """Filas del producto en una tienda o, sin tienda, en todas las tiendas."""
+        codigo = str(numero_producto)
+        tiendas = [store] if store else self._particiones.keys()
+        filas = []
+        for tienda in tiendas:
+            rango = self._por_clave.get((codigo, tienda))
+            if rango is not None:
+                filas.extend(range(rango[0], rango[0] + rango[1]))
+        return filas
+
+    def buscar(self, numero_producto: str, store: Optional[str] = None) -> pa.Table:
+        """Tabla Arrow con las filas exactas del producto (opcionalmente por tienda)."""
+        return self.table.take(pa.array(self.filas_producto(numero_producto, store), type=pa.int64()))
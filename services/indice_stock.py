@@ -0,0 +1,109 @@
+# services/indice_stock.py
+"""
+Índice en memoria del stock (Parquet) para ``/api/stock`` y ``services_gateway``.
+
+Se construye una sola vez por versión del Parquet (mtime) desde
+``core.scheduler.load_stock_index``:
+
+- tabla ordenada por ``codigo`` y ``almacen_365`` (normalizados: sin espacios y
+  en mayúsculas). El snapshot Arrow ya se escribe en ese orden (``ordenar_stock``):
+  la tabla mapeada se usa tal cual, sin copia privada por worker;
+- mapa hash ``codigo -> (offset, largo)`` con el rango de filas del código;
+- dentro de cada rango, los almacenes ordenados: se filtra solo ese puñado de filas.
+
+La búsqueda es por código exacto (antes ``match_substring`` devolvía también
+códigos que contenían al buscado).
+"""
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from services.orden_tablas import aplicar_orden, rangos_ordenados
+
+# Tope de códigos por llamada a /api/stock/batch
+STOCK_BATCH_MAX_CODIGOS = int(os.getenv("STOCK_BATCH_MAX_CODIGOS", "1000"))
+
+
+def normalizar_codigo(valor) -> str:
+    return str(valor).strip().upper() if valor is not None else ""
+
+
+def _normalizar_columna(col) -> pa.ChunkedArray:
+    if pa.types.is_dictionary(col.type):
+        col = col.cast(col.type.value_type)
+    if not pa.types.is_string(col.type) and not pa.types.is_large_string(col.type):
+        col = pc.cast(col, pa.string())
+    return pc.utf8_upper(pc.utf8_trim_whitespace(col))
+
+
+def _claves_stock(table: pa.Table):
+    codigos = _normalizar_columna(table.column('codigo'))
+    almacenes = _normalizar_columna(table.column('almacen_365')) if 'almacen_365' in table.column_names \
+        else pa.chunked_array([pa.nulls(table.num_rows, pa.string())])
+    orden = pc.sort_indices(pa.table({'codigo': codigos, 'almacen': almacenes}),
+                            sort_keys=[('codigo', 'ascending'), ('almacen', 'ascending')])
+    return codigos, almacenes, orden
+
+
+def ordenar_stock(table: pa.Table) -> pa.Table:
+    """Tabla en el orden de ``IndiceStock`` (para escribir el snapshot ya ordenado)."""
+    if 'codigo' not in table.column_names:
+        return table
+    return table.take(_claves_stock(table)[2])
+
+
+class IndiceStock:
+    """Stock ordenado por (código, almacén) con rango de filas por código."""
+
+    def __init__(self, table: pa.Table, version: float = 0.0):
+        self.version = version
+        self._rangos: Dict[str, Tuple[int, int]] = {}
+
+        if 'codigo' not in table.column_names:
+            self.table = table
+            self._almacenes = pa.array([], type=pa.string())
+            return
+
+        codigos, almacenes, orden = _claves_stock(table)
+        self.table = aplicar_orden(table, orden)
+        self._almacenes = almacenes.take(orden).combine_chunks()
+        self._rangos = rangos_ordenados(codigos.take(orden))
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    def filas(self, codigo, almacenes: Optional[Iterable[str]] = None) -> List[int]:
+        """Filas del código exacto, opcionalmente solo de ``almacenes``."""
+        rango = self._rangos.get(normalizar_codigo(codigo))
+        if rango is None:
+            return []
+        offset, largo = rango
+        if almacenes is None:
+            return list(range(offset, offset + largo))
+        permitidos = {normalizar_codigo(a) for a in almacenes}
+        return [offset + i for i, alm in enumerate(self._almacenes.slice(offset, largo).to_pylist())
+                if alm in permitidos]
+
+    def buscar(self, codigo, almacenes: Optional[Iterable[str]] = None) -> pa.Table:
+        """Tabla Arrow con las filas del código (y almacenes) pedidos."""
+        return self.table.take(pa.array(self.filas(codigo, almacenes), type=pa.int64()))
+
+    def buscar_lote(self, codigos: Iterable, almacenes: Optional[Iterable[str]] = None,
+                    solo_disponible: bool = False) -> pa.Table:
+        """Filas de varios códigos en una pasada: rangos concatenados + un ``is_in`` de almacenes."""
+        rangos = [self._rangos.get(normalizar_codigo(c)) for c in dict.fromkeys(codigos)]
+        rangos = [r for r in rangos if r is not None]
+        if not rangos:
+            return self.table.slice(0, 0)
+        filas = np.concatenate([np.arange(o, o + n, dtype=np.int64) for o, n in rangos])
+        if almacenes is not None:
+            permitidos = pa.array(sorted({normalizar_codigo(a) for a in almacenes}), type=pa.string())
+            filas = filas[np.asarray(pc.is_in(self._almacenes.take(filas), value_set=permitidos))]
+        tabla = self.table.take(filas)
+        if solo_disponible and 'disponible_venta' in tabla.column_names:
+            tabla = tabla.filter(pc.fill_null(pc.greater(tabla.column('disponible_venta'), 0), False))
+        return tabla
@@ -0,0 +1,191 @@
+# services/odata_batch.py
+"""
+Lectura estructurada de respuestas OData ``$batch`` (``multipart/mixed``).
+
+Antes se partía toda la respuesta con ``splitlines()`` y se buscaban líneas que
+empezaran con ``HTTP/1.1``: no se sabía a qué línea del presupuesto correspondía
+cada error y se logueaba el cuerpo completo en INFO.
+
+``ParserBatch`` se alimenta por trozos (``response.aiter_bytes()``) y arma una
+``ParteBatch`` por cada respuesta HTTP embebida:
+
+- ``content_id``: el ``Content-ID`` de la parte (cabeceras MIME o HTTP internas);
+- ``grupo``: índice de la parte de primer nivel (un changeset o un pedido suelto),
+  para ubicar errores de changeset que D365 devuelve sin ``Content-ID``;
+- ``status`` / ``motivo`` y, solo si es un error, ``cuerpo`` (las respuestas
+  exitosas no se guardan: la memoria no crece con el tamaño del carrito).
+
+Los cuerpos se loguean en DEBUG; en los mensajes de error van truncados
+(``truncar``, ``ODATA_LIMITE_LOG``).
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+# Caracteres de un cuerpo que se incluyen en logs / mensajes de error
+ODATA_LIMITE_LOG = int(os.getenv("ODATA_LIMITE_LOG", "1000"))
+
+_PATRON_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_PATRON_STATUS = re.compile(r"^HTTP/\d(?:\.\d)?\s+(\d{3})\s*(.*)$")
+
+
+def truncar(texto: Optional[str], limite: int = ODATA_LIMITE_LOG) -> str:
+    if texto is None:
+        return ""
+    if len(texto) <= limite:
+        return texto
+    return f"{texto[:limite]}... ({len(texto)} caracteres)"
+
+
+def boundary_de(content_type: str) -> Optional[str]:
+    m = _PATRON_BOUNDARY.search(content_type or "")
+    return m.group(1) if m else None
+
+
+@dataclass
+class ParteBatch:
+    grupo: int
+    content_id: Optional[str] = None
+    status: int = 0
+    motivo: str = ""
+    cuerpo: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 400
+
+
+class ParserBatch:
+    """Parser incremental de una respuesta ``multipart/mixed`` de ``$batch``."""
+
+    def __init__(self, content_type: str, guardar_cuerpos_ok: bool = False):
+        boundary = boundary_de(content_type)
+        if not boundary:
+            raise ValueError(f"Respuesta $batch sin boundary: {content_type!r}")
+        self.partes: List[ParteBatch] = []
+        self._guardar_ok = guardar_cuerpos_ok
+        self._boundaries: List[str] = [boundary]
+        self._buffer = b""
+        self._grupo = -1
+        # preambulo | mime | status | http | cuerpo
+        self._estado = "preambulo"
+        self._mime: Dict[str, str] = {}
+        self._parte: Optional[ParteBatch] = None
+        self._cuerpo: List[str] = []
+
+    def alimentar(self, datos: bytes):
+        self._buffer += datos
+        *lineas, self._buffer = self._buffer.split(b"\n")
+        for linea in lineas:
+            self._linea(linea.rstrip(b"\r").decode("utf-8", errors="replace"))
+
+    def terminar(self) -> List[ParteBatch]:
+        if self._buffer:
+            self._linea(self._buffer.rstrip(b"\r").decode("utf-8", errors="replace"))
+            self._buffer = b""
+        self._cerrar_parte()
+        return self.partes
+
+    def _delimitador(self, linea: str):
+        """``(boundary, es_cierre)`` si la línea es un delimitador conocido, si no None."""
+        if not linea.startswith("--"):
+            return None
+        resto = linea[2:].rstrip()
+        for boundary in reversed(self._boundaries):
+            if resto == boundary:
+                return boundary, False
+            if resto == boundary + "--":
+                return boundary, True
+        return None
+
+    def _cerrar_parte(self):
+        parte = self._parte
+        if parte is not None:
+            if self._cuerpo and (not parte.ok or self._guardar_ok):
+                parte.cuerpo = "\n".join(self._cuerpo).strip()
+            self.partes.append(parte)
+        self._parte = None
+        self._cuerpo = []
+
+    def _linea(self, linea: str):
+        delimitador = self._delimitador(linea)
+        if delimitador is not None:
+            boundary, es_cierre = delimitador
+            self._cerrar_parte()
+            nivel = self._boundaries.index(boundary)
+            del self._boundaries[nivel + 1:]
+            if es_cierre:
+                self._boundaries.pop()
+                self._estado = "preambulo"
+            else:
+                if nivel == 0:
+                    self._grupo += 1
+                self._estado = "mime"
+                self._mime = {}
+            return
+
+        if self._estado == "mime":
+            if linea.strip():
+                nombre, _, valor = linea.partition(":")
+                self._mime[nombre.strip().lower()] = valor.strip()
+                return
+            tipo = self._mime.get("content-type", "").lower()
+            if tipo.startswith("multipart/"):
+                # Changeset: sus partes vienen delimitadas por su propio boundary
+                self._boundaries.append(boundary_de(self._mime["content-type"]))
+                self._estado = "preambulo"
+            else:
+                self._parte = ParteBatch(grupo=self._grupo, content_id=self._mime.get("content-id"))
+                self._estado = "status"
+        elif self._estado == "status":
+            m = _PATRON_STATUS.match(linea)
+            if m:
+                self._parte.status, self._parte.motivo = int(m.group(1)), m.group(2)
+                self._estado = "http"
+        elif self._estado == "http":
+            if not linea.strip():
+                self._estado = "cuerpo"
+                return
+            nombre, _, valor = linea.partition(":")
+            if nombre.strip().lower() == "content-id" and not self._parte.content_id:
+                self._parte.content_id = valor.strip()
+        elif self._estado == "cuerpo":
+            if not self._parte.ok or self._guardar_ok:
+                self._cuerpo.append(linea)
+
+
+def parsear_batch(content_type: str, contenido: Iterable[bytes]) -> List[ParteBatch]:
+    """Atajo síncrono: parsea todos los trozos de ``contenido``."""
+    parser = ParserBatch(content_type)
+    for trozo in contenido:
+        parser.alimentar(trozo)
+    return parser.terminar()
+
+
+def resultados_por_operacion(partes: List[ParteBatch], grupos: List[List[str]]) -> Dict[str, ParteBatch]:
+    """``Content-ID -> ParteBatch`` para todas las operaciones enviadas.
+
+    ``grupos`` son los Content-ID de cada parte de primer nivel del request, en
+    orden (un changeset o un pedido suelto). Si un changeset falla, D365 responde
+    una sola parte de error (a veces sin ``Content-ID``): se aplica a todas las
+    operaciones de ese grupo que no tengan respuesta propia.
+    """
+    enviados = {cid for grupo in grupos for cid in grupo}
+    resultados: Dict[str, ParteBatch] = {}
+    sin_id: Dict[int, ParteBatch] = {}
+    for parte in partes:
+        if parte.content_id in enviados:
+            resultados[parte.content_id] = parte
+        elif not parte.ok:
+            sin_id.setdefault(parte.grupo, parte)
+    for indice, grupo in enumerate(grupos):
+        fallida = sin_id.get(indice)
+        if fallida is None:
+            # Changeset con una operación fallida y su Content-ID: el resto se revirtió
+            fallida = next((resultados[c] for c in grupo if c in resultados and not resultados[c].ok), None)
+        for cid in grupo:
+            if cid not in resultados or (fallida is not None and resultados[cid].ok):
+                resultados[cid] = fallida or ParteBatch(grupo=indice, content_id=cid, status=0,
+                                                        motivo="Sin respuesta en el $batch")
+    return resultados
@@ -0,0 +1,36 @@
+# services/orden_tablas.py
+"""
+Utilidades comunes de los índices en memoria sobre tablas ordenadas
+(catálogo, stock, atributos).
+
+Los snapshots Arrow se escriben ya en el orden de cada índice
+(``registro_tablas.registrar_orden_snapshot``): ``aplicar_orden`` reconoce ese
+caso y no copia la tabla mapeada; ``rangos_ordenados`` arma el mapa
+``valor -> (offset, largo)`` desde los bordes de cada tramo de valores iguales.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def aplicar_orden(table: pa.Table, orden: pa.Array) -> pa.Table:
+    """``table`` reordenada por ``orden``; si ya está en ese orden se devuelve la misma (sin copia)."""
+    if np.array_equal(orden.to_numpy(), np.arange(len(orden))):
+        return table
+    return table.take(orden).combine_chunks()
+
+
+def rangos_ordenados(col) -> Dict[str, Tuple[int, int]]:
+    """``valor -> (offset, largo)`` de cada tramo de valores iguales de una columna ya ordenada."""
+    if isinstance(col, pa.ChunkedArray):
+        col = col.combine_chunks()
+    n = len(col)
+    if n == 0:
+        return {}
+    distintos = pc.fill_null(pc.not_equal(col.slice(1), col.slice(0, n - 1)), True)
+    inicios = np.concatenate([[0], np.flatnonzero(distintos.to_numpy(zero_copy_only=False)) + 1])
+    largos = np.diff(np.append(inicios, n))
+    valores = col.take(pa.array(inicios, type=pa.int64())).to_pylist()
+    return {v: (int(i), int(k)) for v, i, k in zip(valores, inicios, largos) if v is not None}
@@ -0,0 +1,145 @@
+# services/payload_productos.py
+"""
+Caché de respuestas JSON ya serializadas (y comprimidas) para /api/productos.
+
+Cada combinación (tienda, página, items_per_page) se serializa una sola vez por
+versión del catálogo (mtime del Parquet). El job ``productos`` del scheduler la
+invalida explícitamente tras descargar un Parquet nuevo; además, una versión
+distinta del índice descarta automáticamente lo anterior.
+
+Solo se guardan las variantes comprimidas (gzip y, si está disponible, brotli): un
+catálogo completo de una tienda pesa decenas de MB sin comprimir. El cliente sin
+compresión (raro) recibe el gzip descomprimido al vuelo. La caché se acota por
+entradas y por bytes (``PRODUCTOS_PAYLOAD_MAX_BYTES``), LRU.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import http_date, parse_etags
+
+from services.formato_moneda import formatear_columnas_ars
+from services.indice_productos import COLUMNAS_MONEDA
+from services.logging_utils import get_module_logger
+
+try:  # compresión brotli opcional (paquete `brotli`)
+    import brotli
+except Exception:  # pragma: no cover - depende del entorno
+    brotli = None
+
+logger = get_module_logger(__name__)
+
+PAYLOAD_MAX_ENTRIES = int(os.getenv("PRODUCTOS_PAYLOAD_MAX_ENTRIES", "32"))
+# Bytes (comprimidos) que retiene la caché por worker
+PAYLOAD_MAX_BYTES = int(os.getenv("PRODUCTOS_PAYLOAD_MAX_BYTES", str(128 * 1024 * 1024)))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class PayloadProductos:
+    """Cuerpo JSON de una página de productos con sus variantes comprimidas."""
+
+    __slots__ = ("largo", "gzip", "br", "etag", "last_modified")
+
+    def __init__(self, raw: bytes, version: float, clave: Tuple[str, int, int]):
+        self.largo = len(raw)
+        self.gzip = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+        self.br = brotli.compress(raw, quality=BROTLI_QUALITY) if brotli is not None else None
+        firma = hashlib.sha1(repr(clave).encode("utf-8")).hexdigest()[:12]
+        self.etag = f'"productos-{int(version * 1000):x}-{firma}"'
+        self.last_modified = http_date(version)
+
+    @property
+    def tamanio(self) -> int:
+        """Bytes retenidos en la caché."""
+        return len(self.gzip) + (len(self.br) if self.br is not None else 0)
+
+    def cuerpo(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """Elige la variante según Accept-Encoding. Devuelve (bytes, content-encoding)."""
+        accept_encoding = (accept_encoding or "").lower()
+        if self.br is not None and "br" in accept_encoding:
+            return self.br, "br"
+        if "gzip" in accept_encoding:
+            return self.gzip, "gzip"
+        return gzip.decompress(self.gzip), None
+
+    def coincide(self, if_none_match: Optional[str]) -> bool:
+        """¿``If-None-Match`` (lista separada por comas) incluye este ETag? Comparación débil."""
+        etags = parse_etags(if_none_match or "")
+        if "*" in etags:
+            return True
+        return self.etag in (e[2:] if e.startswith("W/") else e for e in etags)
+
+
+_lock = threading.Lock()
+_version: Optional[float] = None
+_payloads: "OrderedDict[Tuple[str, int, int], PayloadProductos]" = OrderedDict()
+_bytes = 0
+_building: Dict[Tuple[str, int, int], threading.Lock] = {}
+
+
+def _serializar(index, store: str, page: int, items: int) -> bytes:
+    offset = max((page - 1) * items, 0)
+    table = index.tabla_tienda(store).slice(offset, max(items, 0))
+
+    # formateo monetario vectorizado (solo de la página pedida)
+    table = formatear_columnas_ars(table, COLUMNAS_MONEDA)
+
+    data = table.to_pandas().to_dict('records')
+    return json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+
+
+def _vaciar():
+    global _bytes
+    _payloads.clear()
+    _building.clear()
+    _bytes = 0
+
+
+def invalidar_payloads_productos():
+    """Descarta todos los payloads serializados (llamado por el job `productos`)."""
+    global _version
+    with _lock:
+        _vaciar()
+        _version = None
+    logger.info("Payloads de /api/productos invalidados.")
+
+
+def obtener_payload_productos(index, store: str, page: int, items: int) -> PayloadProductos:
+    """Devuelve el payload de (store, page, items) para la versión del índice, serializándolo si falta."""
+    global _version, _bytes
+    clave = (store, page, items)
+    with _lock:
+        if _version != index.version:
+            _vaciar()
+            _version = index.version
+        payload = _payloads.get(clave)
+        if payload is not None:
+            _payloads.move_to_end(clave)
+            return payload
+        build_lock = _building.setdefault(clave, threading.Lock())
+
+    # Un solo hilo serializa cada clave; el resto espera y reutiliza el resultado
+    with build_lock:
+        with _lock:
+            payload = _payloads.get(clave) if _version == index.version else None
+        if payload is not None:
+            return payload
+        payload = PayloadProductos(_serializar(index, store, page, items), index.version, clave)
+        with _lock:
+            # Un payload más grande que todo el presupuesto se sirve sin cachear
+            if _version == index.version and payload.tamanio <= PAYLOAD_MAX_BYTES:
+                _payloads[clave] = payload
+                _bytes += payload.tamanio
+                while len(_payloads) > PAYLOAD_MAX_ENTRIES or _bytes > PAYLOAD_MAX_BYTES:
+                    _, descartado = _payloads.popitem(last=False)
+                    _bytes -= descartado.tamanio
+            _building.pop(clave, None)
+        logger.info(f"Payload /api/productos serializado para {clave}: {payload.largo} bytes "
+                    f"(gzip {len(payload.gzip)})")
+        return payload
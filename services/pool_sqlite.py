@@ -0,0 +1,182 @@
+# services/pool_sqlite.py
+"""
+Pool de conexiones SQLite por hilo para ``services.database.conectar_db``.
+
+Antes cada ``conectar_db`` abría un ``sqlite3.connect`` nuevo, re-ejecutaba los
+PRAGMA y lo logueaba en INFO. Ahora cada hilo conserva una conexión por base:
+
+- PRAGMA una sola vez por conexión física (WAL, ``synchronous``, ``mmap_size``,
+  ``cache_size``, ``temp_store``);
+- caché de sentencias preparadas de ``sqlite3`` (``cached_statements``), que solo
+  sirve si la conexión vive más que una consulta;
+- chequeo de salud al reutilizar una conexión ociosa (``SELECT 1`` y mismo
+  archivo en disco); si falla se reabre;
+- al devolverla se revierte cualquier transacción que haya quedado abierta;
+- métricas (``metricas_pool``) para el log de monitoreo del scheduler.
+
+Si un hilo pide la misma base estando ya dentro de un ``conectar_db`` (anidado),
+recibe una conexión aparte que se cierra al salir, como antes.
+"""
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Dict
+
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+SQLITE_TIMEOUT = float(os.getenv("SQLITE_TIMEOUT", "10"))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+# Una conexión ociosa más de este tiempo se verifica antes de reutilizarla
+SQLITE_HEALTHCHECK_SECS = float(os.getenv("SQLITE_HEALTHCHECK_SECS", "30"))
+
+
+class _ConexionPool:
+    __slots__ = ("conexion", "inodo", "ultimo_uso", "en_uso", "__weakref__")
+
+    def __init__(self, conexion: sqlite3.Connection, inodo):
+        self.conexion = conexion
+        self.inodo = inodo
+        self.ultimo_uso = time.monotonic()
+        self.en_uso = False
+
+
+def _inodo(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_dev, st.st_ino
+    except OSError:
+        return None
+
+
+class PoolSQLite:
+    """Conexiones SQLite reutilizables, una por (hilo, base)."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._abiertas: "weakref.WeakSet[_ConexionPool]" = weakref.WeakSet()
+        self._metricas = {"opened": 0, "closed": 0, "checkouts": 0, "reused": 0,
+                          "healthcheck_failures": 0, "nested": 0, "rollbacks": 0}
+
+    def _contar(self, clave: str, n: int = 1):
+        with self._lock:
+            self._metricas[clave] += n
+
+    def _abrir(self, path: str) -> sqlite3.Connection:
+        conexion = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, cached_statements=SQLITE_STATEMENT_CACHE)
+        conexion.execute("PRAGMA journal_mode=WAL;")
+        conexion.execute("PRAGMA synchronous=NORMAL;")
+        conexion.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 2**20};")
+        conexion.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB};")
+        conexion.execute("PRAGMA temp_store=MEMORY;")
+        self._contar("opened")
+        return conexion
+
+    def _cerrar(self, entrada: _ConexionPool):
+        try:
+            entrada.conexion.close()
+        except sqlite3.Error:
+            pass
+        self._contar("closed")
+
+    def _sana(self, entrada: _ConexionPool, path: str) -> bool:
+        if time.monotonic() - entrada.ultimo_uso < SQLITE_HEALTHCHECK_SECS:
+            return True
+        try:
+            # Archivo reemplazado/borrado (migración, restore): la conexión apunta al viejo
+            if entrada.inodo != _inodo(path):
+                return False
+            entrada.conexion.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _conexiones_hilo(self) -> Dict[str, _ConexionPool]:
+        conexiones = getattr(self._local, "conexiones", None)
+        if conexiones is None:
+            conexiones = self._local.conexiones = {}
+        return conexiones
+
+    @contextmanager
+    def conexion(self, path: str):
+        """Conexión del hilo para ``path``; al salir queda sin transacción abierta."""
+        conexiones = self._conexiones_hilo()
+        entrada = conexiones.get(path)
+        self._contar("checkouts")
+
+        if entrada is not None and entrada.en_uso:
+            # Uso anidado en el mismo hilo: conexión aparte para no mezclar transacciones
+            self._contar("nested")
+            conexion = self._abrir(path)
+            try:
+                yield conexion
+            finally:
+                conexion.close()
+                self._contar("closed")
+            return
+
+        if entrada is not None and not self._sana(entrada, path):
+            logger.warning(f"Conexión SQLite no saludable, se reabre: {path}")
+            self._contar("healthcheck_failures")
+            self._cerrar(entrada)
+            entrada = None
+        if entrada is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            entrada = _ConexionPool(self._abrir(path), None)
+            entrada.inodo = _inodo(path)
+            conexiones[path] = entrada
+            with self._lock:
+                self._abiertas.add(entrada)
+            logger.debug(f"Nueva conexión SQLite en pool para {path} ({threading.current_thread().name})")
+        else:
+            self._contar("reused")
+
+        entrada.en_uso = True
+        try:
+            yield entrada.conexion
+        finally:
+            entrada.en_uso = False
+            entrada.ultimo_uso = time.monotonic()
+            try:
+                if entrada.conexion.in_transaction:
+                    # Equivale a lo que hacía close() con cambios sin commit
+                    entrada.conexion.rollback()
+                    self._contar("rollbacks")
+            except sqlite3.Error:
+                conexiones.pop(path, None)
+                self._cerrar(entrada)
+
+    def cerrar_hilo(self):
+        """Cierra las conexiones del hilo actual (p. ej. al terminar un worker de larga vida)."""
+        conexiones = self._conexiones_hilo()
+        for entrada in list(conexiones.values()):
+            self._cerrar(entrada)
+        conexiones.clear()
+
+    def reiniciar_tras_fork(self):
+        # Las conexiones SQLite no deben cruzar un fork (gunicorn --preload)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._abiertas = weakref.WeakSet()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            datos = dict(self._metricas)
+            datos["open"] = len(self._abiertas)
+        return datos
+
+
+pool_sqlite = PoolSQLite()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pool_sqlite.reiniciar_tras_fork)
+
+
+def metricas_pool() -> dict:
+    return pool_sqlite.metricas()
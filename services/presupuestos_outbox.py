@@ -0,0 +1,393 @@
+# services/presupuestos_outbox.py
+"""
+Creación de presupuestos D365 como trabajo en segundo plano (outbox en SQLite).
+
+``api_create_quotation`` bloqueaba el hilo del request hasta 60 s (cabecera) más
+120 s (líneas) y, si el ``$batch`` de líneas fallaba, dejaba una cabecera huérfana.
+Ahora el request solo encola y devuelve un ``job_id``; el cliente consulta el
+estado en ``/api/quotation_jobs/<job_id>``.
+
+- Tabla ``presupuestos_outbox`` (misc): cada trabajo con su cabecera, líneas,
+  estado, intentos y último error. Sobrevive a reinicios: el job
+  ``presupuestos_outbox`` del scheduler retoma los que quedaron a medias.
+- Clave de idempotencia: la referencia ``CustomerRequisitionNumber``
+  (``BUSCADOR-XXXXXXXXX``) se genera al encolar. Si la creación de la cabecera
+  falla sin respuesta definitiva (red, timeout, 5xx) el trabajo sigue en
+  ``creando_cabecera`` y, antes de reintentar, se busca en D365 por esa
+  referencia. El header ``Idempotency-Key`` del cliente evita encolar dos veces
+  el mismo envío.
+- Solo el ``$batch`` de líneas se reintenta, con backoff exponencial y jitter, y
+  solo las líneas que fallaron de forma transitoria (``lineas_creadas`` guarda las
+  ya creadas). Si no se sabe si D365 aplicó una línea (red, 5xx del lote), antes
+  de reintentar se cruzan con las líneas que ya tiene el presupuesto.
+- Cada trabajo se toma con un lease (``tomado_por`` / ``tomado_hasta``) cuyo dueño es
+  una ejecución (un token por corrida, no por proceso): ni otro proceso ni otro hilo
+  del mismo lo ejecutan a la vez. El trabajo se inserta ya tomado por la corrida que
+  lanza ``encolar_presupuesto``; si una renovación falla, la corrida se detiene.
+
+Estados: ``pendiente`` -> ``creando_cabecera`` -> ``cabecera_creada`` ->
+``completado`` | ``error``.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from services.cola_escritura import escribir
+from services.database import DB_PATHS, conectar_db
+from services.d365_interface import (
+    STATUS_REINTENTABLES,
+    generar_referencia_presupuesto,
+    run_buscar_presupuesto_por_referencia,
+    run_crear_cabecera_presupuesto,
+    run_crear_lineas_presupuesto,
+    run_listar_articulos_presupuesto,
+)
+from services.email_service import enviar_correo_fallo
+from services.logging_utils import get_module_logger
+from services.odata_batch import truncar
+from services.token_d365 import obtener_token_d365
+
+logger = get_module_logger(__name__)
+
+PRESUPUESTOS_WORKERS = int(os.getenv("PRESUPUESTOS_WORKERS", "4"))
+# Reintentos del $batch de líneas (además del primer intento)
+PRESUPUESTO_BATCH_REINTENTOS = int(os.getenv("PRESUPUESTO_BATCH_REINTENTOS", "4"))
+PRESUPUESTO_BACKOFF_BASE = float(os.getenv("PRESUPUESTO_BACKOFF_BASE", "2"))
+PRESUPUESTO_BACKOFF_MAX = float(os.getenv("PRESUPUESTO_BACKOFF_MAX", "60"))
+# Tiempo que un proceso retiene un trabajo sin renovar antes de que otro pueda retomarlo
+PRESUPUESTO_LEASE_SECS = float(os.getenv("PRESUPUESTO_LEASE_SECS", "300"))
+
+ESTADOS_FINALES = ("completado", "error")
+
+_COLUMNAS = ("id", "usuario", "clave_idempotencia", "referencia", "estado", "datos_cabecera", "lineas",
+             "quotation_number", "lineas_creadas", "intentos", "error", "creado", "actualizado")
+
+_OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _ejecutor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PRESUPUESTOS_WORKERS, thread_name_prefix="presupuestos")
+    return _executor
+
+
+def _reiniciar_tras_fork():
+    # Los hilos del executor no sobreviven al fork; el hijo toma otra identidad de lease
+    global _executor, _executor_lock, _OWNER
+    _executor = None
+    _executor_lock = threading.Lock()
+    _OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def _fila_a_trabajo(fila) -> dict:
+    trabajo = dict(zip(_COLUMNAS, fila))
+    trabajo["datos_cabecera"] = json.loads(trabajo["datos_cabecera"])
+    trabajo["lineas"] = json.loads(trabajo["lineas"])
+    trabajo["lineas_creadas"] = json.loads(trabajo["lineas_creadas"] or "[]")
+    return trabajo
+
+
+def obtener_trabajo(job_id: str) -> Optional[dict]:
+    with conectar_db("misc") as conexion:
+        fila = conexion.execute(
+            f"SELECT {', '.join(_COLUMNAS)} FROM presupuestos_outbox WHERE id = ?", (job_id,)
+        ).fetchone()
+    return _fila_a_trabajo(fila) if fila else None
+
+
+def _por_clave(usuario: str, clave: str) -> Optional[dict]:
+    with conectar_db("misc") as conexion:
+        fila = conexion.execute(
+            f"SELECT {', '.join(_COLUMNAS)} FROM presupuestos_outbox WHERE usuario = ? AND clave_idempotencia = ?",
+            (usuario, clave),
+        ).fetchone()
+    return _fila_a_trabajo(fila) if fila else None
+
+
+def encolar_presupuesto(datos_cabecera: dict, lineas: list, usuario: str, clave: Optional[str] = None) -> dict:
+    """Registra el trabajo en el outbox y lo lanza en segundo plano.
+
+    Con la misma ``clave`` (por usuario) devuelve el trabajo ya existente en vez de
+    crear otro presupuesto.
+    """
+    if not usuario:
+        raise ValueError("encolar_presupuesto requiere un usuario")
+    if clave:
+        existente = _por_clave(usuario, clave)
+        if existente:
+            logger.info(f"Presupuesto ya encolado para la clave {clave}: {existente['id']} ({existente['estado']})")
+            return existente
+
+    ahora = time.time()
+    job_id = uuid.uuid4().hex
+    referencia = generar_referencia_presupuesto()
+
+    lease = _nuevo_lease()
+
+    def _insertar(cursor):
+        # Insertado ya tomado: reanudar_presupuestos_pendientes no lo relanza mientras espera en el executor
+        cursor.execute(
+            "INSERT OR IGNORE INTO presupuestos_outbox (id, usuario, clave_idempotencia, referencia, estado, "
+            "datos_cabecera, lineas, intentos, tomado_por, tomado_hasta, creado, actualizado) "
+            "VALUES (?, ?, ?, ?, 'pendiente', ?, ?, 0, ?, ?, ?, ?)",
+            (job_id, usuario, clave, referencia, json.dumps(datos_cabecera), json.dumps(lineas),
+             lease, ahora + PRESUPUESTO_LEASE_SECS, ahora, ahora),
+        )
+        return cursor.rowcount
+
+    if not escribir(DB_PATHS["misc"], _insertar) and clave:
+        # Otro request con la misma clave ganó la carrera
+        return _por_clave(usuario, clave)
+
+    logger.info(f"Presupuesto encolado: job={job_id} referencia={referencia} ({len(lineas)} líneas)")
+    _ejecutor().submit(procesar_trabajo, job_id, lease)
+    return obtener_trabajo(job_id)
+
+
+def _nuevo_lease() -> str:
+    return f"{_OWNER}:{uuid.uuid4().hex[:8]}"
+
+
+def _reclamar(job_id: str, lease: Optional[str] = None) -> Optional[str]:
+    """Renueva el lease ``lease`` o, sin él, toma el trabajo si está libre o vencido.
+
+    Devuelve el lease vigente, o None si el trabajo terminó o lo tiene otra corrida.
+    """
+    nuevo = lease is None
+    lease = lease or _nuevo_lease()
+
+    def _tomar(cursor):
+        ahora = time.time()
+        condicion = "(tomado_por IS NULL OR tomado_hasta IS NULL OR tomado_hasta < ?)" if nuevo else "tomado_por = ?"
+        cursor.execute(
+            "UPDATE presupuestos_outbox SET tomado_por = ?, tomado_hasta = ?, actualizado = ? "
+            f"WHERE id = ? AND estado NOT IN ('completado', 'error') AND {condicion}",
+            (lease, ahora + PRESUPUESTO_LEASE_SECS, ahora, job_id, ahora if nuevo else lease),
+        )
+        return cursor.rowcount == 1
+    return lease if escribir(DB_PATHS["misc"], _tomar) else None
+
+
+def _actualizar(job_id: str, lease: str, **campos) -> bool:
+    """Actualiza el trabajo solo si ``lease`` sigue siendo su dueño."""
+    campos["actualizado"] = time.time()
+    if campos.get("estado") in ESTADOS_FINALES:
+        campos["tomado_por"] = None
+        campos["tomado_hasta"] = None
+    asignaciones = ", ".join(f"{c} = ?" for c in campos)
+
+    def _guardar(cursor):
+        cursor.execute(f"UPDATE presupuestos_outbox SET {asignaciones} WHERE id = ? AND tomado_por = ?",
+                       (*campos.values(), job_id, lease))
+        return cursor.rowcount == 1
+    return escribir(DB_PATHS["misc"], _guardar)
+
+
+def _espera_backoff(intento: int) -> float:
+    base = min(PRESUPUESTO_BACKOFF_BASE * 2 ** (intento - 1), PRESUPUESTO_BACKOFF_MAX)
+    return base + random.uniform(0, base / 2)
+
+
+def _crear_cabecera(trabajo: dict) -> Optional[str]:
+    """SalesQuotationNumber del trabajo: el ya creado (buscado por referencia) o uno nuevo.
+
+    Ante fallas transitorias (sin token, red, 5xx) el trabajo queda en
+    ``creando_cabecera``: se reintenta con backoff buscando primero por referencia
+    y, agotados los reintentos, lo retoma ``reanudar_presupuestos_pendientes`` al
+    vencer el lease. Solo un rechazo definitivo de D365 lo pasa a ``error``.
+    """
+    job_id, referencia, lease = trabajo["id"], trabajo["referencia"], trabajo["lease"]
+    buscar = trabajo["estado"] == "creando_cabecera"
+    error = None
+    for intento in range(PRESUPUESTO_BATCH_REINTENTOS + 1):
+        if intento:
+            espera = _espera_backoff(intento)
+            logger.info(f"Job {job_id}: reintento de la cabecera {referencia} en {espera:.1f}s")
+            time.sleep(espera)
+            if not _reclamar(job_id, lease):
+                logger.warning(f"Job {job_id}: lease perdido; la cabecera {referencia} la retoma otra corrida")
+                return None
+
+        token = obtener_token_d365()
+        if not token:
+            error = "No se pudo obtener token D365"
+            continue
+
+        if buscar:
+            # Un intento anterior pudo crearla antes de caerse: la referencia es la clave
+            numero, error = run_buscar_presupuesto_por_referencia(referencia, token)
+            if error:
+                continue
+            if numero:
+                logger.info(f"Job {job_id}: cabecera {numero} ya existía para {referencia}")
+                _actualizar(job_id, lease, estado="cabecera_creada", quotation_number=numero, error=None)
+                return numero
+
+        if not _actualizar(job_id, lease, estado="creando_cabecera"):
+            logger.warning(f"Job {job_id}: lease perdido antes de crear la cabecera {referencia}")
+            return None
+        buscar = True
+        numero, error, reintentable = run_crear_cabecera_presupuesto(trabajo["datos_cabecera"], referencia, token)
+        if numero:
+            _actualizar(job_id, lease, estado="cabecera_creada", quotation_number=numero, error=None)
+            return numero
+        if not reintentable:
+            _actualizar(job_id, lease, estado="error", error=error)
+            return None
+
+    # Sigue en creando_cabecera: se retoma por referencia cuando venza el lease
+    _actualizar(job_id, lease, estado="creando_cabecera", error=error)
+    logger.warning(f"Job {job_id}: cabecera {referencia} sin confirmar tras reintentos; se retoma más tarde: {error}")
+    enviar_correo_fallo("crear_presupuesto_batch",
+                        f"Cabecera {referencia} sin confirmar (job {job_id}), se reintentará: {error}")
+    return None
+
+
+def _conciliar(numero: str, lineas: list, creadas: set, dudosas: set, token: str) -> set:
+    """De las líneas ``dudosas`` (sin saber si D365 las aplicó), las que ya están en el presupuesto."""
+    articulos = run_listar_articulos_presupuesto(numero, token)
+    if articulos is None:
+        return set()
+    sobrantes = Counter(articulos) - Counter(lineas[i].get("articulo") for i in creadas)
+    aplicadas = set()
+    for i in sorted(dudosas):
+        articulo = lineas[i].get("articulo")
+        if sobrantes[articulo] > 0:
+            sobrantes[articulo] -= 1
+            aplicadas.add(i)
+    return aplicadas
+
+
+def _crear_lineas(trabajo: dict, numero: str) -> bool:
+    job_id, lineas, lease = trabajo["id"], trabajo["lineas"], trabajo["lease"]
+    intentos = trabajo["intentos"] or 0
+    creadas = set(trabajo["lineas_creadas"])
+    pendientes = [i for i in range(len(lineas)) if i not in creadas]
+    # Un intento previo interrumpido: no se sabe qué líneas quedaron aplicadas
+    dudosas = set(pendientes) if intentos else set()
+    definitivas = {}
+    error = None
+    for intento in range(PRESUPUESTO_BATCH_REINTENTOS + 1):
+        if not pendientes:
+            break
+        if intento or intentos:
+            espera = _espera_backoff(intento or 1)
+            logger.info(f"Job {job_id}: reintento de {len(pendientes)} línea/s en {espera:.1f}s")
+            time.sleep(espera)
+            if not _reclamar(job_id, lease):
+                logger.warning(f"Job {job_id}: lease perdido; las líneas de {numero} las retoma otra corrida")
+                return False
+
+        token = obtener_token_d365()
+        if not token:
+            error = "No se pudo obtener token D365"
+            continue
+        if dudosas:
+            aplicadas = _conciliar(numero, lineas, creadas, dudosas, token)
+            if aplicadas:
+                logger.info(f"Job {job_id}: {len(aplicadas)} línea/s ya estaban creadas en {numero}")
+                creadas |= aplicadas
+                pendientes = [i for i in pendientes if i not in aplicadas]
+                _actualizar(job_id, lease, lineas_creadas=json.dumps(sorted(creadas)))
+            dudosas = set()
+            if not pendientes:
+                break
+
+        fallidas, error = run_crear_lineas_presupuesto(numero, [lineas[i] for i in pendientes], token)
+        intentos += 1
+        creadas |= {i for k, i in enumerate(pendientes) if k not in fallidas}
+        reintentar = []
+        for k, parte in fallidas.items():
+            i = pendientes[k]
+            if parte.status == 0 or parte.status in STATUS_REINTENTABLES:
+                reintentar.append(i)
+                if parte.status == 0:
+                    dudosas.add(i)
+            else:
+                definitivas[i] = parte
+        pendientes = sorted(reintentar)
+        _actualizar(job_id, lease, intentos=intentos, error=error, lineas_creadas=json.dumps(sorted(creadas)))
+
+    if not pendientes and not definitivas:
+        _actualizar(job_id, lease, estado="completado", error=None)
+        logger.info(f"Job {job_id}: presupuesto {numero} completo ({len(lineas)} líneas, {intentos} intento/s)")
+        return True
+
+    sin_crear = sorted(set(pendientes) | set(definitivas))
+    detalle = [f"{lineas[i].get('articulo', '')}: {definitivas[i].status} {definitivas[i].motivo} "
+               f"{truncar(definitivas[i].cuerpo, 300)}".strip() if i in definitivas
+               else f"{lineas[i].get('articulo', '')}: reintentos agotados" for i in sin_crear]
+    error = f"{len(sin_crear)} de {len(lineas)} líneas sin crear en {numero}: {detalle}"
+    _actualizar(job_id, lease, estado="error", error=error)
+    enviar_correo_fallo("crear_presupuesto_batch",
+                        f"Presupuesto {numero} ({trabajo['referencia']}) incompleto tras {intentos} intento/s: {error}")
+    return False
+
+
+def procesar_trabajo(job_id: str, lease: Optional[str] = None):
+    """Ejecuta (o retoma) un trabajo del outbox. Se llama en un hilo del executor.
+
+    ``lease`` es el de ``encolar_presupuesto`` (trabajo insertado ya tomado); sin él
+    se toma el trabajo si está libre o su lease venció.
+    """
+    try:
+        lease = _reclamar(job_id, lease)
+        if not lease:
+            logger.info(f"Job {job_id}: terminado o tomado por otra corrida")
+            return
+        trabajo = obtener_trabajo(job_id)
+        trabajo["lease"] = lease
+        numero = trabajo["quotation_number"] or _crear_cabecera(trabajo)
+        if numero:
+            _crear_lineas(trabajo, numero)
+    except Exception as e:
+        logger.exception(f"Job {job_id}: error inesperado")
+        try:
+            if lease:
+                _actualizar(job_id, lease, estado="error", error=str(e))
+        except Exception:
+            logger.exception(f"Job {job_id}: no se pudo registrar el error")
+
+
+def reanudar_presupuestos_pendientes() -> int:
+    """Relanza los trabajos sin terminar cuyo lease venció (proceso caído, reinicio)."""
+    with conectar_db("misc") as conexion:
+        ids = [r[0] for r in conexion.execute(
+            "SELECT id FROM presupuestos_outbox WHERE estado NOT IN ('completado', 'error') "
+            "AND (tomado_hasta IS NULL OR tomado_hasta < ?)", (time.time(),)
+        )]
+    for job_id in ids:
+        _ejecutor().submit(procesar_trabajo, job_id)
+    if ids:
+        logger.info(f"Presupuestos pendientes retomados: {len(ids)}")
+    return len(ids)
+
+
+def estado_publico(trabajo: dict) -> dict:
+    """Vista del trabajo para el cliente (sin payloads)."""
+    return {
+        "job_id": trabajo["id"],
+        "status": trabajo["estado"],
+        "done": trabajo["estado"] in ESTADOS_FINALES,
+        "reference": trabajo["referencia"],
+        "quotation_number": trabajo["quotation_number"],
+        "lines_created": len(trabajo["lineas_creadas"]),
+        "lines_total": len(trabajo["lineas"]),
+        "attempts": trabajo["intentos"],
+        "error": trabajo["error"] if trabajo["estado"] == "error" else None,
+    }
@@ -0,0 +1,321 @@
+# services/registro_tablas.py
+"""
+Registro único (por proceso) de tablas Parquet en memoria.
+
+Todos los lectores (scheduler, vistas, services_gateway, caching) piden las
+tablas acá, así cada archivo se lee una sola vez por versión (mtime):
+
+- thread-safe, con un lock de carga por ruta (un solo hilo lee cada archivo);
+- contabiliza los bytes de cada tabla (``Table.nbytes``);
+- presupuesto de memoria configurable (``PARQUET_MEMORY_BUDGET_MB``) con
+  desalojo LRU de las tablas menos usadas;
+- métricas de aciertos, fallos, desalojos y tiempo de carga.
+
+Snapshots Arrow IPC: el scheduler escribe junto a cada Parquet un ``.arrow`` sin
+comprimir (``escribir_snapshot_arrow``). Si el snapshot corresponde al mtime
+actual del Parquet, el registro lo abre con ``pa.memory_map``: la tabla apunta a
+las páginas del page cache del SO, que comparten todos los workers de gunicorn,
+y no cuenta contra el presupuesto de memoria privada.
+
+Los índices en memoria (catálogo, stock, atributos) necesitan la tabla ordenada:
+su orden se registra con ``registrar_orden_snapshot`` y el snapshot se escribe ya
+ordenado, así los índices usan la tabla mapeada con slices sin copia.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from services.guarda_publicacion import verificar_publicacion
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+PARQUET_MEMORY_BUDGET_MB = int(os.getenv("PARQUET_MEMORY_BUDGET_MB", "2048"))
+# Cada cuánto se mira si apareció el snapshot de una tabla leída desde el Parquet
+SNAPSHOT_REVISION_SECS = float(os.getenv("SNAPSHOT_REVISION_SECS", "30"))
+
+
+# Metadato del snapshot con el mtime del Parquet del que se generó
+_META_ORIGEN = b"pos_origen_mtime"
+# Metadato presente si el snapshot se escribió con el orden registrado para su Parquet
+_META_ORDENADO = b"pos_ordenado"
+
+# Parquet -> función que ordena la tabla antes de volcarla al snapshot
+_ORDENES_SNAPSHOT: Dict[str, Callable[[pa.Table], pa.Table]] = {}
+
+
+def registrar_orden_snapshot(path: str, ordenar: Callable[[pa.Table], pa.Table]):
+    """El snapshot de ``path`` se escribirá como ``ordenar(tabla)`` (el orden de su índice)."""
+    _ORDENES_SNAPSHOT[os.path.abspath(path)] = ordenar
+
+
+def ruta_snapshot(path: str) -> str:
+    """``productos_cache.parquet`` -> ``productos_cache.arrow``."""
+    return os.path.splitext(path)[0] + ".arrow"
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _abrir_snapshot(path: str, mtime: float) -> Optional[pa.Table]:
+    """Tabla mapeada en memoria desde el snapshot, si es de la misma versión que el Parquet."""
+    snap = ruta_snapshot(path)
+    if not os.path.exists(snap):
+        return None
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(snap, "r"))
+        if (reader.schema.metadata or {}).get(_META_ORIGEN) != repr(mtime).encode():
+            return None
+        return reader.read_all()
+    except (OSError, pa.ArrowInvalid):
+        logger.warning(f"Snapshot Arrow ilegible, se usa el Parquet: {snap}", exc_info=True)
+        return None
+
+
+class _DiccionarioAcumulado:
+    """Diccionario único y creciente por columna para el snapshot.
+
+    El formato de archivo IPC solo admite un diccionario por campo (más deltas),
+    pero cada row group del Parquet trae el suyo: se re-codifican los índices
+    contra un diccionario que solo crece y se emiten deltas.
+    """
+
+    def __init__(self):
+        self.posiciones: Dict[object, int] = {}
+        self.valores: list = []
+
+    def recodificar(self, arr: pa.Array) -> pa.Array:
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        mapa = []
+        for valor in arr.dictionary.to_pylist():
+            pos = self.posiciones.get(valor)
+            if pos is None:
+                pos = self.posiciones[valor] = len(self.valores)
+                self.valores.append(valor)
+            mapa.append(pos)
+        indices = pa.array(mapa, type=arr.type.index_type).take(arr.indices)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.valores, type=arr.type.value_type))
+
+
+def _lotes_snapshot(path: str, tabla: Optional[pa.Table]):
+    """Lotes a volcar: la tabla en memoria o, sin ella, el Parquet row group por row group."""
+    if tabla is not None:
+        yield from tabla.to_batches()
+        return
+    parquet = pq.ParquetFile(path)
+    for i in range(parquet.num_row_groups):
+        yield from parquet.read_row_group(i).to_batches()
+
+
+def escribir_snapshot_arrow(path: str, tabla: Optional[pa.Table] = None) -> bool:
+    """Escribe (temporal + rename atómico) el snapshot Arrow IPC sin compresión del Parquet ``path``."""
+    mtime = _mtime(path)
+    if mtime is None:
+        return False
+    ordenar = _ORDENES_SNAPSHOT.get(os.path.abspath(path))
+    if ordenar is not None:
+        # Ordenar requiere la tabla entera (solo en el proceso que publica, una vez por versión)
+        tabla = ordenar(tabla if tabla is not None else pq.read_table(path))
+    schema = tabla.schema if tabla is not None else pq.read_schema(path)
+    meta = dict(schema.metadata or {})
+    meta[_META_ORIGEN] = repr(mtime).encode()
+    if ordenar is not None:
+        meta[_META_ORDENADO] = b"1"
+    schema = schema.with_metadata(meta)
+    diccionarios = {i: _DiccionarioAcumulado() for i, f in enumerate(schema) if pa.types.is_dictionary(f.type)}
+    opciones = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+
+    snap = ruta_snapshot(path)
+    tmp = f"{snap}.tmp"
+    filas = 0
+    try:
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema, options=opciones) as writer:
+            for lote in _lotes_snapshot(path, tabla):
+                columnas = [diccionarios[i].recodificar(col) if i in diccionarios else col
+                            for i, col in enumerate(lote.columns)]
+                writer.write_batch(pa.RecordBatch.from_arrays(columnas, schema=schema))
+                filas += lote.num_rows
+        verificar_publicacion(f"snapshot {os.path.basename(snap)}")
+        os.replace(tmp, snap)
+    except OSError:
+        # p. ej. en Windows, si otro proceso mantiene mapeado el snapshot anterior
+        logger.warning(f"No se pudo publicar el snapshot {snap}; se seguirá leyendo el Parquet", exc_info=True)
+        return False
+    finally:
+        # Sin publicar (error de E/S o PublicacionRechazada de un líder depuesto) no queda el temporal
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    logger.info(f"Snapshot Arrow escrito: {os.path.basename(snap)} ({filas} filas)")
+    return True
+
+
+def asegurar_snapshot_arrow(path: str) -> bool:
+    """Genera el snapshot solo si falta o quedó desactualizado respecto del Parquet."""
+    mtime = _mtime(path)
+    if mtime is None:
+        return False
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(ruta_snapshot(path), "r"))
+        meta = reader.schema.metadata or {}
+        ordenado = os.path.abspath(path) not in _ORDENES_SNAPSHOT or _META_ORDENADO in meta
+        if meta.get(_META_ORIGEN) == repr(mtime).encode() and ordenado:
+            return True
+    except (OSError, pa.ArrowInvalid):
+        pass
+    return escribir_snapshot_arrow(path)
+
+
+class _Entrada:
+    __slots__ = ("mtime", "tabla", "nbytes", "mapeada", "cargada", "revisada")
+
+    def __init__(self, mtime: float, tabla: pa.Table, mapeada: bool):
+        self.mtime = mtime
+        self.tabla = tabla
+        self.mapeada = mapeada
+        # Las tablas mapeadas viven en el page cache compartido, no en memoria privada
+        self.nbytes = 0 if mapeada else tabla.nbytes
+        self.cargada = time.time()
+        self.revisada = time.monotonic()
+
+
+class RegistroTablas:
+    """Caché LRU de ``pa.Table`` indexada por ruta y validada por mtime."""
+
+    def __init__(self, presupuesto_bytes: int):
+        self.presupuesto_bytes = presupuesto_bytes
+        self._lock = threading.Lock()
+        self._tablas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._cargando: Dict[str, threading.Lock] = {}
+        self._bytes = 0
+        self._metricas = {"hits": 0, "misses": 0, "evictions": 0, "loads": 0, "load_seconds": 0.0}
+
+    def _vigente(self, path: str, mtime: float) -> Optional[_Entrada]:
+        entrada = self._tablas.get(path)
+        if entrada is None or entrada.mtime != mtime:
+            return None
+        if not entrada.mapeada and time.monotonic() - entrada.revisada > SNAPSHOT_REVISION_SECS:
+            # Se leyó el Parquet antes de que el scheduler publicara el snapshot: pasar al mapeado.
+            # Se revisa cada tanto, no en cada acierto
+            entrada.revisada = time.monotonic()
+            if (_mtime(ruta_snapshot(path)) or 0) > entrada.cargada:
+                return None
+        self._tablas.move_to_end(path)
+        return entrada
+
+    def _quitar(self, path: str):
+        entrada = self._tablas.pop(path, None)
+        if entrada is not None:
+            self._bytes -= entrada.nbytes
+
+    def _desalojar(self, conservar: str):
+        for path in list(self._tablas):
+            if self._bytes <= self.presupuesto_bytes:
+                break
+            if path == conservar or self._tablas[path].mapeada:
+                continue
+            self._quitar(path)
+            self._metricas["evictions"] += 1
+            logger.info(f"Registro Parquet: desalojada {path} (en uso {self._bytes / 2**20:0.1f} MiB)")
+
+    def obtener(self, path: str) -> Optional[Tuple[float, pa.Table]]:
+        """Devuelve ``(mtime, tabla)`` de la versión actual del archivo, o None si no existe."""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            with self._lock:
+                self._quitar(path)
+            return None
+
+        with self._lock:
+            entrada = self._vigente(path, mtime)
+            if entrada is not None:
+                self._metricas["hits"] += 1
+                return entrada.mtime, entrada.tabla
+            carga = self._cargando.setdefault(path, threading.Lock())
+
+        with carga:
+            with self._lock:
+                entrada = self._vigente(path, mtime)
+                # Otro hilo la cargó mientras esperábamos: cuenta como acierto
+                self._metricas["hits" if entrada is not None else "misses"] += 1
+            if entrada is not None:
+                return entrada.mtime, entrada.tabla
+
+            t0 = time.perf_counter()
+            tabla = _abrir_snapshot(path, mtime)
+            mapeada = tabla is not None
+            if not mapeada:
+                tabla = pq.read_table(path)
+            segundos = time.perf_counter() - t0
+            entrada = _Entrada(mtime, tabla, mapeada)
+            with self._lock:
+                self._quitar(path)
+                self._tablas[path] = entrada
+                self._bytes += entrada.nbytes
+                self._metricas["loads"] += 1
+                self._metricas["load_seconds"] += segundos
+                self._desalojar(conservar=path)
+            origen = "snapshot mapeado" if mapeada else f"{tabla.nbytes / 2**20:0.1f} MiB"
+            logger.info(f"Registro Parquet: {os.path.basename(path)} cargado en {segundos:0.2f}s "
+                        f"({origen}, {tabla.num_rows} filas)")
+            return entrada.mtime, entrada.tabla
+
+    def invalidar(self, path: Optional[str] = None):
+        """Descarta una tabla (o todas); la próxima lectura la vuelve a cargar."""
+        with self._lock:
+            if path is None:
+                self._tablas.clear()
+                self._bytes = 0
+            else:
+                self._quitar(path)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            datos = dict(self._metricas)
+            datos.update({
+                "bytes": self._bytes,
+                "budget_bytes": self.presupuesto_bytes,
+                "tables": {os.path.basename(p): e.nbytes for p, e in self._tablas.items()},
+                "mapped": [os.path.basename(p) for p, e in self._tablas.items() if e.mapeada],
+            })
+        return datos
+
+
+registro_tablas = RegistroTablas(PARQUET_MEMORY_BUDGET_MB * 2**20)
+
+
+def obtener_tabla(path: str) -> Optional[pa.Table]:
+    """Tabla Parquet compartida del proceso (None si el archivo no existe)."""
+    res = registro_tablas.obtener(path)
+    return res[1] if res is not None else None
+
+
+def obtener_tabla_con_version(path: str) -> Optional[Tuple[float, pa.Table]]:
+    return registro_tablas.obtener(path)
+
+
+def invalidar_tabla(path: Optional[str] = None):
+    registro_tablas.invalidar(path)
+
+
+def publicar_tabla(path: str, tabla: Optional[pa.Table] = None):
+    """Tras escribir un Parquet: genera su snapshot Arrow (mmap) e invalida la copia en memoria."""
+    escribir_snapshot_arrow(path, tabla)
+    invalidar_tabla(path)
+
+
+def metricas_tablas() -> dict:
+    return registro_tablas.metricas()
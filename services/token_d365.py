@@ -0,0 +1,129 @@
+# services/token_d365.py
+"""
+Token de acceso a D365 en memoria del proceso, con renovación según su vencimiento.
+
+Antes cada request a D365 leía el token de ``misc`` en SQLite y un cron lo
+renovaba cada 10 minutos sin mirar ``expires_in``. Ahora:
+
+- el token y su vencimiento viven en memoria (``obtener_token_d365`` no toca SQLite
+  mientras el token esté vigente);
+- faltando ``TOKEN_D365_MARGEN_SECS`` para vencer se renueva: un solo hilo pide
+  el token nuevo (single-flight) y el resto sigue usando el vigente; si ya venció,
+  los demás esperan a ese único pedido;
+- antes de ir al endpoint OAuth se mira SQLite: si otro proceso ya lo renovó, se
+  usa ese. SQLite queda solo para compartir el token entre procesos;
+- si el endpoint OAuth falla se sigue con el token en memoria o, si no hay (proceso
+  recién iniciado), con el persistido en SQLite mientras no haya vencido;
+- ``AuthD365`` (auth del cliente httpx compartido) reintenta una vez ante 401 con
+  un token renovado.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from services.database import guardar_token_d365, leer_token_d365
+from services.get_token import solicitar_token_d365, TokenRetrievalError
+from services.logging_utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# Se renueva cuando faltan menos de estos segundos para el vencimiento
+TOKEN_D365_MARGEN_SECS = float(os.getenv("TOKEN_D365_MARGEN_SECS", "600"))
+
+
+class GestorTokenD365:
+    """Token D365 vigente en memoria con renovación single-flight."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expira = 0.0
+
+    def _vigente(self, margen: float = 0.0) -> bool:
+        return self._token is not None and time.time() < self._expira - margen
+
+    def _renovar(self, rechazado: Optional[str] = None) -> Optional[str]:
+        """Con el lock tomado: token persistido por otro proceso o uno nuevo del endpoint."""
+        token, expira = leer_token_d365()
+        if token and token != rechazado and expira and time.time() < expira - TOKEN_D365_MARGEN_SECS:
+            self._token, self._expira = token, expira
+            logger.info("Token D365 tomado de SQLite (renovado por otro proceso).")
+            return token
+        try:
+            token, expira = solicitar_token_d365()
+        except TokenRetrievalError:
+            if self._vigente() and self._token != rechazado:
+                logger.warning("No se pudo renovar el token D365; se sigue usando el vigente.")
+                return self._token
+            # Proceso recién iniciado (sin token en memoria): el persistido sirve mientras no venza
+            if token and token != rechazado and expira and time.time() < expira:
+                self._token, self._expira = token, expira
+                logger.warning("No se pudo renovar el token D365; se usa el persistido en SQLite hasta que venza.")
+                return token
+            return None
+        self._token, self._expira = token, expira
+        try:
+            guardar_token_d365(token, expira)
+        except Exception:
+            logger.exception("No se pudo persistir el token D365 (queda solo en memoria)")
+        logger.info(f"Token D365 renovado, vence en {expira - time.time():.0f}s")
+        return token
+
+    def obtener(self) -> Optional[str]:
+        """Token vigente, renovándolo si está por vencer. ``None`` si no hay forma de obtenerlo."""
+        if self._vigente(TOKEN_D365_MARGEN_SECS):
+            return self._token
+        if self._vigente():
+            # Por vencer pero todavía válido: renueva un solo hilo, el resto no espera
+            if not self._lock.acquire(blocking=False):
+                return self._token
+        else:
+            self._lock.acquire()
+        try:
+            if self._vigente(TOKEN_D365_MARGEN_SECS):
+                return self._token
+            return self._renovar()
+        finally:
+            self._lock.release()
+
+    def renovar_rechazado(self, rechazado: str) -> Optional[str]:
+        """Tras un 401 con ``rechazado``: token distinto (si otro hilo ya lo renovó) o uno nuevo."""
+        with self._lock:
+            if self._vigente() and self._token != rechazado:
+                return self._token
+            return self._renovar(rechazado)
+
+
+    def reiniciar_tras_fork(self):
+        # El lock pudo quedar tomado por un hilo que no existe en el hijo
+        self._lock = threading.Lock()
+
+
+gestor_token_d365 = GestorTokenD365()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=gestor_token_d365.reiniciar_tras_fork)
+
+
+def obtener_token_d365() -> Optional[str]:
+    return gestor_token_d365.obtener()
+
+
+class AuthD365(httpx.Auth):
+    """Reintenta una vez un request rechazado con 401, con el token renovado."""
+
+    async def async_auth_flow(self, request):
+        response = yield request
+        if response.status_code != 401:
+            return
+        rechazado = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        # La renovación es bloqueante (requests + SQLite): fuera del loop
+        token = await asyncio.to_thread(gestor_token_d365.renovar_rechazado, rechazado)
+        if not token or token == rechazado:
+            return
+        logger.info(f"401 de D365 en {request.method} {request.url.path}: reintento con token renovado")
+        request.headers["Authorization"] = f"Bearer {token}"
+        yield request
@@ -0,0 +1,12 @@
+# tests/__init__.py
+"""
+Tests unitarios de ``services`` (unittest; corren con ``python -m pytest tests``
+o ``python -m unittest discover tests``).
+
+La base SQLite única se resuelve al importar ``services.database``: antes de eso
+se apunta ``POS_SQLITE_PATH`` a un archivo temporal para no tocar ``pos.db``.
+"""
+import os
+import tempfile
+
+os.environ["POS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="pos_tests_"), "pos.db")
@@ -0,0 +1,49 @@
+import unittest
+
+import pyarrow as pa
+
+from services.busqueda_productos import IndiceBusquedaProductos, distancia_edicion, terminos
+from services.indice_productos import CatalogoIndex
+
+
+def _codigos(indice, query):
+    total, filas = indice.buscar(query)
+    return [indice.catalogo.table.column("numero_producto")[f].as_py() for f, _ in filas]
+
+
+class BusquedaProductosTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.indice = IndiceBusquedaProductos(CatalogoIndex(pa.table({
+            "Número de Producto": ["P1", "P2", "P3"],
+            "StoreNumber": ["T1", "T1", "T1"],
+            "Nombre del Producto": ["Cañería termofusión 20mm", "Llave de paso", "Pintura látex interior"],
+        })))
+
+    def test_terminos_sin_acentos(self):
+        self.assertEqual(terminos("Cañería TÉRMICA"), ["caneria", "termica"])
+
+    def test_exacto_y_prefijo(self):
+        self.assertEqual(_codigos(self.indice, "caneria"), ["P1"])
+        self.assertEqual(_codigos(self.indice, "pint lat"), ["P3"])
+
+    def test_palabra_corta_tolera_una_edicion(self):
+        self.assertEqual(_codigos(self.indice, "lleve"), ["P2"])
+        self.assertEqual(_codigos(self.indice, "lxeve"), [])
+
+    def test_palabra_larga_tolera_dos_borrados_de_un_mismo_lado(self):
+        # Dos letras de más en la consulta y dos de menos
+        self.assertEqual(_codigos(self.indice, "termofuxxsion"), ["P1"])
+        self.assertEqual(_codigos(self.indice, "termofsin"), ["P1"])
+
+    def test_palabra_larga_tolera_dos_sustituciones(self):
+        self.assertEqual(_codigos(self.indice, "tarmofusiin"), ["P1"])
+        self.assertEqual(_codigos(self.indice, "taxmofusiin"), [])
+
+    def test_distancia_con_transposicion_y_cota(self):
+        self.assertEqual(distancia_edicion("interior", "inetrior", 2), 1)
+        self.assertEqual(distancia_edicion("interior", "exterior", 1), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from services import database as db
+
+FILAS = [("P1", "Producto 1", "Color", "Rojo"), ("P2", "Producto 2", "Color", "Azul")]
+
+
+def _tablas():
+    with db.conectar_db("atributos") as conexion:
+        return {
+            r[0] for r in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'atributos%'")
+        }
+
+
+def _indices():
+    with db.conectar_db("atributos") as conexion:
+        return {
+            r[0] for r in conexion.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'atributos' AND sql IS NOT NULL"
+            )
+        }
+
+
+def _filas():
+    with db.conectar_db("atributos") as conexion:
+        return sorted(conexion.execute("SELECT product_number, attribute_value FROM atributos").fetchall())
+
+
+def _cargar(filas):
+    with db.carga_masiva("atributos", db.SQL_INSERT_ATRIBUTOS) as escribir_lote:
+        for fila in filas:
+            escribir_lote([fila])
+
+
+class CargaMasivaTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db.init_db()
+
+    def setUp(self):
+        _cargar(FILAS)
+
+    def test_publica_la_sombra_sin_dejar_restos(self):
+        _cargar([("P3", "Producto 3", "Talle", "M")])
+
+        self.assertEqual(_filas(), [("P3", "M")])
+        self.assertEqual(_tablas(), {"atributos"})
+        self.assertEqual(len(_indices()), 1)
+
+    def test_los_indices_alternan_de_nombre_en_cada_carga(self):
+        antes = _indices()
+        _cargar(FILAS)
+        despues = _indices()
+
+        self.assertEqual({db.nombre_indice_alterno(n) for n in antes}, despues)
+
+    def test_carga_vacia_no_reemplaza_la_tabla_publicada(self):
+        _cargar([])
+
+        self.assertEqual(_filas(), [("P1", "Rojo"), ("P2", "Azul")])
+        self.assertEqual(_tablas(), {"atributos"})
+
+    def test_error_durante_la_carga_descarta_la_sombra(self):
+        with self.assertRaises(RuntimeError):
+            with db.carga_masiva("atributos", db.SQL_INSERT_ATRIBUTOS) as escribir_lote:
+                escribir_lote([("P9", "Producto 9", "Color", "Verde")])
+                raise RuntimeError("extracción cortada")
+
+        self.assertEqual(_filas(), [("P1", "Rojo"), ("P2", "Azul")])
+        self.assertEqual(_tablas(), {"atributos"})
+
+    def test_vieja_sobrante_no_choca_con_los_indices_alternos(self):
+        # Simula un DROP de __vieja que falló tras publicar: sus índices tienen
+        # justo los nombres que la próxima sombra va a usar
+        with db.conectar_db("atributos") as conexion:
+            conexion.execute("CREATE TABLE atributos__vieja AS SELECT * FROM atributos")
+            for nombre in _indices():
+                conexion.execute(
+                    f"CREATE INDEX {db.nombre_indice_alterno(nombre)} ON atributos__vieja(product_number)"
+                )
+            conexion.commit()
+
+        _cargar([("P4", "Producto 4", "Color", "Negro")])
+
+        self.assertEqual(_filas(), [("P4", "Negro")])
+        self.assertEqual(_tablas(), {"atributos"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+
+from services import changelog_productos
+from services.delta_productos import calcular_cambios_productos
+
+
+def _catalogo(filas):
+    """Tabla de productos con nombres canónicos a partir de (producto, tienda, precio, nombre)."""
+    producto, tienda, precio, nombre = zip(*filas) if filas else ((), (), (), ())
+    return pa.table({
+        "numero_producto": pa.array(producto, type=pa.string()),
+        "store_number": pa.array(tienda, type=pa.string()),
+        "precio_final_con_iva": pa.array(precio, type=pa.float64()),
+        "nombre_producto": pa.array(nombre, type=pa.string()),
+    })
+
+
+class ChangelogTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.catalogo = os.path.join(self.dir.name, "productos_cache.parquet")
+        open(self.catalogo, "wb").close()
+        os.utime(self.catalogo, (4.0, 4.0))
+        for nombre, valor in (("CAMBIOS_PRODUCTOS_DIR", os.path.join(self.dir.name, "cambios")),
+                              ("CACHE_FILE_PRODUCTOS", self.catalogo)):
+            parche = mock.patch.object(changelog_productos, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        changelog_productos.limpiar_cache_cambios()
+        self.addCleanup(changelog_productos.limpiar_cache_cambios)
+        self.addCleanup(self.dir.cleanup)
+
+    def _registrar(self, desde, hasta, anterior, nuevo):
+        changelog_productos.registrar_cambios_productos(
+            calcular_cambios_productos(_catalogo(anterior), _catalogo(nuevo), desde, hasta))
+
+    def _registrar_historia(self):
+        v1 = [("A", "T1", 10.0, "Alfa"), ("B", "T1", 20.0, "Beta"), ("C", "T1", 30.0, "Gama")]
+        v2 = [("B", "T1", 21.0, "Beta"), ("C", "T1", 30.0, "Gama"), ("N", "T1", 5.0, "Nuevo")]
+        v3 = [("A", "T1", 11.0, "Alfa"), ("C", "T1", 30.0, "Gama"), ("N", "T1", 6.0, "Nuevo")]
+        v4 = [("A", "T1", 11.0, "Alfa"), ("C", "T1", 30.0, "Gama"), ("N", "T1", 7.0, "Nuevo")]
+        self._registrar(1.0, 2.0, v1, v2)
+        self._registrar(2.0, 3.0, v2, v3)
+        self._registrar(3.0, 4.0, v3, v4)
+
+    def test_compone_la_cadena_de_refrescos(self):
+        self._registrar_historia()
+
+        respuesta = changelog_productos.obtener_cambios_desde(1.0)
+
+        self.assertFalse(respuesta["full_resync"])
+        tienda = respuesta["stores"]["T1"]
+        # A: delete -> insert se informa como update (el cliente ya lo tenía)
+        # N: insert -> update sigue siendo insert, con la última versión de la fila
+        # B: update -> delete queda delete
+        self.assertEqual([f["numero_producto"] for f in tienda["inserted"]], ["N"])
+        self.assertEqual(tienda["inserted"][0]["precio_final_con_iva"], "7,00")
+        self.assertEqual([f["numero_producto"] for f in tienda["updated"]], ["A"])
+        self.assertEqual(tienda["updated"][0]["precio_final_con_iva"], "11,00")
+        self.assertEqual(tienda["deleted"], ["B"])
+
+    def test_desde_una_version_intermedia(self):
+        self._registrar_historia()
+
+        tienda = changelog_productos.obtener_cambios_desde(3.0)["stores"]["T1"]
+
+        self.assertEqual((tienda["inserted"], tienda["deleted"]), ([], []))
+        self.assertEqual([f["numero_producto"] for f in tienda["updated"]], ["N"])
+
+    def test_cadena_rota_pide_resincronizacion(self):
+        self._registrar_historia()
+        os.remove(os.path.join(changelog_productos.CAMBIOS_PRODUCTOS_DIR, "cambios_2000_3000.parquet"))
+
+        self.assertIsNone(changelog_productos._cadena(1000, 4000))
+        self.assertTrue(changelog_productos.obtener_cambios_desde(1.0)["full_resync"])
+        self.assertFalse(changelog_productos.obtener_cambios_desde(3.0)["full_resync"])
+
+    def test_cadena_rota_no_queda_cacheada(self):
+        # El worker ve la versión nueva antes de que exista el último eslabón
+        v1 = [("A", "T1", 10.0, "Alfa")]
+        v2 = [("A", "T1", 12.0, "Alfa")]
+        v3 = [("A", "T1", 15.0, "Alfa")]
+        self._registrar(1.0, 2.0, v1, v2)
+        self.assertTrue(changelog_productos.obtener_cambios_desde(1.0)["full_resync"])
+
+        self._registrar(2.0, 4.0, v2, v3)
+        respuesta = changelog_productos.obtener_cambios_desde(1.0)
+
+        self.assertFalse(respuesta["full_resync"])
+        self.assertEqual(respuesta["stores"]["T1"]["updated"][0]["precio_final_con_iva"], "15,00")
+
+    def test_cache_acotada_por_filas(self):
+        self._registrar_historia()
+        with mock.patch.object(changelog_productos, "CAMBIOS_CACHE_MAX_FILAS", 3):
+            changelog_productos.obtener_cambios_desde(1.0)
+            changelog_productos.obtener_cambios_desde(3.0)
+
+        self.assertLessEqual(changelog_productos._cache_filas, 3)
+        self.assertEqual(len(changelog_productos._cache), 1)
+
+    def test_version_al_dia_o_futura(self):
+        self._registrar_historia()
+
+        al_dia = changelog_productos.obtener_cambios_desde(4.0)
+        futura = changelog_productos.obtener_cambios_desde(9.0)
+
+        self.assertEqual((al_dia["full_resync"], al_dia["stores"]), (False, {}))
+        self.assertTrue(futura["full_resync"])
+
+    def test_filtra_por_tienda(self):
+        self._registrar(1.0, 2.0, [("A", "T1", 1.0, "Alfa")],
+                        [("A", "T1", 2.0, "Alfa"), ("A", "T2", 3.0, "Alfa")])
+        self._registrar(2.0, 4.0, [("A", "T1", 2.0, "Alfa"), ("A", "T2", 3.0, "Alfa")],
+                        [("A", "T1", 2.0, "Alfa"), ("A", "T2", 3.0, "Alfa")])
+
+        respuesta = changelog_productos.obtener_cambios_desde(1.0, store="T2")
+
+        self.assertEqual(list(respuesta["stores"]), ["T2"])
+        self.assertEqual(respuesta["stores"]["T2"]["inserted"][0]["store_number"], "T2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from services.cola_escritura import ColaEscritura, escribir
+
+
+def _crear_tabla(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+
+
+def _insertar(cursor, x):
+    cursor.execute("INSERT INTO t (x) VALUES (?)", (x,))
+    return x
+
+
+def _valores(path):
+    conexion = sqlite3.connect(path)
+    try:
+        return sorted(r[0] for r in conexion.execute("SELECT x FROM t"))
+    finally:
+        conexion.close()
+
+
+class ColaEscrituraTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cola.db")
+        escribir(self.path, _crear_tabla)
+        self.liberar = threading.Event()
+        self.en_curso = threading.Event()
+
+    def tearDown(self):
+        self.liberar.set()
+        self.dir.cleanup()
+
+    def _bloquear(self, cursor):
+        # Retiene el hilo escritor hasta que el test lo libere
+        self.en_curso.set()
+        self.liberar.wait(5)
+        return "bloqueo"
+
+    def test_trabajos_en_espera_se_confirman_en_un_solo_lote(self):
+        cola = ColaEscritura(self.path)
+        bloqueo = cola.enviar(self._bloquear)
+        self.assertTrue(self.en_curso.wait(5))
+        futures = [cola.enviar(_insertar, i) for i in range(10)]
+        self.liberar.set()
+
+        self.assertEqual(bloqueo.result(5), "bloqueo")
+        self.assertEqual([f.result(5) for f in futures], list(range(10)))
+        metricas = cola.metricas()
+        self.assertEqual(metricas["batches"], 2)
+        self.assertEqual(metricas["max_batch"], 10)
+        self.assertEqual(_valores(self.path), list(range(10)))
+
+    def test_un_trabajo_fallido_solo_revierte_su_savepoint(self):
+        def _fallar(cursor):
+            cursor.execute("INSERT INTO t (x) VALUES (99)")
+            raise ValueError("falla del trabajo")
+
+        cola = ColaEscritura(self.path)
+        cola.enviar(self._bloquear)
+        self.assertTrue(self.en_curso.wait(5))
+        antes = cola.enviar(_insertar, 1)
+        fallido = cola.enviar(_fallar)
+        despues = cola.enviar(_insertar, 2)
+        self.liberar.set()
+
+        self.assertEqual(antes.result(5), 1)
+        self.assertEqual(despues.result(5), 2)
+        with self.assertRaises(ValueError):
+            fallido.result(5)
+        self.assertEqual(_valores(self.path), [1, 2])
+        self.assertEqual(cola.metricas()["errors"], 1)
+
+    def test_timeout_en_cola_cancela_el_trabajo(self):
+        bloqueo = threading.Thread(target=escribir, args=(self.path, self._bloquear))
+        bloqueo.start()
+        self.assertTrue(self.en_curso.wait(5))
+        with self.assertRaises(sqlite3.OperationalError):
+            escribir(self.path, _insertar, 7, timeout=0.2)
+        self.liberar.set()
+        bloqueo.join(5)
+
+        escribir(self.path, _insertar, 8)
+        self.assertEqual(_valores(self.path), [8])
+
+    def test_timeout_con_el_trabajo_en_curso_espera_el_commit(self):
+        def _lento(cursor):
+            self.liberar.wait(0.5)
+            return _insertar(cursor, 5)
+
+        self.assertEqual(escribir(self.path, _lento, timeout=0.1), 5)
+        self.assertEqual(_valores(self.path), [5])
+
+    def test_escritura_anidada_desde_el_hilo_escritor(self):
+        def _anidada(cursor):
+            return escribir(self.path, _insertar, 1)
+
+        with self.assertRaises(RuntimeError):
+            escribir(self.path, _anidada)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import pyarrow as pa
+
+from services.delta_productos import calcular_cambios_productos
+
+
+def _catalogo(filas):
+    """Tabla de productos con nombres canónicos a partir de (producto, tienda, precio, nombre)."""
+    producto, tienda, precio, nombre = zip(*filas) if filas else ((), (), (), ())
+    return pa.table({
+        "numero_producto": pa.array(producto, type=pa.string()),
+        "store_number": pa.array(tienda, type=pa.string()),
+        "precio_final_con_iva": pa.array(precio, type=pa.float64()),
+        "nombre_producto": pa.array(nombre, type=pa.string()),
+    })
+
+
+class CalcularCambiosTests(unittest.TestCase):
+    def test_clasifica_agregados_modificados_eliminados_y_repreciados(self):
+        anterior = _catalogo([
+            ("A", "T1", 10.0, "Alfa"),
+            ("B", "T1", 20.0, "Beta"),
+            ("C", "T1", 30.0, "Gama"),
+            ("D", "T1", None, "Delta"),
+        ])
+        nuevo = _catalogo([
+            ("A", "T1", 10.0, "Alfa"),      # igual
+            ("B", "T1", 25.0, "Beta"),      # re-precio
+            ("D", "T1", None, "Delta II"),  # cambio de nombre (null == null en el precio)
+            ("E", "T1", 50.0, "Épsilon"),   # alta
+        ])
+
+        cambios = calcular_cambios_productos(anterior, nuevo, 1.0, 2.0)
+
+        self.assertEqual(cambios.agregados.column("numero_producto").to_pylist(), ["E"])
+        self.assertEqual(sorted(cambios.modificados.column("numero_producto").to_pylist()), ["B", "D"])
+        self.assertEqual(cambios.eliminados.column("numero_producto").to_pylist(), ["C"])
+        self.assertEqual(cambios.repreciados.column("numero_producto").to_pylist(), ["B"])
+        self.assertFalse(cambios.vacio)
+
+    def test_misma_clave_en_otra_tienda_es_otra_fila(self):
+        anterior = _catalogo([("A", "T1", 10.0, "Alfa")])
+        nuevo = _catalogo([("A", "T1", 10.0, "Alfa"), ("A", "T2", 10.0, "Alfa")])
+
+        cambios = calcular_cambios_productos(anterior, nuevo)
+
+        self.assertEqual(cambios.agregados.column("store_number").to_pylist(), ["T2"])
+        self.assertEqual(cambios.resumen(), {"agregados": 1, "modificados": 0, "eliminados": 0, "repreciados": 0})
+
+    def test_sin_version_anterior_todo_es_alta(self):
+        nuevo = _catalogo([("A", "T1", 10.0, "Alfa")])
+
+        cambios = calcular_cambios_productos(None, nuevo)
+
+        self.assertEqual(cambios.agregados.num_rows, 1)
+        self.assertEqual(cambios.eliminados.num_rows, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from decimal import Decimal
+
+import pyarrow as pa
+
+from services.formato_moneda import formatear_ars, formatear_columnas_ars, formatear_lista_ars, formatear_valor_ars
+
+
+class FormatoMonedaTests(unittest.TestCase):
+    def test_valor_puntual(self):
+        self.assertEqual(formatear_valor_ars(1234567.891), "1.234.567,89")
+
+    def test_columna_igual_al_formateo_por_valor(self):
+        valores = [0.0, 0.5, 999.999, 1000.0, -1234.5, 21548.195, 1e16, 12.345]
+
+        self.assertEqual(formatear_ars(pa.array(valores)).to_pylist(),
+                         [formatear_valor_ars(v) for v in valores])
+
+    def test_nulos_negativos_e_infinitos(self):
+        self.assertEqual(formatear_ars([None, -0.0, float("inf")]).to_pylist(), ["nan", "-0,00", "inf"])
+        self.assertEqual(formatear_lista_ars([0, -1.5, None, 1000]), ["0,00", "-1,50", "N/A", "1.000,00"])
+        self.assertEqual(formatear_lista_ars([]), [])
+
+    def test_decimales_se_redondean_en_decimal_medio_al_par(self):
+        valores = [Decimal("1234.565"), Decimal("2.675"), Decimal("-0.005"), None]
+
+        self.assertEqual(formatear_valor_ars(Decimal("1234.565")), "1.234,56")
+        self.assertEqual(formatear_ars(pa.array(valores, type=pa.decimal128(28, 6))).to_pylist(),
+                         ["1.234,56", "2,68", "-0,00", "nan"])
+        self.assertEqual(formatear_lista_ars(valores), ["1.234,56", "2,68", "-0,00", "N/A"])
+
+    def test_formatear_columnas(self):
+        tabla = pa.table({"precio": [1500.0, None], "codigo": ["A", "B"]})
+
+        salida = formatear_columnas_ars(tabla, ["precio", "inexistente"])
+
+        self.assertEqual(salida.column("precio").to_pylist(), ["1.500,00", "nan"])
+        self.assertEqual(salida.column_names, ["precio", "codigo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import pyarrow as pa
+
+from services.indice_atributos import IndiceAtributos, ordenar_atributos
+
+
+class IndiceAtributosTests(unittest.TestCase):
+    def setUp(self):
+        self.tabla = pa.table({
+            "ProductNumber": ["p2", "P1", "P1 ", "P3"],
+            "AttributeName": ["Color", "Talle", "Color", "Peso"],
+            "AttributeValue": ["Azul", "M", "Rojo", "1kg"],
+        })
+
+    def test_atributos_lote_con_claves_normalizadas(self):
+        indice = IndiceAtributos(self.tabla)
+
+        lote = indice.atributos_lote([" p1", "P2", "NO", "p1"])
+        self.assertEqual(list(lote), ["P1", "P2", "NO"])
+        self.assertEqual([a["AttributeName"] for a in lote["P1"]], ["Color", "Talle"])
+        self.assertEqual(lote["NO"], [])
+        self.assertEqual(indice.num_productos, 3)
+
+    def test_snapshot_ordenado_se_usa_sin_copia(self):
+        ordenada = ordenar_atributos(self.tabla)
+
+        self.assertIs(IndiceAtributos(ordenada).table, ordenada)
+
+
+if __name__ == "__main__":
+    unittest.main()
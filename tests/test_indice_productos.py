@@ -0,0 +1,66 @@
+import unittest
+
+import pyarrow as pa
+
+from services.indice_productos import CatalogoIndex, ordenar_catalogo
+from services.orden_tablas import aplicar_orden, rangos_ordenados
+
+
+class RangosOrdenadosTests(unittest.TestCase):
+    def test_tramos_de_una_columna_ordenada(self):
+        col = pa.chunked_array([["A", "A"], ["A", "B", "C", "C"]])
+
+        self.assertEqual(rangos_ordenados(col), {"A": (0, 3), "B": (3, 1), "C": (4, 2)})
+
+    def test_ignora_nulos_y_columna_vacia(self):
+        self.assertEqual(rangos_ordenados(pa.array(["A", None, None, "B"])), {"A": (0, 1), "B": (3, 1)})
+        self.assertEqual(rangos_ordenados(pa.array([], type=pa.string())), {})
+
+    def test_aplicar_orden_identidad_no_copia(self):
+        tabla = pa.table({"x": [1, 2, 3]})
+
+        self.assertIs(aplicar_orden(tabla, pa.array([0, 1, 2])), tabla)
+        self.assertEqual(aplicar_orden(tabla, pa.array([2, 0, 1])).column("x").to_pylist(), [3, 1, 2])
+
+
+class CatalogoIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tabla = pa.table({
+            "Número de Producto": ["X2", "X1", "X1", "X3"],
+            "StoreNumber": ["T2", "T1", "T2", "T1"],
+            "PrecioFinalConIVA": [2.0, 1.0, 1.5, 3.0],
+        })
+
+    def test_particiones_y_busqueda_por_clave(self):
+        indice = CatalogoIndex(self.tabla)
+
+        self.assertEqual(indice.tiendas(), ["T1", "T2"])
+        self.assertEqual(indice.tabla_tienda("T2").column("numero_producto").to_pylist(), ["X1", "X2"])
+        fila = indice.fila("X1", "T2")
+        self.assertEqual(indice.table.column("precio_final_con_iva")[fila].as_py(), 1.5)
+        self.assertIsNone(indice.fila("X3", "T2"))
+        self.assertEqual(indice.buscar("X1").column("store_number").to_pylist(), ["T1", "T2"])
+
+    def test_filas_repetidas_de_una_clave(self):
+        tabla = pa.table({
+            "Número de Producto": ["X1", "X2", "X1", "X1"],
+            "StoreNumber": ["T1", "T1", "T1", "T2"],
+            "PrecioFinalConIVA": [1.0, 2.0, 1.1, 1.2],
+        })
+        indice = CatalogoIndex(tabla)
+
+        self.assertEqual(sorted(indice.buscar("X1", "T1").column("precio_final_con_iva").to_pylist()), [1.0, 1.1])
+        self.assertEqual(indice.buscar("X1").num_rows, 3)
+        self.assertIn(indice.fila("X1", "T1"), indice.filas_producto("X1", "T1"))
+
+    def test_snapshot_ordenado_conserva_los_buffers(self):
+        ordenada = ordenar_catalogo(self.tabla).combine_chunks()
+        indice = CatalogoIndex(ordenada)
+
+        # Renombrar columnas crea otra Table pero sobre los mismos buffers
+        original = ordenada.column(0).chunk(0).buffers()[1].address
+        self.assertEqual(indice.table.column(0).chunk(0).buffers()[1].address, original)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+import pyarrow as pa
+
+from services.indice_stock import IndiceStock, ordenar_stock
+
+
+class IndiceStockTests(unittest.TestCase):
+    def setUp(self):
+        self.tabla = pa.table({
+            "codigo": [" b1", "A1", "a1 ", "B1", "C1"],
+            "almacen_365": ["ALM2", "alm2", "ALM1", "ALM1", "ALM1"],
+            "disponible_venta": [1.0, 0.0, 5.0, 2.0, 3.0],
+        })
+
+    def test_busqueda_exacta_normalizada(self):
+        indice = IndiceStock(self.tabla)
+
+        self.assertEqual(indice.buscar("a1").column("almacen_365").to_pylist(), ["ALM1", "alm2"])
+        self.assertEqual(indice.filas("A1", almacenes=["Alm2"]), [1])
+        self.assertEqual(indice.buscar("A").num_rows, 0)
+
+    def test_buscar_lote(self):
+        indice = IndiceStock(self.tabla)
+
+        lote = indice.buscar_lote(["b1", "A1", "ZZ", "b1"], almacenes=["alm1"])
+        self.assertEqual(lote.column("codigo").to_pylist(), ["B1", "a1 "])
+        disponibles = indice.buscar_lote(["A1"], solo_disponible=True)
+        self.assertEqual(disponibles.column("disponible_venta").to_pylist(), [5.0])
+
+    def test_snapshot_ordenado_se_usa_sin_copia(self):
+        ordenada = ordenar_stock(self.tabla)
+
+        self.assertIs(IndiceStock(ordenada).table, ordenada)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+from services.odata_batch import ParserBatch, parsear_batch, resultados_por_operacion, truncar
+
+CONTENT_TYPE = 'multipart/mixed; boundary="batchresponse_a1"'
+RESPUESTA = (
+    "--batchresponse_a1\r\n"
+    "Content-Type: multipart/mixed; boundary=changesetresponse_c1\r\n\r\n"
+    "--changesetresponse_c1\r\n"
+    "Content-Type: application/http\r\nContent-Transfer-Encoding: binary\r\nContent-ID: 1\r\n\r\n"
+    "HTTP/1.1 201 Created\r\nContent-Type: application/json; odata.metadata=minimal\r\n\r\n"
+    "{\"ok\":1}\r\n"
+    "--changesetresponse_c1--\r\n"
+    "--batchresponse_a1\r\n"
+    "Content-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n"
+    "HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\nContent-ID: 2\r\n\r\n"
+    "{\"error\":{\"message\":\"Item no existe\"}}\r\n"
+    "--batchresponse_a1\r\n"
+    "Content-Type: application/http\r\n\r\n"
+    "HTTP/1.1 503 Service Unavailable\r\n\r\n"
+    "{\"error\":\"busy\"}\r\n"
+    "--batchresponse_a1--\r\n"
+).encode()
+
+
+def _en_trozos(datos, tamanio):
+    return [datos[i:i + tamanio] for i in range(0, len(datos), tamanio)]
+
+
+class ParserBatchTests(unittest.TestCase):
+    def test_partes_con_trozos_que_cortan_lineas(self):
+        parser = ParserBatch(CONTENT_TYPE)
+        for trozo in _en_trozos(RESPUESTA, 7):
+            parser.alimentar(trozo)
+        partes = parser.terminar()
+
+        self.assertEqual([(p.grupo, p.content_id, p.status) for p in partes],
+                         [(0, "1", 201), (1, "2", 400), (2, None, 503)])
+        self.assertEqual(partes[1].motivo, "Bad Request")
+
+    def test_solo_guarda_el_cuerpo_de_los_errores(self):
+        partes = parsear_batch(CONTENT_TYPE, [RESPUESTA])
+
+        self.assertIsNone(partes[0].cuerpo)
+        self.assertEqual(partes[1].cuerpo, '{"error":{"message":"Item no existe"}}')
+        self.assertEqual(partes[2].cuerpo, '{"error":"busy"}')
+
+    def test_guardar_cuerpos_ok(self):
+        parser = ParserBatch(CONTENT_TYPE, guardar_cuerpos_ok=True)
+        parser.alimentar(RESPUESTA)
+
+        self.assertEqual(parser.terminar()[0].cuerpo, '{"ok":1}')
+
+    def test_sin_boundary(self):
+        with self.assertRaises(ValueError):
+            ParserBatch("application/json")
+
+
+class ResultadosPorOperacionTests(unittest.TestCase):
+    def test_asigna_cada_respuesta_a_su_operacion(self):
+        resultados = resultados_por_operacion(parsear_batch(CONTENT_TYPE, [RESPUESTA]),
+                                              [["1"], ["2"], ["3"], ["4"]])
+
+        self.assertEqual({cid: p.status for cid, p in resultados.items()},
+                         {"1": 201, "2": 400, "3": 503, "4": 0})
+        # Grupo sin Content-ID propio: el error del grupo se aplica a su operación
+        self.assertEqual(resultados["3"].cuerpo, '{"error":"busy"}')
+        self.assertEqual(resultados["4"].motivo, "Sin respuesta en el $batch")
+
+    def test_changeset_fallido_revierte_todas_sus_operaciones(self):
+        respuesta = (
+            "--batchresponse_a1\r\n"
+            "Content-Type: multipart/mixed; boundary=changesetresponse_c1\r\n\r\n"
+            "--changesetresponse_c1\r\n"
+            "Content-Type: application/http\r\nContent-ID: 2\r\n\r\n"
+            "HTTP/1.1 400 Bad Request\r\n\r\n{\"error\":\"linea 2\"}\r\n"
+            "--changesetresponse_c1--\r\n"
+            "--batchresponse_a1--\r\n"
+        ).encode()
+
+        resultados = resultados_por_operacion(parsear_batch(CONTENT_TYPE, [respuesta]), [["1", "2", "3"]])
+
+        self.assertEqual({cid: p.status for cid, p in resultados.items()}, {"1": 400, "2": 400, "3": 400})
+        self.assertEqual(resultados["1"].cuerpo, '{"error":"linea 2"}')
+
+
+class TruncarTests(unittest.TestCase):
+    def test_truncar(self):
+        self.assertEqual(truncar(None), "")
+        self.assertEqual(truncar("abc", 5), "abc")
+        self.assertEqual(truncar("abcdefgh", 3), "abc... (8 caracteres)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import gzip
+import json
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+
+from services import payload_productos
+from services.payload_productos import obtener_payload_productos
+
+
+class _Indice:
+    def __init__(self, version, filas=50):
+        self.version = version
+        self._tabla = pa.table({
+            "numero_producto": [f"P{i:05d}" for i in range(filas)],
+            "precio_final_con_iva": [float(i) * 1.37 for i in range(filas)],
+        })
+
+    def tabla_tienda(self, store):
+        return self._tabla
+
+
+class PayloadProductosTests(unittest.TestCase):
+    def setUp(self):
+        payload_productos.invalidar_payloads_productos()
+        self.addCleanup(payload_productos.invalidar_payloads_productos)
+
+    def test_solo_guarda_variantes_comprimidas(self):
+        payload = obtener_payload_productos(_Indice(1.0), "T1", 1, 10)
+
+        cuerpo, encoding = payload.cuerpo("")
+        self.assertIsNone(encoding)
+        self.assertEqual(len(json.loads(cuerpo)), 10)
+        self.assertEqual(len(cuerpo), payload.largo)
+        self.assertEqual(gzip.decompress(payload.cuerpo("gzip, deflate")[0]), cuerpo)
+        self.assertFalse(hasattr(payload, "raw"))
+
+    def test_cache_acotada_por_bytes(self):
+        indice = _Indice(1.0, filas=2000)
+        tamanio = obtener_payload_productos(indice, "T1", 1, 500).tamanio
+        payload_productos.invalidar_payloads_productos()
+
+        with mock.patch.object(payload_productos, "PAYLOAD_MAX_BYTES", int(tamanio * 2.5)):
+            for pagina in range(1, 5):
+                obtener_payload_productos(indice, "T1", pagina, 500)
+
+            self.assertEqual(list(payload_productos._payloads), [("T1", 3, 500), ("T1", 4, 500)])
+            self.assertLessEqual(payload_productos._bytes, payload_productos.PAYLOAD_MAX_BYTES)
+            self.assertEqual(payload_productos._bytes,
+                             sum(p.tamanio for p in payload_productos._payloads.values()))
+
+    def test_payload_mayor_al_presupuesto_no_se_cachea(self):
+        with mock.patch.object(payload_productos, "PAYLOAD_MAX_BYTES", 10):
+            obtener_payload_productos(_Indice(1.0), "T1", 1, 50)
+
+        self.assertEqual((len(payload_productos._payloads), payload_productos._bytes), (0, 0))
+
+    def test_if_none_match_compara_cada_etag_exacto(self):
+        payload = obtener_payload_productos(_Indice(1.0), "T1", 1, 10)
+        etag = payload.etag
+
+        self.assertTrue(payload.coincide(etag))
+        self.assertTrue(payload.coincide(f'"otro", W/{etag}'))
+        self.assertTrue(payload.coincide("*"))
+        self.assertFalse(payload.coincide(None))
+        self.assertFalse(payload.coincide(f'"x{etag[1:-1]}x"'))
+        self.assertFalse(payload.coincide(etag[:-2] + '"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import threading
+import unittest
+from unittest import mock
+
+from services import database as db
+from services import presupuestos_outbox as outbox
+from services.odata_batch import ParteBatch
+
+LINEAS = [{"articulo": "A1", "cantidad": 1}, {"articulo": "A2", "cantidad": 2}]
+
+
+def _tomado_por(job_id):
+    with db.conectar_db("misc") as conexion:
+        return conexion.execute("SELECT tomado_por FROM presupuestos_outbox WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def _robar_lease(job_id):
+    with db.conectar_db("misc") as conexion:
+        conexion.execute("UPDATE presupuestos_outbox SET tomado_por = 'otra-corrida' WHERE id = ?", (job_id,))
+        conexion.commit()
+
+
+class PresupuestosOutboxTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db.init_db()
+
+    def setUp(self):
+        for nombre, valor in (("obtener_token_d365", lambda: "token"),
+                              ("enviar_correo_fallo", lambda *a: None),
+                              ("_espera_backoff", lambda intento: 0)):
+            parche = mock.patch.object(outbox, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def _esperar(self, job_id):
+        for _ in range(200):
+            trabajo = outbox.obtener_trabajo(job_id)
+            if trabajo["estado"] in outbox.ESTADOS_FINALES:
+                return trabajo
+            threading.Event().wait(0.02)
+        self.fail(f"el trabajo {job_id} no terminó")
+
+    def test_trabajo_encolado_no_se_relanza_ni_se_reclama_en_el_mismo_proceso(self):
+        en_curso, liberar = threading.Event(), threading.Event()
+        cabeceras = []
+
+        def _cabecera(datos, referencia, token):
+            cabeceras.append(referencia)
+            en_curso.set()
+            liberar.wait(5)
+            return "PRES-1", None, False
+
+        with mock.patch.object(outbox, "run_crear_cabecera_presupuesto", _cabecera), \
+                mock.patch.object(outbox, "run_crear_lineas_presupuesto", lambda n, l, t: ({}, None)):
+            trabajo = outbox.encolar_presupuesto({"cliente": "C1"}, LINEAS, "vendedor@x")
+            self.assertTrue(en_curso.wait(5))
+
+            self.assertEqual(outbox.reanudar_presupuestos_pendientes(), 0)
+            outbox.procesar_trabajo(trabajo["id"])
+            liberar.set()
+            final = self._esperar(trabajo["id"])
+
+        self.assertEqual(len(cabeceras), 1)
+        self.assertEqual((final["estado"], final["quotation_number"]), ("completado", "PRES-1"))
+
+    def test_lease_perdido_detiene_los_reintentos(self):
+        llamadas = []
+
+        def _lineas(numero, lineas, token):
+            llamadas.append(len(lineas))
+            _robar_lease(trabajo["id"])
+            return {0: ParteBatch(grupo=0, content_id="1", status=503)}, "503"
+
+        with mock.patch.object(outbox, "run_crear_cabecera_presupuesto", lambda d, r, t: ("PRES-2", None, False)), \
+                mock.patch.object(outbox, "run_crear_lineas_presupuesto", _lineas), \
+                mock.patch.object(outbox, "_ejecutor") as ejecutor:
+            trabajo = outbox.encolar_presupuesto({"cliente": "C2"}, LINEAS, "vendedor@x")
+            job_id, lease = ejecutor.return_value.submit.call_args.args[1:]
+            outbox.procesar_trabajo(job_id, lease)
+
+        self.assertEqual(llamadas, [2])
+        final = outbox.obtener_trabajo(job_id)
+        self.assertEqual(final["estado"], "cabecera_creada")
+        self.assertEqual(_tomado_por(job_id), "otra-corrida")
+
+    def test_lease_vencido_se_puede_retomar(self):
+        with mock.patch.object(outbox, "_ejecutor"):
+            trabajo = outbox.encolar_presupuesto({"cliente": "C3"}, LINEAS, "vendedor@x")
+        self.assertIsNone(outbox._reclamar(trabajo["id"]))
+
+        with db.conectar_db("misc") as conexion:
+            conexion.execute("UPDATE presupuestos_outbox SET tomado_hasta = 0 WHERE id = ?", (trabajo["id"],))
+            conexion.commit()
+
+        self.assertTrue(outbox._reclamar(trabajo["id"]))
+
+    def test_requiere_usuario(self):
+        with self.assertRaises(ValueError):
+            outbox.encolar_presupuesto({"cliente": "C4"}, LINEAS, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
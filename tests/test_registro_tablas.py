@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from services import guarda_publicacion
+from services.registro_tablas import (
+    asegurar_snapshot_arrow,
+    escribir_snapshot_arrow,
+    obtener_tabla,
+    registrar_orden_snapshot,
+    ruta_snapshot,
+)
+
+
+class SnapshotArrowTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, "tabla.parquet")
+        pq.write_table(pa.table({"codigo": ["B", "A", "C"], "valor": [2, 1, 3]}), self.path)
+        self.addCleanup(guarda_publicacion.registrar_guarda, None)
+
+    def test_snapshot_ordenado_y_mapeado(self):
+        registrar_orden_snapshot(self.path, lambda t: t.sort_by("codigo"))
+
+        self.assertTrue(asegurar_snapshot_arrow(self.path))
+        self.assertTrue(os.path.exists(ruta_snapshot(self.path)))
+        self.assertEqual(obtener_tabla(self.path).column("codigo").to_pylist(), ["A", "B", "C"])
+
+    def test_lider_depuesto_no_deja_el_temporal(self):
+        guarda_publicacion.registrar_guarda(lambda: False)
+
+        with self.assertRaises(guarda_publicacion.PublicacionRechazada):
+            escribir_snapshot_arrow(self.path)
+
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ["tabla.parquet"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import time
+import unittest
+from unittest import mock
+
+from services import token_d365
+from services.get_token import TokenRetrievalError
+from services.token_d365 import GestorTokenD365
+
+
+def _oauth_caido():
+    # El constructor arma un JsonResponse, que necesita Django configurado
+    with mock.patch("services.get_token.JsonResponse"):
+        error = TokenRetrievalError("sin red")
+    raise error
+
+
+class GestorTokenD365Tests(unittest.TestCase):
+    def setUp(self):
+        parche = mock.patch.object(token_d365, "solicitar_token_d365", _oauth_caido)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def _persistido(self, token, expira):
+        parche = mock.patch.object(token_d365, "leer_token_d365", lambda: (token, expira))
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_oauth_caido_usa_el_persistido_vigente(self):
+        # Dentro del margen de renovación pero todavía válido
+        self._persistido("persistido", time.time() + 60)
+
+        self.assertEqual(GestorTokenD365().obtener(), "persistido")
+
+    def test_oauth_caido_no_usa_persistido_vencido_ni_rechazado(self):
+        self._persistido("persistido", time.time() - 1)
+        self.assertIsNone(GestorTokenD365().obtener())
+
+        self._persistido("persistido", time.time() + 60)
+        self.assertIsNone(GestorTokenD365().renovar_rechazado("persistido"))
+
+
+if __name__ == "__main__":
+    unittest.main()